@@ -0,0 +1,267 @@
+"""In-process stand-ins for instagrapi and google-genai, for load tests and local experiments.
+
+install() registers fake `instagrapi` (with its exceptions, extractors and
+config submodules), `google.genai` and `google.genai.types` modules, so main.py runs unchanged without network
+access or credentials. Each upstream round trip sleeps for a configurable
+latency and fails with a configurable probability:
+
+    FAKE_INSTAGRAM_LATENCY_MS=800  FAKE_INSTAGRAM_ERROR_RATE=0.02
+    FAKE_GEMINI_LATENCY_MS=400     FAKE_GEMINI_ERROR_RATE=0.01
+    FAKE_LATENCY_JITTER=0.5        # each call sleeps latency * uniform(1 - jitter, 1 + jitter)
+    FAKE_INSTAGRAM_CONFIGURE_DELAY_MS=3000  # photo_upload's fixed wait before configuring
+
+photo_upload does what instagrapi's does locally (re-encode the image, read its
+size, wait, then upload, configure and expose round trips), so the prepared
+upload path can be compared against it.
+
+install() must run before main (or anything importing instagrapi/genai) is imported.
+"""
+import os, sys, time, types, random, itertools, threading
+from io import BytesIO
+
+WORDS = ["golden", "hour", "harbour", "mist", "city", "lights", "quiet", "morning", "coast", "neon", "forest", "trail"]
+
+
+class UpstreamProfile:
+    """Latency and error rate of one fake upstream."""
+
+    def __init__(self, name, latency_ms, error_rate, jitter):
+        self.name = name
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.jitter = jitter
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, name, default_latency_ms, default_error_rate):
+        prefix = f"FAKE_{name.upper()}"
+        return cls(
+            name,
+            float(os.getenv(f"{prefix}_LATENCY_MS", default_latency_ms)),
+            float(os.getenv(f"{prefix}_ERROR_RATE", default_error_rate)),
+            float(os.getenv("FAKE_LATENCY_JITTER", 0.5))
+        )
+
+    def call(self, operation):
+        """Sleeps like a network round trip, then raises with probability error_rate."""
+        with self._lock:
+            self.calls += 1
+        delay = self.latency_ms / 1000 * random.uniform(1 - self.jitter, 1 + self.jitter)
+        time.sleep(max(delay, 0))
+        if random.random() < self.error_rate:
+            raise RuntimeError(f"Fake {self.name} error during {operation}")
+
+
+instagram = UpstreamProfile.from_env("instagram", 800, 0.0)
+gemini = UpstreamProfile.from_env("gemini", 400, 0.0)
+INSTAGRAM_CONFIGURE_DELAY = float(os.getenv("FAKE_INSTAGRAM_CONFIGURE_DELAY_MS", 3000)) / 1000
+
+
+# instagrapi
+class ClientError(Exception):
+    def __init__(self, message="", **kwargs):
+        super().__init__(message)
+
+
+class LoginRequired(ClientError):
+    pass
+
+
+class PhotoNotUpload(ClientError):
+    pass
+
+
+class PhotoConfigureError(ClientError):
+    pass
+
+
+class PhotoConfigureStoryError(PhotoConfigureError):
+    pass
+
+
+class FakeMedia:
+    _ids = itertools.count(1)
+
+    def __init__(self):
+        n = next(self._ids)
+        self.id = f"fake_{n}"
+        self.pk = n
+        self.code = f"FAKE{n:08d}"
+
+
+def extract_media_v1(media):
+    return types.SimpleNamespace(**media)
+
+
+class FakeAccount:
+    def __init__(self, username):
+        self.username = username
+        self.full_name = f"Fake {username}"
+        self.follower_count = 1000
+        self.following_count = 100
+        self.media_count = 42
+
+
+class FakeResponse:
+    status_code = 200
+    text = "{}"
+
+
+class FakeSession:
+    """A requests.Session that answers every request after one fake round trip."""
+
+    def get_adapter(self, url):
+        return types.SimpleNamespace(max_retries=0)
+
+    def mount(self, prefix, adapter):
+        pass
+
+    def post(self, url, data=None, headers=None, **kwargs):
+        instagram.call("rupload" if "rupload" in url else "post")
+        return FakeResponse()
+
+
+class FakeInstagramClient:
+    """The subset of instagrapi.Client used by main.py and src/."""
+
+    def __init__(self, settings=None, **kwargs):
+        self.username = None
+        self.settings = settings or {}
+        self.private = FakeSession()
+        self.public = FakeSession()
+        self.last_json = {}
+        self.last_response = None
+
+    def login(self, username, password, **kwargs):
+        instagram.call("login")
+        self.username = username
+        self.settings.setdefault("uuids", {"uuid": f"fake-{username}"})
+        return True
+
+    def get_settings(self):
+        return dict(self.settings)
+
+    def set_settings(self, settings):
+        self.settings = dict(settings)
+        return True
+
+    def set_uuids(self, uuids):
+        self.settings["uuids"] = uuids
+        return True
+
+    def load_settings(self, path):
+        return self.settings
+
+    def dump_settings(self, path):
+        return True
+
+    def get_timeline_feed(self):
+        instagram.call("get_timeline_feed")
+        return {"feed_items": []}
+
+    def account_info(self):
+        instagram.call("account_info")
+        return FakeAccount(self.username or "fake_user")
+
+    def request_log(self, response):
+        pass
+
+    def expose(self):
+        instagram.call("expose")
+        return {}
+
+    def _configure(self, operation):
+        instagram.call(operation)
+        media = FakeMedia()
+        self.last_json = {"status": "ok", "media": {"id": media.id, "pk": media.pk, "code": media.code}}
+        return self.last_json
+
+    def photo_configure(self, upload_id, width, height, caption, *args, **kwargs):
+        return self._configure("photo_configure")
+
+    def photo_configure_to_story(self, upload_id, width, height, caption, *args, **kwargs):
+        return self._configure("photo_configure_to_story")
+
+    def _upload(self, path, configure):
+        from PIL import Image
+
+        # instagrapi's prepare_image() re-encodes the file, then photo_rupload opens it again for its size
+        with Image.open(path) as im:
+            im.save(BytesIO(), "JPEG")
+        with Image.open(path) as im:
+            width, height = im.size
+        self.private.post("https://i.instagram.com/rupload_igphoto/fake")
+        time.sleep(INSTAGRAM_CONFIGURE_DELAY)
+        configure(str(int(time.time() * 1000)), width, height, "")
+        self.expose()
+        return extract_media_v1(self.last_json["media"])
+
+    def photo_upload(self, path, caption, **kwargs):
+        return self._upload(path, self.photo_configure)
+
+    def photo_upload_to_story(self, path, caption=None, **kwargs):
+        return self._upload(path, self.photo_configure_to_story)
+
+
+# google-genai
+class FakeGenerateContentResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeModels:
+    def generate_content(self, model, contents, **kwargs):
+        gemini.call("generate_content")
+        words = " ".join(random.sample(WORDS, 4))
+        return FakeGenerateContentResponse(f"{words.capitalize()} #fake #caption")
+
+
+class FakeGenaiClient:
+    def __init__(self, api_key=None, http_options=None, **kwargs):
+        self.models = FakeModels()
+
+
+class FakeHttpOptions:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def install():
+    """Registers the fake SDK modules in sys.modules."""
+    instagrapi = types.ModuleType("instagrapi")
+    instagrapi.__version__ = "2.1.5"
+    instagrapi.Client = FakeInstagramClient
+    exceptions = types.ModuleType("instagrapi.exceptions")
+    for error in (ClientError, LoginRequired, PhotoNotUpload, PhotoConfigureError, PhotoConfigureStoryError):
+        setattr(exceptions, error.__name__, error)
+    extractors = types.ModuleType("instagrapi.extractors")
+    extractors.extract_media_v1 = extract_media_v1
+    config = types.ModuleType("instagrapi.config")
+    config.API_DOMAIN = "i.instagram.com"
+    for module in (exceptions, extractors, config):
+        setattr(instagrapi, module.__name__.rsplit(".", 1)[1], module)
+        sys.modules[module.__name__] = module
+    sys.modules["instagrapi"] = instagrapi
+
+    try:
+        import google
+    except ImportError:
+        google = types.ModuleType("google")
+        google.__path__ = []
+        sys.modules["google"] = google
+    genai = types.ModuleType("google.genai")
+    genai.Client = FakeGenaiClient
+    genai_types = types.ModuleType("google.genai.types")
+    genai_types.HttpOptions = FakeHttpOptions
+    genai.types = genai_types
+    google.genai = genai
+    sys.modules["google.genai"] = genai
+    sys.modules["google.genai.types"] = genai_types
+
+
+def stats():
+    return {
+        profile.name: {"calls": profile.calls, "latency_ms": profile.latency_ms, "error_rate": profile.error_rate}
+        for profile in (instagram, gemini)
+    }
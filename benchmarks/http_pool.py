@@ -0,0 +1,143 @@
+"""Connection pooling benchmark against a local mock upstream.
+
+Starts a keep-alive HTTP server that charges a simulated TCP+TLS handshake on
+every new connection, then compares a fresh session per call (what
+generate_caption and login_to_instagram used to do) with the shared pools in
+src/http_pool.py, for both requests (instagrapi) and httpx (google-genai).
+
+    python benchmarks/http_pool.py [--calls 200] [--threads 8] [--handshake-ms 60] [--json]
+"""
+import os, sys, json, time, logging, argparse, threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+import requests
+
+from src import http_pool
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+class MockUpstream(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    handshake_s = 0.0
+    latency_s = 0.0
+    connections = 0
+    lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        with MockUpstream.lock:
+            MockUpstream.connections += 1
+        time.sleep(self.handshake_s)
+
+    def do_GET(self):
+        time.sleep(self.latency_s)
+        body = b'{"status": "ok"}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_upstream(handshake_ms, latency_ms):
+    MockUpstream.handshake_s = handshake_ms / 1000
+    MockUpstream.latency_s = latency_ms / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockUpstream)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/"
+
+
+def fresh_requests(url):
+    with requests.Session() as session:
+        session.get(url).raise_for_status()
+
+
+def pooled_requests_session():
+    class FakeInstagramClient:
+        private = requests.Session()
+        public = requests.Session()
+
+    return http_pool.configure_instagram_client(FakeInstagramClient()).private
+
+
+def fresh_httpx(url):
+    with httpx.Client() as client:
+        client.get(url).raise_for_status()
+
+
+def run(label, fn, url, calls, threads):
+    MockUpstream.connections = 0
+    samples = []
+
+    def call(_):
+        started = time.perf_counter()
+        fn(url)
+        samples.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(call, range(calls)))
+    elapsed = time.perf_counter() - started
+    samples.sort()
+    return {
+        "client": label,
+        "total_s": round(elapsed, 3),
+        "mean_ms": round(sum(samples) / len(samples) * 1000, 2),
+        "p95_ms": round(samples[int(len(samples) * 0.95) - 1] * 1000, 2),
+        "connections_opened": MockUpstream.connections
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--handshake-ms", type=float, default=60, help="simulated TCP+TLS setup per new connection")
+    parser.add_argument("--latency-ms", type=float, default=5, help="simulated server time per request")
+    parser.add_argument("--json", action="store_true", help="print a machine-readable report")
+    args = parser.parse_args()
+
+    server, url = start_upstream(args.handshake_ms, args.latency_ms)
+    pooled_session = pooled_requests_session()
+    pooled_httpx = httpx.Client(**http_pool.gemini_client_args())
+    try:
+        results = [
+            run("requests, session per call", fresh_requests, url, args.calls, args.threads),
+            run("requests, shared pool", lambda u: pooled_session.get(u).raise_for_status(), url, args.calls, args.threads),
+            run("httpx, client per call", fresh_httpx, url, args.calls, args.threads),
+            run("httpx, shared pool", lambda u: pooled_httpx.get(u).raise_for_status(), url, args.calls, args.threads),
+        ]
+    finally:
+        pooled_httpx.close()
+        server.shutdown()
+
+    report = {
+        "calls": args.calls,
+        "threads": args.threads,
+        "handshake_ms": args.handshake_ms,
+        "latency_ms": args.latency_ms,
+        "results": results,
+        "pool_stats": http_pool.stats()
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"{args.calls} calls on {args.threads} threads, {args.handshake_ms:.0f}ms handshake, {args.latency_ms:.0f}ms upstream latency")
+    print(f"{'client':<28}{'total':>10}{'mean':>11}{'p95':>11}{'conns':>8}")
+    for r in results:
+        print(f"{r['client']:<28}{r['total_s']:>9.2f}s{r['mean_ms']:>9.2f}ms{r['p95_ms']:>9.2f}ms{r['connections_opened']:>8}")
+
+
+if __name__ == "__main__":
+    main()
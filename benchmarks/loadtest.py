@@ -0,0 +1,383 @@
+"""Load test: drive a mixed workload at a target request rate against fake Instagram and Gemini backends.
+
+Starts the app under uvicorn in a scratch directory with the fakes from
+benchmarks/fake_backends.py, logs in, seeds input images, then sends an
+open-loop schedule of requests to /upload, /process, /process/batch,
+/instagram/post/next, /images/processed and /mcp. Latency is measured from
+each request's scheduled start, so a saturated server shows up as queueing
+delay instead of a lower offered rate.
+
+    python benchmarks/loadtest.py [--rate 20] [--duration 30] [--mix upload=2,process=3,...]
+                                  [--instagram-latency-ms 800] [--gemini-error-rate 0.01] [--output report.json]
+
+The report (--json or --output) holds throughput, p50/p95/p99 latency and
+error rates per endpoint and overall.
+"""
+import os, sys, json, time, random, shutil, socket, asyncio, argparse, tempfile, subprocess
+from collections import Counter
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_MIX = "upload=2,process=3,batch=1,post_next=1,processed=3,mcp=2"
+OPERATIONS = ("upload", "process", "batch", "post_next", "processed", "mcp")
+
+
+def serve(port):
+    """Runs the app with the fake SDKs installed (the server side of the harness)."""
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, BENCHMARKS)
+    import fake_backends
+
+    fake_backends.install()
+
+    import uvicorn
+    import main
+
+    uvicorn.run(main.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise SystemExit(f"Unknown operation in --mix: {name} (available: {', '.join(OPERATIONS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def source_jpeg(size):
+    """A photo-sized JPEG; every upload appends unique trailing bytes so the result cache never hits."""
+    from io import BytesIO
+    from PIL import Image, ImageDraw
+
+    width, height = size
+    img = Image.new("RGB", (width, height))
+    draw = ImageDraw.Draw(img)
+    for i in range(0, width, 40):
+        draw.rectangle([i, 0, i + 20, height], fill=(i % 256, (i * 3) % 256, 180))
+    buffer = BytesIO()
+    img.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def percentile(sorted_samples, p):
+    if not sorted_samples:
+        return None
+    index = max(int(round(p / 100 * len(sorted_samples))) - 1, 0)
+    return sorted_samples[min(index, len(sorted_samples) - 1)]
+
+
+def summarize(samples, errors, error_kinds, duration):
+    latencies = sorted(samples)
+    requests = len(latencies)
+    ms = lambda s: round(s * 1000, 2) if s is not None else None
+    return {
+        "requests": requests,
+        "errors": errors,
+        "error_rate": round(errors / requests, 4) if requests else None,
+        "error_kinds": dict(error_kinds),
+        "throughput_rps": round((requests - errors) / duration, 2),
+        "latency_ms": {
+            "p50": ms(percentile(latencies, 50)),
+            "p95": ms(percentile(latencies, 95)),
+            "p99": ms(percentile(latencies, 99)),
+            "max": ms(latencies[-1] if latencies else None),
+            "mean": ms(sum(latencies) / requests if requests else None)
+        }
+    }
+
+
+class LoadTest:
+    def __init__(self, args, base_url, client):
+        self.args = args
+        self.base_url = base_url
+        self.client = client
+        self.image = source_jpeg(args.image_size)
+        self.inputs = []
+        self.counter = 0
+        self.results = {name: {"samples": [], "errors": 0, "kinds": Counter()} for name in OPERATIONS}
+        self.skipped = Counter()
+
+    def unique_image(self):
+        self.counter += 1
+        name = f"load_{os.getpid()}_{self.counter}.jpg"
+        return name, self.image + os.urandom(16)
+
+    async def upload(self):
+        name, body = self.unique_image()
+        resp = await self.client.post("/upload", files={"file": (name, body, "image/jpeg")})
+        if resp.status_code == 200:
+            self.inputs.append(name)
+        return resp, None
+
+    async def process(self):
+        if not self.inputs:
+            return None, "no_input"
+        resp = await self.client.post("/process", json={"filename": self.inputs.pop(0), "renditions": self.args.renditions})
+        return resp, lambda body: body.get("success")
+
+    async def batch(self):
+        if len(self.inputs) < self.args.batch_size:
+            return None, "no_input"
+        filenames = [self.inputs.pop(0) for _ in range(self.args.batch_size)]
+        resp = await self.client.post("/process/batch", json={"filenames": filenames, "renditions": self.args.renditions})
+        return resp, lambda body: body.get("failed") == 0
+
+    async def post_next(self):
+        resp = await self.client.post("/instagram/post/next")
+        return resp, lambda body: body.get("success")
+
+    async def processed(self):
+        resp = await self.client.get("/images/processed")
+        return resp, None
+
+    async def mcp(self):
+        resp = await self.client.post("/mcp", json={
+            "jsonrpc": "2.0", "id": str(self.counter), "method": "tools/call",
+            "params": {"name": "get_processed_images", "arguments": {}}
+        })
+        return resp, lambda body: body.get("error") is None
+
+    async def run_one(self, name, scheduled):
+        try:
+            resp, check = await getattr(self, name)()
+        except Exception as e:
+            self.record(name, scheduled, f"exception:{type(e).__name__}")
+            return
+        if resp is None:
+            self.skipped[f"{name}:{check}"] += 1
+            return
+        if resp.status_code >= 400:
+            self.record(name, scheduled, f"http_{resp.status_code}")
+        elif check and not check(resp.json()):
+            self.record(name, scheduled, "app_error")
+        else:
+            self.record(name, scheduled, None)
+
+    def record(self, name, scheduled, error):
+        result = self.results[name]
+        result["samples"].append(time.perf_counter() - scheduled)
+        if error:
+            result["errors"] += 1
+            result["kinds"][error] += 1
+
+    async def seed(self, mix):
+        """Uploads enough inputs for the scheduled process/batch calls, and a posting backlog for post_next."""
+        total = self.args.rate * self.args.duration
+        weight = sum(mix.values())
+        expected = lambda name: int(total * mix.get(name, 0) / weight * 1.2) + 1
+        needed = expected("process") + expected("batch") * self.args.batch_size
+        backlog = expected("post_next")
+
+        semaphore = asyncio.Semaphore(16)
+
+        async def seeded(fn):
+            async with semaphore:
+                return await fn()
+
+        await asyncio.gather(*(seeded(self.upload) for _ in range(needed + backlog)))
+        backlog_inputs = [self.inputs.pop() for _ in range(min(backlog, len(self.inputs)))]
+        await asyncio.gather(*(
+            seeded(lambda filename=filename: self.client.post("/process", json={"filename": filename}))
+            for filename in backlog_inputs
+        ))
+
+    async def run(self, mix):
+        rng = random.Random(self.args.seed)
+        names = list(mix)
+        weights = [mix[name] for name in names]
+        count = int(self.args.rate * self.args.duration)
+
+        tasks = []
+        started = time.perf_counter()
+        offset = 0.0
+        for _ in range(count):
+            if self.args.arrivals == "poisson":
+                offset += rng.expovariate(self.args.rate)
+            else:
+                offset += 1 / self.args.rate
+            scheduled = started + offset
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            name = rng.choices(names, weights)[0]
+            tasks.append(asyncio.create_task(self.run_one(name, scheduled)))
+        await asyncio.gather(*tasks)
+        return time.perf_counter() - started
+
+
+async def drive(args, base_url):
+    import httpx
+
+    mix = parse_mix(args.mix)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=args.timeout) as client:
+        login = await client.post("/instagram/login", json={"username": "loadtest", "password": "loadtest"})
+        if not login.json().get("success"):
+            raise SystemExit(f"Fake login failed: {login.text}")
+
+        test = LoadTest(args, base_url, client)
+        seed_started = time.perf_counter()
+        await test.seed(mix)
+        seed_s = time.perf_counter() - seed_started
+
+        elapsed = await test.run(mix)
+        health = (await client.get("/health")).json()
+
+    endpoints = {
+        name: summarize(result["samples"], result["errors"], result["kinds"], elapsed)
+        for name, result in test.results.items() if result["samples"]
+    }
+    all_samples = [s for result in test.results.values() for s in result["samples"]]
+    all_kinds = sum((result["kinds"] for result in test.results.values()), Counter())
+    return {
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "config": {
+            "rate": args.rate,
+            "duration_s": args.duration,
+            "arrivals": args.arrivals,
+            "mix": mix,
+            "batch_size": args.batch_size,
+            "renditions": args.renditions,
+            "image_size": list(args.image_size),
+            "concurrency": args.concurrency,
+            "instagram": {"latency_ms": args.instagram_latency_ms, "error_rate": args.instagram_error_rate, "configure_delay_ms": args.instagram_configure_delay_ms},
+            "gemini": {"latency_ms": args.gemini_latency_ms, "error_rate": args.gemini_error_rate},
+            "jitter": args.jitter,
+            "server_env": dict(args.server_env)
+        },
+        "seed_s": round(seed_s, 2),
+        "elapsed_s": round(elapsed, 2),
+        "overall": summarize(all_samples, sum(r["errors"] for r in test.results.values()), all_kinds, elapsed),
+        "endpoints": endpoints,
+        "skipped": dict(test.skipped),
+        "server": {"admission": health.get("admission")}
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def start_server(args, workdir, port):
+    env = dict(
+        os.environ,
+        PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""),
+        GEMINI_API_KEY="fake",
+        STATE_BACKEND="memory",
+        FAKE_INSTAGRAM_LATENCY_MS=str(args.instagram_latency_ms),
+        FAKE_INSTAGRAM_ERROR_RATE=str(args.instagram_error_rate),
+        FAKE_INSTAGRAM_CONFIGURE_DELAY_MS=str(args.instagram_configure_delay_ms),
+        FAKE_GEMINI_LATENCY_MS=str(args.gemini_latency_ms),
+        FAKE_GEMINI_ERROR_RATE=str(args.gemini_error_rate),
+        FAKE_LATENCY_JITTER=str(args.jitter)
+    )
+    env.update(args.server_env)
+    log = open(os.path.join(workdir, "server.log"), "wb")
+    proc = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve", str(port)],
+        cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    return proc, log
+
+
+async def wait_for_health(base_url, proc, timeout=60):
+    import httpx
+
+    deadline = time.perf_counter() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.perf_counter() < deadline:
+            if proc.poll() is not None:
+                raise SystemExit("Server exited during startup; see server.log in the work directory")
+            try:
+                if (await client.get("/health")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                await asyncio.sleep(0.05)
+    raise SystemExit(f"/health did not answer within {timeout}s")
+
+
+def print_report(report):
+    config = report["config"]
+    print(f"{config['rate']} req/s offered for {config['duration_s']}s ({config['arrivals']} arrivals), "
+          f"instagram {config['instagram']['latency_ms']:.0f}ms/{config['instagram']['error_rate']:.0%} err, "
+          f"gemini {config['gemini']['latency_ms']:.0f}ms/{config['gemini']['error_rate']:.0%} err")
+    print(f"{'endpoint':<12}{'reqs':>7}{'ok/s':>9}{'err%':>8}{'p50':>11}{'p95':>11}{'p99':>11}")
+    rows = list(report["endpoints"].items()) + [("overall", report["overall"])]
+    for name, r in rows:
+        latency = r["latency_ms"]
+        print(f"{name:<12}{r['requests']:>7}{r['throughput_rps']:>9.2f}{r['error_rate'] * 100:>7.1f}%"
+              f"{latency['p50']:>9.1f}ms{latency['p95']:>9.1f}ms{latency['p99']:>9.1f}ms")
+    if report["skipped"]:
+        print(f"skipped (no seeded input left): {report['skipped']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--serve", type=int, metavar="PORT", help=argparse.SUPPRESS)
+    parser.add_argument("--rate", type=float, default=20, help="offered requests per second")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of scheduled arrivals")
+    parser.add_argument("--arrivals", choices=("constant", "poisson"), default="poisson")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"operation weights (default: {DEFAULT_MIX})")
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--renditions", type=lambda s: s.split(","), default=None, help="e.g. feed,story")
+    parser.add_argument("--image-size", type=lambda s: tuple(int(v) for v in s.split("x")), default=(1600, 1200))
+    parser.add_argument("--concurrency", type=int, default=256, help="max open client connections")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--instagram-latency-ms", type=float, default=800, help="per Instagram API round trip")
+    parser.add_argument("--instagram-configure-delay-ms", type=float, default=3000, help="photo_upload's fixed wait before configuring")
+    parser.add_argument("--instagram-error-rate", type=float, default=0.0)
+    parser.add_argument("--gemini-latency-ms", type=float, default=400)
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.5, help="upstream latency varies by +/- this fraction")
+    parser.add_argument("--server-env", action="append", default=[], type=lambda s: tuple(s.split("=", 1)),
+                        metavar="KEY=VALUE", help="extra server environment, e.g. PIXEL_BUDGET_BYTES=200000000")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    parser.add_argument("--keep-workdir", action="store_true")
+    parser.add_argument("--json", action="store_true", help="print a machine-readable report")
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve)
+        return
+
+    workdir = tempfile.mkdtemp(prefix="gramgateway-load-")
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    proc, log = start_server(args, workdir, port)
+    try:
+        asyncio.run(wait_for_health(base_url, proc))
+        report = asyncio.run(drive(args, base_url))
+    finally:
+        proc.terminate()
+        proc.wait()
+        log.close()
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Post handler timing with and without prepared-post records.
+
+Renders images through process_single_image, strips the prepared-post record
+from half of them, then times instagram_post_handler on each half against the
+fake Instagram client from benchmarks/fake_backends.py. Without a record the
+handler rebuilds the caption and goes through photo_upload, which re-encodes
+the image, reopens it for its size and waits before configuring, as
+instagrapi does. With a record it verifies the checksum, sends the stored
+bytes and waits the same delay (PREPARED_CONFIGURE_DELAY) before configuring.
+
+    python benchmarks/post_prepared.py [--posts 5] [--latency-ms 150] [--configure-delay-ms 3000] [--json]
+"""
+import os, sys, json, time, shutil, asyncio, argparse, tempfile, statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+
+
+def source_image(path, index):
+    from PIL import Image, ImageDraw
+
+    img = Image.new("RGB", (3000, 2000), (30, 60 + index % 100, 120))
+    ImageDraw.Draw(img).rectangle([index, index, 1500, 1000], fill=(200, 180, 40))
+    img.save(path, format="JPEG", quality=92)
+
+
+def strip_record(storage, name):
+    """Re-stores name without its prepared-post record, like an image processed before records existed."""
+    entry = storage.info(name)
+    metadata = {key: value for key, value in entry["metadata"].items() if key != "prepared"}
+    with storage.writing(name, metadata) as tmp_path:
+        with storage.reading(name) as path:
+            shutil.copyfile(path, tmp_path)
+
+
+async def run(args):
+    import main
+    from src.storage import get_storage
+
+    main.instagram_client = main.configure_instagram_client(sys.modules["instagrapi"].Client())
+    input_storage = get_storage("input_images")
+    pics_storage = get_storage("pics")
+
+    processed = []
+    for i in range(args.posts * 2):
+        filename = f"bench_{i}.jpg"
+        with input_storage.writing(filename) as path:
+            source_image(path, i)
+        result = await main.process_single_image({"filename": filename, "custom_caption": f"Benchmark frame {i}"})
+        processed.append(result["processed_filename"])
+
+    legacy, prepared = processed[:args.posts], processed[args.posts:]
+    for name in legacy:
+        strip_record(pics_storage, name)
+
+    timings = {}
+    for label, names in (("without_record", legacy), ("with_record", prepared)):
+        samples = []
+        for name in names:
+            started = time.perf_counter()
+            result = await main.instagram_post_handler({"filename": name})
+            samples.append(time.perf_counter() - started)
+            if not result.get("success"):
+                raise SystemExit(f"Posting {name} failed: {result.get('error')}")
+        timings[label] = {
+            "median_ms": round(statistics.median(samples) * 1000, 1),
+            "mean_ms": round(statistics.mean(samples) * 1000, 1),
+            "min_ms": round(min(samples) * 1000, 1)
+        }
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--posts", type=int, default=5, help="posts timed on each path")
+    parser.add_argument("--latency-ms", type=float, default=150, help="fake Instagram latency per API round trip")
+    parser.add_argument("--configure-delay-ms", type=float, default=3000, help="instagrapi's wait before configuring")
+    parser.add_argument("--json", action="store_true", help="print a machine-readable report")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="gramgateway-post-")
+    os.environ.update(
+        STATE_BACKEND="memory",
+        STARTUP_PREWARM="false",
+        RESULT_CACHE_ENABLED="false",
+        FAKE_INSTAGRAM_LATENCY_MS=str(args.latency_ms),
+        FAKE_INSTAGRAM_CONFIGURE_DELAY_MS=str(args.configure_delay_ms),
+        PREPARED_CONFIGURE_DELAY=str(args.configure_delay_ms / 1000),
+        FAKE_LATENCY_JITTER="0"
+    )
+    sys.path[:0] = [ROOT, BENCHMARKS]
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        import fake_backends
+
+        fake_backends.install()
+        timings = asyncio.run(run(args))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "posts": args.posts,
+        "latency_ms": args.latency_ms,
+        "configure_delay_ms": args.configure_delay_ms,
+        **timings,
+        "speedup": round(timings["without_record"]["median_ms"] / timings["with_record"]["median_ms"], 2)
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"{args.posts} posts per path, {args.latency_ms:.0f}ms per Instagram round trip, {args.configure_delay_ms:.0f}ms configure delay")
+    print(f"{'path':<16}{'median':>11}{'mean':>11}{'min':>11}")
+    for label in ("without_record", "with_record"):
+        t = timings[label]
+        print(f"{label:<16}{t['median_ms']:>9.1f}ms{t['mean_ms']:>9.1f}ms{t['min_ms']:>9.1f}ms")
+    print(f"speedup {report['speedup']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
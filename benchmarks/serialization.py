@@ -0,0 +1,112 @@
+"""Serialization benchmark for large /images/processed listings and MCP tools/call results.
+
+Compares FastAPI's default path (jsonable_encoder + JSONResponse, and for MCP
+json.dumps + MCPResponse validation + jsonable_encoder) with what the app runs:
+the /images/processed route handler itself, fed the payload in place of a
+storage listing, and the fast path in src/serialization.py for MCP.
+
+    python benchmarks/serialization.py [--images 10000] [--repeat 20] [--json]
+"""
+import os, sys, json, time, asyncio, argparse, statistics
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from src.models import MCPResponse
+from src.serialization import FAST_JSON, mcp_response, mcp_text_result
+
+
+def listing_payload(count):
+    """A get_processed_images() result with count images."""
+    now = datetime(2025, 1, 1)
+    images = [
+        {
+            "filename": f"Golden_hour_over_the_harbour_number_{i}.jpg",
+            "size": 350_000 + i,
+            "created": (now + timedelta(seconds=i)).isoformat(),
+            "modified": (now + timedelta(seconds=i)).isoformat(),
+            "posted": i % 3 == 0,
+            "renditions": ["feed", "story"] if i % 2 else ["feed"]
+        }
+        for i in range(count)
+    ]
+    posted = sum(1 for image in images if image["posted"])
+    return {
+        "processed_images": images,
+        "total_count": count,
+        "posted_count": posted,
+        "unposted_count": count - posted
+    }
+
+
+def default_rest(payload):
+    return JSONResponse(jsonable_encoder(payload)).body
+
+
+def route_rest(payload):
+    """The body /images/processed answers with, produced by the route handler itself."""
+    import main
+
+    async def listing():
+        return payload
+
+    main.get_processed_images = listing
+    return ROUTE_LOOP.run_until_complete(main.list_processed_images()).body
+
+
+ROUTE_LOOP = asyncio.new_event_loop()
+
+
+def default_mcp(payload):
+    response = MCPResponse(id="1", result={"content": [{"type": "text", "text": json.dumps(payload, indent=2)}]})
+    return JSONResponse(jsonable_encoder(response)).body
+
+
+def fast_mcp(payload):
+    return mcp_response("1", result=mcp_text_result(payload)).body
+
+
+def time_call(fn, payload, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(payload)
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--json", action="store_true", help="print a machine-readable report")
+    args = parser.parse_args()
+
+    payload = listing_payload(args.images)
+    report = {"images": args.images, "fast_json": FAST_JSON}
+    for name, default_fn, fast_fn in (("rest_listing", default_rest, route_rest), ("mcp_tools_call", default_mcp, fast_mcp)):
+        default_s = time_call(default_fn, payload, args.repeat)
+        fast_s = time_call(fast_fn, payload, args.repeat)
+        report[name] = {
+            "default_ms": round(default_s * 1000, 2),
+            "fast_ms": round(fast_s * 1000, 2),
+            "speedup": round(default_s / fast_s, 2),
+            "bytes": len(fast_fn(payload))
+        }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"{args.images} images, fast path {'on' if FAST_JSON else 'off (orjson missing or FAST_JSON=false)'}")
+    print(f"{'payload':<16}{'default':>12}{'fast':>12}{'speedup':>10}")
+    for name in ("rest_listing", "mcp_tools_call"):
+        r = report[name]
+        print(f"{name:<16}{r['default_ms']:>10.2f}ms{r['fast_ms']:>10.2f}ms{r['speedup']:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Startup benchmark: import time of main.py and time to the first /health response.
+
+Compares STARTUP_MODE=eager (everything imported before serving, the old
+behaviour) with STARTUP_MODE=lazy.
+
+    python benchmarks/startup.py [--runs 5] [--json]
+"""
+import os, sys, json, time, socket, argparse, statistics, subprocess, urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def mode_env(mode):
+    env = dict(os.environ, STARTUP_MODE=mode, PYTHONDONTWRITEBYTECODE="1")
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    return env
+
+
+def measure_import(mode):
+    """Seconds spent importing main in a fresh interpreter."""
+    out = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET],
+        cwd=ROOT, env=mode_env(mode), capture_output=True, text=True, check=True
+    )
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def measure_first_health(mode, timeout=60):
+    """Seconds from spawning uvicorn until /health first answers 200."""
+    port = free_port()
+    url = f"http://127.0.0.1:{port}/health"
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=mode_env(mode), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                with urllib.request.urlopen(url, timeout=1) as resp:
+                    if resp.status == 200:
+                        return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.01)
+        raise TimeoutError(f"/health did not answer within {timeout}s in {mode} mode")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def summarize(samples):
+    return {
+        "median_s": round(statistics.median(samples), 4),
+        "min_s": round(min(samples), 4),
+        "max_s": round(max(samples), 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="print a machine-readable report")
+    args = parser.parse_args()
+
+    report = {}
+    for mode in ("eager", "lazy"):
+        report[mode] = {
+            "import": summarize([measure_import(mode) for _ in range(args.runs)]),
+            "first_health": summarize([measure_first_health(mode) for _ in range(args.runs)]),
+        }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"{'mode':<8}{'import (median)':>18}{'first /health (median)':>26}")
+    for mode, result in report.items():
+        print(f"{mode:<8}{result['import']['median_s']:>17.3f}s{result['first_health']['median_s']:>25.3f}s")
+
+
+if __name__ == "__main__":
+    main()
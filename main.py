@@ -1,38 +1,42 @@
-import os, json, logging, uvicorn
-from typing import Dict, Any, Optional
+import os, time, asyncio, logging, importlib, uvicorn
+from email.utils import formatdate
+from typing import TYPE_CHECKING, Dict, Any, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import FileResponse, HTMLResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request, Header, Depends
+from fastapi.responses import FileResponse, HTMLResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi_mcp import FastApiMCP
-
-# Instagram imports
-from instagrapi import Client
-from instagrapi.exceptions import LoginRequired
-
-from src.process_image import (
-    generate_caption, 
-    remove_hashtags, 
-    sanitize_filename, 
-    add_watermark, 
-    get_orientation, 
-    resize_and_center,
-    INSTAGRAM_SIZES
-)
+
+# Heavy SDKs (instagrapi, google-genai, Pillow, fastapi_mcp) are imported on first use
+if TYPE_CHECKING:
+    from instagrapi import Client
+
 from src.poster import (
     load_posted_pics,
     save_posted_pic,
-    HASHTAGS
+    HASHTAGS,
+    POST_LOCK_TTL
 )
 
+from src.state import get_state, ledger_key, LockNotAcquired
+from src.storage import get_storage
+from src.admission import AdmissionRejected, estimate_footprint, pixel_budget
+from src.assets import asset_cache
+from src.http_pool import configure_instagram_client, stats as http_pool_stats
+from src.prepared_post import PreparedPostMismatch, build_record, prepared_record, rupload_supported, upload_prepared
+from src.uploads import PROCESS_QUEUE, UPLOAD_MAX_CHUNK, UPLOAD_SWEEP_INTERVAL, UploadError, upload_manager
+from src.profiling import PROFILING_ENABLED, PROFILING_INTERVAL_MS, ProfilingMiddleware, check_admin_token, profile_store, start_session
+from src.scheduler import SCHEDULER_ENABLED, SCHEDULER_TICK_INTERVAL, SchedulerError, scheduler
+from src.result_cache import RESULT_CACHE_ENABLED, content_digest, result_cache, result_key, reserve_output_name
+
 # import Pydantic models for MCP protocol
-from src.models import MCPRequest, MCPResponse, ImageProcessRequest, BatchProcessRequest, InstagramLoginRequest, InstagramPostRequest
+from src.models import MCPRequest, ImageProcessRequest, BatchProcessRequest, UploadCreateRequest, UploadFinalizeRequest, InstagramLoginRequest, InstagramPostRequest, SchedulerAccountRequest, ScheduleEntryUpdate
+from src.serialization import JSONResponseClass, json_response, mcp_response, mcp_text_result
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s - %(message)s')
@@ -42,7 +46,8 @@ logger = logging.getLogger(__name__)
 app = FastAPI(
     title="MCP Image Processing & Instagram Server",
     description="A Model Context Protocol server for image processing and Instagram posting",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=JSONResponseClass
 )
 
 # Add CORS middleware
@@ -54,8 +59,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Mount static files
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Per-request profiling (X-Profile: 1 plus X-Admin-Token); not installed at all unless PROFILING_ADMIN_TOKEN is set
+if PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
 
 # Ensure directories exist
 os.makedirs("input_images", exist_ok=True)
@@ -65,6 +71,36 @@ os.makedirs("static", exist_ok=True)
 
 # Global Instagram client
 instagram_client = None
+# Clients of other logged-in accounts, keyed by username (scheduled posts pick their account)
+account_clients: Dict[str, "Client"] = {}
+
+# "lazy" defers heavy imports until first use, "eager" loads everything before serving
+STARTUP_MODE = os.getenv("STARTUP_MODE", "lazy").lower()
+# In lazy mode, warm heavy imports in the background once the server is up
+STARTUP_PREWARM = os.getenv("STARTUP_PREWARM", "true").lower() in ("1", "true", "yes")
+STARTUP_PREWARM_DELAY = float(os.getenv("STARTUP_PREWARM_DELAY", 1.0))
+
+# Processing jobs queued by finalized uploads; every worker runs this many consumers
+PROCESS_QUEUE_WORKERS = int(os.getenv("PROCESS_QUEUE_WORKERS", 2))
+PROCESS_QUEUE_POLL_INTERVAL = float(os.getenv("PROCESS_QUEUE_POLL_INTERVAL", 1.0))
+
+# Renditions rendered when a request doesn't ask for specific ones (feed, story, reel_cover)
+DEFAULT_RENDITIONS = [r.strip() for r in os.getenv("DEFAULT_RENDITIONS", "feed").split(",") if r.strip()]
+# reel_cover is only used as the cover of a reel upload, never posted on its own
+POSTABLE_RENDITIONS = ["feed", "story"]
+
+HEAVY_MODULES = [
+    "PIL.Image",
+    "src.process_image",
+    "google.genai",
+    "instagrapi",
+    "instagrapi.exceptions",
+]
+
+mcp = None
+
+# Futures for results currently being produced, keyed by content hash
+pending_results: Dict[str, asyncio.Future] = {}
 
 USERNAME = os.getenv("IG_USERNAME")
 PASSWORD = os.getenv("IG_PASSWORD")
@@ -72,54 +108,96 @@ PASSWORD = os.getenv("IG_PASSWORD")
 
 
 # Instagram helper functions
-def login_to_instagram(username: str, password: str) -> Client:
+def login_to_instagram(username: str, password: str) -> "Client":
     """Login to Instagram and return authenticated client"""
-    cl = Client()
-    session_file = "session.json"
-    session = None
+    from instagrapi import Client
+    from instagrapi.exceptions import LoginRequired
+
+    cl = configure_instagram_client(Client())
+    state = get_state()
     login_via_session = False
     login_via_pw = False
     
-    # Try session login first
-    if os.path.exists(session_file) and os.path.getsize(session_file) > 0:
-        logger.debug("Session file found, attempting session login...")
-        try:
-            session = cl.load_settings(session_file)
-            cl.set_settings(session)
-            cl.login(username, password)
-            
-            # Test if session is valid
+    # Serialize logins across workers so they don't overwrite each other's session
+    with state.lock(f"login:{username}", ttl=120, wait=60):
+        session = state.get_session(username)
+        
+        # Try session login first
+        if session:
+            logger.debug("Stored session found, attempting session login...")
             try:
-                cl.get_timeline_feed()
-                login_via_session = True
-                logger.info("Logged in via session.")
-            except LoginRequired:
-                logger.warning("Session invalid, trying re-login...")
-                old_session = cl.get_settings()
-                cl.set_settings({})
-                cl.set_uuids(old_session.get("uuids", {}))
+                cl.set_settings(session)
                 cl.login(username, password)
-                login_via_session = True
-                logger.info("Re-logged in via session.")
-        except Exception as e:
-            logger.error(f"Session login failed: {e}")
+                
+                # Test if session is valid
+                try:
+                    cl.get_timeline_feed()
+                    login_via_session = True
+                    logger.info("Logged in via session.")
+                except LoginRequired:
+                    logger.warning("Session invalid, trying re-login...")
+                    old_session = cl.get_settings()
+                    cl.set_settings({})
+                    cl.set_uuids(old_session.get("uuids", {}))
+                    cl.login(username, password)
+                    login_via_session = True
+                    logger.info("Re-logged in via session.")
+            except Exception as e:
+                logger.error(f"Session login failed: {e}")
+        
+        # Try password login if session failed
+        if not login_via_session:
+            logger.debug("Attempting login via username and password...")
+            try:
+                cl.set_settings({})
+                if cl.login(username, password):
+                    login_via_pw = True
+                    logger.info("Logged in via username and password.")
+            except Exception as e:
+                logger.error(f"Password login failed: {e}")
+                raise Exception(f"Password login failed: {e}")
+        
+        if not login_via_pw and not login_via_session:
+            raise Exception("Couldn't login user with either password or session")
+        
+        state.save_session(username, cl.get_settings())
+        state.set_value("instagram:active_user", username)
     
-    # Try password login if session failed
-    if not login_via_session:
-        logger.debug("Attempting login via username and password...")
-        try:
-            cl.set_settings({})
-            if cl.login(username, password):
-                cl.dump_settings(session_file)
-                login_via_pw = True
-                logger.info("Logged in via username and password.")
-        except Exception as e:
-            logger.error(f"Password login failed: {e}")
-            raise Exception(f"Password login failed: {e}")
+    return cl
+
+def get_instagram_client(username: Optional[str] = None) -> Optional["Client"]:
+    """Return this worker's Instagram client, restoring it from the shared session store if another worker logged in
+    
+    With a username, returns that account's client instead; any account that has logged in once has a stored session.
+    """
+    global instagram_client
     
-    if not login_via_pw and not login_via_session:
-        raise Exception("Couldn't login user with either password or session")
+    if username is None and instagram_client is not None:
+        return instagram_client
+    if username is not None:
+        if instagram_client is not None and instagram_client.username == username:
+            return instagram_client
+        if username in account_clients:
+            return account_clients[username]
     
+    state = get_state()
+    active = username is None
+    if active:
+        username = state.get_value("instagram:active_user")
+    session = state.get_session(username) if username else None
+    if not session:
+        return None
+    
+    from instagrapi import Client
+    
+    cl = configure_instagram_client(Client())
+    cl.set_settings(session)
+    cl.username = username
+    if active:
+        instagram_client = cl
+    else:
+        account_clients[username] = cl
+    logger.info(f"Restored Instagram session for {username} from shared state")
     return cl
 
 
@@ -129,8 +207,8 @@ async def mcp_handler(request: MCPRequest):
     """Main MCP protocol handler"""
     try:
         if request.method == "initialize":
-            return MCPResponse(
-                id=request.id,
+            return mcp_response(
+                request.id,
                 result={
                     "protocolVersion": "2024-11-05",
                     "capabilities": {
@@ -146,8 +224,8 @@ async def mcp_handler(request: MCPRequest):
             )
         
         elif request.method == "tools/list":
-            return MCPResponse(
-                id=request.id,
+            return mcp_response(
+                request.id,
                 result={
                     "tools": [
                         {
@@ -159,7 +237,8 @@ async def mcp_handler(request: MCPRequest):
                                     "filename": {"type": "string", "description": "Name of the image file to process"},
                                     "custom_caption": {"type": "string", "description": "Optional custom caption"},
                                     "watermark_text": {"type": "string", "description": "Watermark text"},
-                                    "watermark_opacity": {"type": "integer", "description": "Watermark opacity (0-255)"}
+                                    "watermark_opacity": {"type": "integer", "description": "Watermark opacity (0-255)"},
+                                    "renditions": {"type": "array", "items": {"type": "string", "enum": ["feed", "story", "reel_cover"]}, "description": "Renditions to render from one decode (default: feed)"}
                                 },
                                 "required": ["filename"]
                             }
@@ -172,7 +251,8 @@ async def mcp_handler(request: MCPRequest):
                                 "properties": {
                                     "filenames": {"type": "array", "items": {"type": "string"}},
                                     "watermark_text": {"type": "string"},
-                                    "watermark_opacity": {"type": "integer"}
+                                    "watermark_opacity": {"type": "integer"},
+                                    "renditions": {"type": "array", "items": {"type": "string", "enum": ["feed", "story", "reel_cover"]}}
                                 },
                                 "required": ["filenames"]
                             }
@@ -196,7 +276,9 @@ async def mcp_handler(request: MCPRequest):
                                 "type": "object",
                                 "properties": {
                                     "filename": {"type": "string", "description": "Name of the processed image file to post"},
-                                    "custom_caption": {"type": "string", "description": "Optional custom caption (overrides filename-based caption)"}
+                                    "custom_caption": {"type": "string", "description": "Optional custom caption (overrides filename-based caption)"},
+                                    "rendition": {"type": "string", "enum": ["feed", "story"], "description": "Which rendition to post: feed post (default) or story"},
+                                    "username": {"type": "string", "description": "Logged-in account to post from (default: the last account that logged in)"}
                                 },
                                 "required": ["filename"]
                             }
@@ -206,7 +288,9 @@ async def mcp_handler(request: MCPRequest):
                             "description": "Post the next unposted image from the processed folder",
                             "inputSchema": {
                                 "type": "object",
-                                "properties": {}
+                                "properties": {
+                                    "rendition": {"type": "string", "enum": ["feed", "story"], "description": "Which rendition to post (default: feed)"}
+                                }
                             }
                         },
                         {
@@ -226,6 +310,59 @@ async def mcp_handler(request: MCPRequest):
                             "name": "get_posted_images",
                             "description": "Get list of images that have been posted to Instagram",
                             "inputSchema": {"type": "object", "properties": {}}
+                        },
+                        {
+                            "name": "scheduler_get_plan",
+                            "description": "Get the posting schedule: accounts, upcoming posts and recent history",
+                            "inputSchema": {
+                                "type": "object",
+                                "properties": {
+                                    "limit": {"type": "integer", "description": "Upcoming posts and history entries to return (default: 50)"}
+                                }
+                            }
+                        },
+                        {
+                            "name": "scheduler_set_account",
+                            "description": "Create or update an account's posting schedule; omitted fields keep their current value",
+                            "inputSchema": {
+                                "type": "object",
+                                "properties": {
+                                    "username": {"type": "string", "description": "Instagram account (must have logged in once)"},
+                                    "slots": {"type": "array", "items": {"type": "string"}, "description": "Daily slots, \"HH:MM\" or engagement windows \"HH:MM-HH:MM\""},
+                                    "daily_quota": {"type": "integer", "description": "Most posts per day"},
+                                    "min_spacing_minutes": {"type": "integer", "description": "Minimum time between two posts"},
+                                    "jitter_minutes": {"type": "integer", "description": "Random offset around HH:MM slots"},
+                                    "rendition": {"type": "string", "enum": ["feed", "story"]},
+                                    "timezone": {"type": "string", "description": "IANA timezone of the slots (default: SCHEDULER_TIMEZONE)"},
+                                    "enabled": {"type": "boolean"},
+                                    "remove": {"type": "boolean", "description": "Remove the account's schedule instead"}
+                                },
+                                "required": ["username"]
+                            }
+                        },
+                        {
+                            "name": "scheduler_update_entry",
+                            "description": "Move, swap the image of, or cancel one planned post",
+                            "inputSchema": {
+                                "type": "object",
+                                "properties": {
+                                    "entry_id": {"type": "string"},
+                                    "run_at": {"type": "string", "description": "New ISO 8601 time, in the account's timezone unless it has an offset"},
+                                    "filename": {"type": "string", "description": "Processed image to post instead"},
+                                    "cancel": {"type": "boolean", "description": "Keep the slot empty; the image returns to the backlog"}
+                                },
+                                "required": ["entry_id"]
+                            }
+                        },
+                        {
+                            "name": "scheduler_replan",
+                            "description": "Drop the upcoming posts of one account (or all) and plan them again from the backlog",
+                            "inputSchema": {
+                                "type": "object",
+                                "properties": {
+                                    "username": {"type": "string"}
+                                }
+                            }
                         }
                     ]
                 }
@@ -244,31 +381,46 @@ async def mcp_handler(request: MCPRequest):
             elif tool_name == "instagram_post":
                 result = await instagram_post_handler(arguments)
             elif tool_name == "instagram_post_next":
-                result = await instagram_post_next_handler()
+                result = await instagram_post_next_handler(arguments)
             elif tool_name == "instagram_status":
                 result = await instagram_status_handler()
             elif tool_name == "get_processed_images":
                 result = await get_processed_images()
             elif tool_name == "get_posted_images":
                 result = await get_posted_images()
+            elif tool_name == "scheduler_get_plan":
+                result = await scheduler_get_plan(arguments)
+            elif tool_name == "scheduler_set_account":
+                result = await scheduler_set_account_handler(arguments)
+            elif tool_name == "scheduler_update_entry":
+                result = await scheduler_update_entry_handler(arguments)
+            elif tool_name == "scheduler_replan":
+                result = await scheduler_replan_handler(arguments)
             else:
                 raise ValueError(f"Unknown tool: {tool_name}")
             
-            return MCPResponse(
-                id=request.id,
-                result={"content": [{"type": "text", "text": json.dumps(result, indent=2)}]}
+            return mcp_response(
+                request.id,
+                result=mcp_text_result(result)
             )
         
         else:
-            return MCPResponse(
-                id=request.id,
+            return mcp_response(
+                request.id,
                 error={"code": -32601, "message": f"Method not found: {request.method}"}
             )
     
+    except AdmissionRejected as e:
+        logger.warning(f"MCP request not admitted: {e}")
+        return mcp_response(
+            request.id,
+            error={"code": -32000, "message": str(e), "data": {"status": e.status_code, "retry_after": e.retry_after}}
+        )
+    
     except Exception as e:
         logger.error(f"MCP handler error: {e}")
-        return MCPResponse(
-            id=request.id,
+        return mcp_response(
+            request.id,
             error={"code": -32603, "message": f"Internal error: {str(e)}"}
         )
 
@@ -281,77 +433,269 @@ async def upload_image(file: UploadFile = File(...)):
             raise HTTPException(status_code=400, detail="File must be an image")
         
         # Save uploaded file
-        file_path = os.path.join("input_images", file.filename)
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
+        content = await file.read()
+        with get_storage("input_images").writing(file.filename, {"content_type": file.content_type}) as file_path:
+            with open(file_path, "wb") as buffer:
+                buffer.write(content)
         
         logger.info(f"Uploaded image: {file.filename}")
         return {"message": "Image uploaded successfully", "filename": file.filename}
     
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Upload error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# Resumable uploads
+def upload_headers(session: Dict[str, Any]) -> Dict[str, str]:
+    """Upload-Offset/Length/Expires headers describing a session"""
+    return {
+        "Upload-Offset": str(upload_manager.describe(session)["offset"]),
+        "Upload-Length": str(session["length"]),
+        "Upload-Expires": formatdate(session["expires"], usegmt=True),
+        "Cache-Control": "no-store"
+    }
+
+def upload_error(e: UploadError) -> HTTPException:
+    """Map an upload protocol error to an HTTP error, with the session's current offset and Retry-After when known"""
+    headers = upload_headers(e.session) if e.session else {}
+    if e.retry_after:
+        headers["Retry-After"] = str(e.retry_after)
+    return HTTPException(status_code=e.status_code, detail=str(e), headers=headers or None)
+
+@app.post("/uploads", status_code=201)
+async def create_upload(request: UploadCreateRequest):
+    """Start a resumable upload; send the bytes with PATCH /uploads/{upload_id}"""
+    try:
+        session = await asyncio.to_thread(upload_manager.create, request.filename, request.length, request.content_type, request.checksum)
+    except UploadError as e:
+        raise upload_error(e)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    headers = dict(upload_headers(session), Location=f"/uploads/{session['id']}")
+    return json_response(upload_manager.describe(session), status_code=201, headers=headers)
+
+@app.patch("/uploads/{upload_id}")
+async def upload_chunk(upload_id: str, request: Request, upload_offset: int = Header(...), upload_checksum: Optional[str] = Header(None)):
+    """Write one chunk at Upload-Offset; chunks may be sent in any order, in parallel, and retried"""
+    content_length = request.headers.get("content-length")
+    if content_length and int(content_length) > UPLOAD_MAX_CHUNK:
+        raise HTTPException(status_code=413, detail=f"Chunks may be at most {UPLOAD_MAX_CHUNK} bytes")
+    data = await request.body()
+    try:
+        session = await asyncio.to_thread(upload_manager.write_chunk, upload_id, upload_offset, data, upload_checksum)
+    except UploadError as e:
+        raise upload_error(e)
+    return Response(status_code=204, headers=upload_headers(session))
+
+@app.head("/uploads/{upload_id}")
+async def upload_offset(upload_id: str):
+    """Current offset of a resumable upload, for a sequential client picking up where it left off"""
+    try:
+        session = upload_manager.get(upload_id)
+    except UploadError as e:
+        raise upload_error(e)
+    return Response(status_code=200, headers=upload_headers(session))
+
+@app.get("/uploads/{upload_id}")
+async def upload_status(upload_id: str):
+    """Progress of a resumable upload: missing byte ranges, status and any processing result"""
+    try:
+        session = upload_manager.get(upload_id)
+    except UploadError as e:
+        raise upload_error(e)
+    return json_response(upload_manager.describe(session))
+
+@app.post("/uploads/{upload_id}/finalize")
+async def finalize_upload(upload_id: str, request: Optional[UploadFinalizeRequest] = None):
+    """Move a complete upload into input_images/, optionally queueing it for processing"""
+    request = request or UploadFinalizeRequest()
+    if request.process:
+        try:
+            resolve_renditions(request.renditions)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    try:
+        session = await asyncio.to_thread(upload_manager.finalize, upload_id)
+    except UploadError as e:
+        raise upload_error(e)
+    
+    if request.process:
+        params = request.model_dump(exclude={"process"})
+        session = await asyncio.to_thread(upload_manager.enqueue_processing, session, params)
+    return json_response(upload_manager.describe(session))
+
+@app.delete("/uploads/{upload_id}", status_code=204)
+async def cancel_upload(upload_id: str):
+    """Abandon a resumable upload and drop its staged bytes"""
+    try:
+        await asyncio.to_thread(upload_manager.delete, upload_id)
+    except UploadError as e:
+        raise upload_error(e)
+    return Response(status_code=204)
+
 # Core processing functions
+def render_image(input_path: str, output_filename: str, watermark_text: str, watermark_opacity: int, renditions: List[str]) -> Tuple[str, Dict[str, str]]:
+    """Decode, transpose and watermark the source once, then render and encode every rendition in parallel, each with its prepared-post record; returns the orientation and rendition storage names"""
+    from io import BytesIO
+    from PIL import Image, ImageOps
+    from src.process_image import add_watermark, caption_from_filename, render_rendition, rendition_name
+
+    pics_storage = get_storage("pics")
+    # The caption the post handler would build, stored so posting doesn't rebuild it
+    post_caption = caption_from_filename(output_filename) + HASHTAGS
+
+    def encode(rendition):
+        canvas, orientation = render_rendition(img, rendition)
+        name = rendition_name(output_filename, rendition)
+        buffer = BytesIO()
+        canvas.save(buffer, format='JPEG', quality=95)
+        data = buffer.getvalue()
+        metadata = {
+            "rendition": rendition,
+            "width": canvas.width,
+            "height": canvas.height,
+            "prepared": build_record(rendition, post_caption, canvas.width, canvas.height, data)
+        }
+        with pics_storage.writing(name, metadata) as path:
+            with open(path, "wb") as f:
+                f.write(data)
+        return orientation, name
+
+    with Image.open(input_path) as source:
+        # Apply existing processing logic
+        img = ImageOps.exif_transpose(source)
+        img = add_watermark(img, watermark_text, watermark_opacity)
+        
+        # Pillow releases the GIL while resizing and encoding, so renditions render concurrently
+        with ThreadPoolExecutor(max_workers=len(renditions)) as pool:
+            results = list(pool.map(encode, renditions))
+    
+    orientation = results[0][0]
+    return orientation, {rendition: name for rendition, (_, name) in zip(renditions, results)}
+
+def resolve_renditions(requested: Optional[List[str]]) -> List[str]:
+    """Validate requested renditions, defaulting to DEFAULT_RENDITIONS; feed is always rendered first"""
+    from src.process_image import RENDITIONS
+
+    renditions = requested or DEFAULT_RENDITIONS
+    unknown = [r for r in renditions if r not in RENDITIONS]
+    if unknown:
+        raise ValueError(f"Unknown renditions: {', '.join(unknown)} (available: {', '.join(RENDITIONS)})")
+    return ["feed"] + [r for r in dict.fromkeys(renditions) if r != "feed"]
+
+def caption_for(filename: str, custom_caption: Optional[str]) -> str:
+    """Return the custom caption or generate one from the filename"""
+    from src.process_image import generate_caption, remove_hashtags
+
+    if custom_caption:
+        return custom_caption
+    prompt = f"Write a cool Instagram caption for this photo described as {os.path.splitext(filename)[0]}\nOnly generate the caption nothing else."
+    caption = generate_caption(prompt)
+    if caption:
+        return remove_hashtags(caption)
+    return os.path.splitext(filename)[0].replace("_", " ")
+
 async def process_single_image(params: Dict[str, Any]) -> Dict[str, Any]:
     """Process a single image with the existing logic"""
+    from src.process_image import sanitize_filename
+
     filename = params.get("filename")
     custom_caption = params.get("custom_caption")
     watermark_text = params.get("watermark_text", "©PnC")
     watermark_opacity = params.get("watermark_opacity", 128)
+    renditions = resolve_renditions(params.get("renditions"))
     
     if not filename:
         raise ValueError("Filename is required")
     
-    input_path = os.path.join("input_images", filename)
-    if not os.path.exists(input_path):
+    input_storage = get_storage("input_images")
+    pics_storage = get_storage("pics")
+    if not input_storage.exists(filename):
         raise ValueError(f"Image file not found: {filename}")
     
+    reserved_name = None
+    digest = None
+    owns_pending = False
     try:
-        from PIL import Image, ImageOps
-        
-        with Image.open(input_path) as img:
-            # Apply existing processing logic
-            img = ImageOps.exif_transpose(img)
-            img = add_watermark(img, watermark_text, watermark_opacity)
-            orientation = get_orientation(img)
-            img = resize_and_center(img, orientation)
-            
-            # Generate caption
-            if custom_caption:
-                caption = custom_caption
-            else:
-                prompt = f"Write a cool Instagram caption for this photo described as {os.path.splitext(filename)[0]}\nOnly generate the caption nothing else."
-                caption = generate_caption(prompt)
-                if caption:
-                    caption = remove_hashtags(caption)
-                else:
-                    caption = os.path.splitext(filename)[0].replace("_", " ")
-            
-            # Save processed image
-            clean_name = sanitize_filename(caption)
-            output_filename = f"{clean_name}.jpg"
-            output_path = os.path.join("pics", output_filename)
+        with input_storage.reading(filename) as input_path:
+            # Same bytes and same parameters always produce the same output and caption
+            if RESULT_CACHE_ENABLED:
+                digest = await asyncio.to_thread(result_key, input_path, {
+                    "watermark_text": watermark_text,
+                    "watermark_opacity": watermark_opacity,
+                    "custom_caption": custom_caption,
+                    "renditions": renditions
+                })
+                cached = await asyncio.to_thread(result_cache.get, digest)
+                if cached:
+                    input_storage.delete(filename)
+                    logger.info(f"Processed image (cached): {filename} -> {cached['processed_filename']}")
+                    return dict(cached, original_filename=filename, cached=True)
+                
+                # A retry of a request that is still running waits for the original instead of redoing it
+                pending = pending_results.get(digest)
+                if pending:
+                    return dict(await asyncio.shield(pending), original_filename=filename, deduplicated=True)
+                pending_results[digest] = asyncio.get_running_loop().create_future()
+                owns_pending = True
             
-            img.save(output_path, format='JPEG', quality=95)
+            # Check the header before decoding anything or calling Gemini
+            _, _, footprint = estimate_footprint(input_path, len(renditions))
             
-            # Remove original
-            os.remove(input_path)
+            # Generate caption without holding any pixel budget
+            caption = await asyncio.to_thread(caption_for, filename, custom_caption)
             
-            logger.info(f"Processed image: {filename} -> {output_filename}")
+            # Never overwrite an existing output, which may already be posted; colliding names get a hash suffix
+            clean_name = sanitize_filename(caption)
+            name_digest = digest or await asyncio.to_thread(content_digest, input_path)
+            output_filename = await asyncio.to_thread(reserve_output_name, pics_storage, clean_name, name_digest)
+            reserved_name = output_filename
             
-            return {
-                "success": True,
-                "original_filename": filename,
-                "processed_filename": output_filename,
-                "caption": caption,
-                "orientation": orientation,
-                "watermark": watermark_text,
-                "message": "Image processed successfully"
-            }
+            # Only decode once the job fits in this worker's pixel budget
+            async with pixel_budget.admit(footprint):
+                orientation, rendition_names = await asyncio.to_thread(
+                    render_image, input_path, output_filename, watermark_text, watermark_opacity, renditions
+                )
+            reserved_name = None
+        
+        # Remove original
+        input_storage.delete(filename)
+        
+        logger.info(f"Processed image: {filename} -> {output_filename}")
+        
+        result = {
+            "success": True,
+            "original_filename": filename,
+            "processed_filename": output_filename,
+            "caption": caption,
+            "orientation": orientation,
+            "renditions": rendition_names,
+            "watermark": watermark_text,
+            "message": "Image processed successfully"
+        }
+        if digest:
+            try:
+                await asyncio.to_thread(result_cache.put, digest, result)
+            except Exception as e:
+                # The image is rendered and the input is gone; a missed cache entry only costs a future re-render
+                logger.warning(f"Couldn't cache result for {filename}: {e}")
+            owns_pending = False
+            pending_results.pop(digest).set_result(result)
+        return result
     
-    except Exception as e:
+    except BaseException as e:
+        # Drop the reserved (never written) output name and let waiting retries fail too
+        if reserved_name:
+            pics_storage.release(reserved_name)
+        pending = pending_results.pop(digest, None) if owns_pending else None
+        if pending and not pending.done():
+            pending.set_result({"success": False, "filename": filename, "error": str(e)})
+        if isinstance(e, AdmissionRejected) or not isinstance(e, Exception):
+            raise
         logger.error(f"Processing error for {filename}: {e}")
         return {
             "success": False,
@@ -359,19 +703,42 @@ async def process_single_image(params: Dict[str, Any]) -> Dict[str, Any]:
             "error": str(e)
         }
 
+def admission_error(e: AdmissionRejected) -> HTTPException:
+    """Map an admission rejection to an HTTP error with Retry-After when applicable"""
+    headers = {"Retry-After": str(e.retry_after)} if e.retry_after else None
+    return HTTPException(status_code=e.status_code, detail=str(e), headers=headers)
+
 async def batch_process_images(params: Dict[str, Any]) -> Dict[str, Any]:
     """Process multiple images in batch"""
     filenames = params.get("filenames", [])
     watermark_text = params.get("watermark_text", "©PnC")
     watermark_opacity = params.get("watermark_opacity", 128)
+    # Reject unknown renditions once, before anything is processed
+    renditions = resolve_renditions(params.get("renditions"))
     
     results = []
     for filename in filenames:
-        result = await process_single_image({
-            "filename": filename,
-            "watermark_text": watermark_text,
-            "watermark_opacity": watermark_opacity
-        })
+        try:
+            result = await process_single_image({
+                "filename": filename,
+                "watermark_text": watermark_text,
+                "watermark_opacity": watermark_opacity,
+                "renditions": renditions
+            })
+        except AdmissionRejected as e:
+            result = {
+                "success": False,
+                "filename": filename,
+                "error": str(e),
+                "status_code": e.status_code
+            }
+        except ValueError as e:
+            result = {
+                "success": False,
+                "filename": filename,
+                "error": str(e),
+                "status_code": 400
+            }
         results.append(result)
     
     successful = len([r for r in results if r.get("success")])
@@ -398,10 +765,12 @@ async def instagram_login_handler(params: Dict[str, Any]) -> Dict[str, Any]:
         }
     
     try:
-        instagram_client = login_to_instagram(username, password)
+        # The login lock may wait up to a minute and instagrapi blocks on the network; keep both off the event loop
+        instagram_client = await asyncio.to_thread(login_to_instagram, username, password)
+        account_clients[username] = instagram_client
         
         # Get account info to verify login
-        user_info = instagram_client.account_info()
+        user_info = await asyncio.to_thread(instagram_client.account_info)
         
         return {
             "success": True,
@@ -423,17 +792,19 @@ async def instagram_login_handler(params: Dict[str, Any]) -> Dict[str, Any]:
         }
 
 async def instagram_post_handler(params: Dict[str, Any]) -> Dict[str, Any]:
-    """Handle posting specific image to Instagram"""
-    global instagram_client
+    """Handle posting specific image to Instagram, from the logged-in account or params["username"]"""
+    username = params.get("username")
+    instagram_client = get_instagram_client(username)
     
     if not instagram_client:
         return {
             "success": False,
-            "error": "Not logged in to Instagram. Please login first."
+            "error": f"Instagram account {username} is not logged in. Please login first." if username else "Not logged in to Instagram. Please login first."
         }
     
     filename = params.get("filename")
     custom_caption = params.get("custom_caption")
+    rendition = params.get("rendition") or "feed"
     
     if not filename:
         return {
@@ -441,45 +812,94 @@ async def instagram_post_handler(params: Dict[str, Any]) -> Dict[str, Any]:
             "error": "Filename is required"
         }
     
-    # Check if file exists in pics folder
-    pic_path = os.path.join("pics", filename)
-    if not os.path.exists(pic_path):
+    if rendition not in POSTABLE_RENDITIONS:
         return {
             "success": False,
-            "error": f"Image file not found: {filename}"
+            "error": f"Rendition '{rendition}' cannot be posted (postable: {', '.join(POSTABLE_RENDITIONS)})"
         }
     
+    # Storage, state and the upload itself all block
+    return await asyncio.to_thread(post_image, instagram_client, filename, rendition, custom_caption)
+
+def post_image(instagram_client: "Client", filename: str, rendition: str, custom_caption: Optional[str]) -> Dict[str, Any]:
+    """Post one processed image (or its story rendition) unless it is already posted or being posted; blocks"""
+    from src.process_image import caption_from_filename, rendition_name
+
+    # Check if file exists in pics storage
+    pics_storage = get_storage("pics")
+    pic_name = rendition_name(filename, rendition)
+    if not pics_storage.exists(pic_name):
+        return {
+            "success": False,
+            "error": f"Image file not found: {filename} ({rendition})"
+        }
+    
+    # The posted ledger keys images by their pics/ path
+    pic_path = ledger_key(pic_name)
+    state = get_state()
+    
     # Check if already posted
-    posted_pics = load_posted_pics()
-    if pic_path in posted_pics:
+    if state.is_posted(pic_path):
         return {
             "success": False,
             "error": "Image has already been posted"
         }
     
+    # Only one worker/replica may post a given image at a time
+    lock_token = state.acquire_lock(f"post:{pic_path}", POST_LOCK_TTL)
+    if lock_token is None:
+        return {
+            "success": False,
+            "locked": True,
+            "error": "Image is already being posted"
+        }
+    
     try:
+        # Re-check now that we hold the lock
+        if state.is_posted(pic_path):
+            return {
+                "success": False,
+                "error": "Image has already been posted"
+            }
+        
+        # Images rendered here carry their final caption, dimensions and checksum
+        prepared = prepared_record(pics_storage.info(pic_name))
+        
         # Generate caption
         if custom_caption:
             caption = custom_caption + HASHTAGS
+        elif prepared:
+            caption = prepared["caption"]
         else:
-            pic_name = os.path.basename(pic_path)
-            caption = os.path.splitext(pic_name)[0].replace("_", " ") + HASHTAGS
+            caption = caption_from_filename(filename) + HASHTAGS
         
         # Post to Instagram
-        media = instagram_client.photo_upload(pic_path, caption)
+        with pics_storage.reading(pic_name) as local_path:
+            media = None
+            if prepared and rupload_supported():
+                try:
+                    media = upload_prepared(instagram_client, local_path, prepared, caption)
+                except PreparedPostMismatch as e:
+                    logger.warning(f"{e}; posting through the regular upload path")
+            if media is None and rendition == "story":
+                media = instagram_client.photo_upload_to_story(local_path, caption)
+            elif media is None:
+                media = instagram_client.photo_upload(local_path, caption)
         
         # Save to posted list
         save_posted_pic(pic_path)
+        pics_storage.mark_posted(pic_name)
         
         # Get post URL
         post_url = f"https://instagram.com/p/{media.code}/"
         
         logger.info(f"Successfully posted image: {filename}")
         
-        return {
+        result = {
             "success": True,
             "message": "Image posted successfully to Instagram",
             "filename": filename,
+            "rendition": rendition,
             "caption": caption,
             "post_url": post_url,
             "media_id": media.id
@@ -491,32 +911,53 @@ async def instagram_post_handler(params: Dict[str, Any]) -> Dict[str, Any]:
             "success": False,
             "error": str(e)
         }
+    
+    finally:
+        state.release_lock(f"post:{pic_path}", lock_token)
+    
+    # Counts against the account's scheduler quota and spacing, however it was posted; the post itself already succeeded
+    try:
+        scheduler.record_post(instagram_client.username)
+    except Exception as e:
+        logger.warning(f"Couldn't count post for {instagram_client.username}: {e}")
+    return result
 
-async def instagram_post_next_handler() -> Dict[str, Any]:
-    """Post the next unposted image from processed folder"""
-    global instagram_client
+async def instagram_post_next_handler(params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Post the next unposted image (or its story rendition) from processed folder"""
+    from src.process_image import RENDITIONS_SUBFOLDER
+
+    rendition = (params or {}).get("rendition") or "feed"
     
-    if not instagram_client:
+    if not get_instagram_client():
         return {
             "success": False,
             "error": "Not logged in to Instagram. Please login first."
         }
     
     try:
-        import glob
+        pics_storage = get_storage("pics")
+        state = get_state()
         
-        # Get all processed images
-        pics = sorted(glob.glob(os.path.join("pics", "*.jpg")))
-        posted_pics = load_posted_pics()
+        if rendition == "feed":
+            match = lambda name: "/" not in name
+        else:
+            match = lambda name: name.startswith(f"{RENDITIONS_SUBFOLDER}/") and name.endswith(f"/{rendition}.jpg")
         
-        # Find first unposted image
-        for pic_path in pics:
-            if pic_path not in posted_pics:
-                filename = os.path.basename(pic_path)
-                
-                # Use the existing post handler
-                result = await instagram_post_handler({"filename": filename})
-                return result
+        # Oldest unposted image first, straight from the storage index
+        for pic_name in pics_storage.unposted(match):
+            if state.is_posted(ledger_key(pic_name)):
+                # Posted through another path; bring the index up to date
+                pics_storage.mark_posted(pic_name)
+                continue
+            
+            filename = pic_name if rendition == "feed" else pic_name.split("/")[1] + ".jpg"
+            
+            # Use the existing post handler
+            result = await instagram_post_handler({"filename": filename, "rendition": rendition})
+            if result.get("locked"):
+                # Another worker is posting this one, move on to the next
+                continue
+            return result
         
         return {
             "success": False,
@@ -532,7 +973,7 @@ async def instagram_post_next_handler() -> Dict[str, Any]:
 
 async def instagram_status_handler() -> Dict[str, Any]:
     """Check Instagram login status"""
-    global instagram_client
+    instagram_client = get_instagram_client()
     
     if not instagram_client:
         return {
@@ -542,7 +983,7 @@ async def instagram_status_handler() -> Dict[str, Any]:
     
     try:
         # Try to get account info to verify connection
-        user_info = instagram_client.account_info()
+        user_info = await asyncio.to_thread(instagram_client.account_info)
         
         return {
             "logged_in": True,
@@ -564,32 +1005,96 @@ async def instagram_status_handler() -> Dict[str, Any]:
             "message": "Connection to Instagram lost"
         }
 
+# Scheduler handler functions
+async def scheduler_get_plan(params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Accounts, upcoming posts and recent history of the posting scheduler"""
+    limit = (params or {}).get("limit") or 50
+    return await asyncio.to_thread(scheduler.describe, limit)
+
+async def scheduler_set_account_handler(params: Dict[str, Any]) -> Dict[str, Any]:
+    """Create, update or remove an account's posting schedule"""
+    username = params.get("username")
+    if not username:
+        return {
+            "success": False,
+            "error": "Username is required"
+        }
+    
+    try:
+        if params.get("remove"):
+            await asyncio.to_thread(scheduler.remove_account, username)
+            return {
+                "success": True,
+                "message": f"Removed the schedule for {username}"
+            }
+        settings = {key: params.get(key) for key in SchedulerAccountRequest.model_fields}
+        account = await asyncio.to_thread(scheduler.set_account, username, settings)
+        return {
+            "success": True,
+            "username": username,
+            "account": account
+        }
+    except SchedulerError as e:
+        return {
+            "success": False,
+            "error": str(e)
+        }
+
+async def scheduler_update_entry_handler(params: Dict[str, Any]) -> Dict[str, Any]:
+    """Move, swap the image of, or cancel a planned post"""
+    try:
+        entry = await asyncio.to_thread(
+            scheduler.update_entry, params.get("entry_id"), params.get("run_at"), params.get("filename"), bool(params.get("cancel"))
+        )
+        return {
+            "success": True,
+            "entry": scheduler.entry_view(entry)
+        }
+    except SchedulerError as e:
+        return {
+            "success": False,
+            "error": str(e)
+        }
+
+async def scheduler_replan_handler(params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Plan the upcoming posts again, for one account or all of them"""
+    await asyncio.to_thread(scheduler.replan, (params or {}).get("username"))
+    return {
+        "success": True,
+        **(await scheduler_get_plan())
+    }
+
 async def get_processed_images() -> Dict[str, Any]:
     """Get list of processed images ready for posting"""
     try:
-        pics_folder = "pics"
-        if not os.path.exists(pics_folder):
-            return {"processed_images": [], "count": 0}
+        from src.process_image import RENDITIONS_SUBFOLDER
+
+        images = {}
+        extra_renditions = {}
         
-        posted_pics = load_posted_pics()
-        images = []
+        # One pass over the storage index; no directory scans or stat calls
+        for entry in get_storage("pics").list():
+            name = entry["name"]
+            if "/" not in name:
+                if name.lower().endswith('.jpg'):
+                    images[name] = {
+                        "filename": name,
+                        "size": entry["size"],
+                        "created": datetime.fromtimestamp(entry["created"]).isoformat(),
+                        "modified": datetime.fromtimestamp(entry["modified"]).isoformat(),
+                        "posted": entry["posted"],
+                        "renditions": ["feed"]
+                    }
+            elif name.startswith(f"{RENDITIONS_SUBFOLDER}/"):
+                _, stem, rendition_file = name.split("/", 2)
+                extra_renditions.setdefault(f"{stem}.jpg", []).append(os.path.splitext(rendition_file)[0])
         
-        for filename in os.listdir(pics_folder):
-            if filename.lower().endswith('.jpg'):
-                file_path = os.path.join(pics_folder, filename)
-                file_stats = os.stat(file_path)
-                is_posted = file_path in posted_pics
-                
-                images.append({
-                    "filename": filename,
-                    "size": file_stats.st_size,
-                    "created": datetime.fromtimestamp(file_stats.st_ctime).isoformat(),
-                    "modified": datetime.fromtimestamp(file_stats.st_mtime).isoformat(),
-                    "posted": is_posted
-                })
+        for filename, renditions in extra_renditions.items():
+            if filename in images:
+                images[filename]["renditions"] += sorted(renditions)
         
         # Sort by creation date, newest first
-        images.sort(key=lambda x: x["created"], reverse=True)
+        images = sorted(images.values(), key=lambda x: x["created"], reverse=True)
         unposted_count = len([img for img in images if not img["posted"]])
         
         return {
@@ -620,56 +1125,77 @@ async def get_posted_images() -> Dict[str, Any]:
 @app.get("/images/processed")
 async def list_processed_images():
     """REST endpoint to list processed images"""
-    return await get_processed_images()
+    return json_response(await get_processed_images())
 
 @app.get("/images/posted")
 async def list_posted_images():
     """REST endpoint to list posted images"""
-    return await get_posted_images()
+    return json_response(await get_posted_images())
 
 @app.post("/process")
 async def process_image_rest(request: ImageProcessRequest):
     """REST endpoint to process a single image"""
-    result = await process_single_image(request.dict())
-    return result
+    try:
+        result = await process_single_image(request.model_dump())
+    except AdmissionRejected as e:
+        raise admission_error(e)
+    except ValueError as e:
+        # Missing file or unknown rendition
+        raise HTTPException(status_code=400, detail=str(e))
+    return json_response(result)
 
 @app.post("/process/batch")
 async def batch_process_rest(request: BatchProcessRequest):
     """REST endpoint to batch process images"""
-    result = await batch_process_images(request.dict())
-    return result
+    try:
+        result = await batch_process_images(request.model_dump())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return json_response(result)
 
 @app.post("/instagram/login")
 async def instagram_login_rest(request: InstagramLoginRequest):
     """REST endpoint for Instagram login"""
-    result = await instagram_login_handler(request.dict())
-    return result
+    result = await instagram_login_handler(request.model_dump())
+    return json_response(result)
 
 @app.post("/instagram/post")
 async def instagram_post_rest(request: InstagramPostRequest):
     """REST endpoint to post to Instagram"""
-    result = await instagram_post_handler(request.dict())
-    return result
+    result = await instagram_post_handler(request.model_dump())
+    return json_response(result)
 
 @app.post("/instagram/post/next")
-async def instagram_post_next_rest():
+async def instagram_post_next_rest(rendition: str = "feed"):
     """REST endpoint to post next unposted image"""
-    result = await instagram_post_next_handler()
-    return result
+    result = await instagram_post_next_handler({"rendition": rendition})
+    return json_response(result)
 
 @app.get("/instagram/status")
 async def instagram_status_rest():
     """REST endpoint to check Instagram status"""
     result = await instagram_status_handler()
-    return result
+    return json_response(result)
 
 @app.get("/download/{filename}")
-async def download_processed_image(filename: str):
-    """Download a processed image"""
-    file_path = os.path.join("pics", filename)
-    if not os.path.exists(file_path):
+async def download_processed_image(filename: str, rendition: str = "feed"):
+    """Download a processed image, or one of its renditions"""
+    from src.process_image import RENDITIONS, rendition_name
+
+    if rendition not in RENDITIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown rendition: {rendition}")
+    pics_storage = get_storage("pics")
+    try:
+        name = rendition_name(filename, rendition)
+        if not pics_storage.exists(name):
+            raise HTTPException(status_code=404, detail="File not found")
+    except ValueError:
         raise HTTPException(status_code=404, detail="File not found")
-    return FileResponse(file_path)
+    
+    local_path = pics_storage.local_path(name)
+    if local_path:
+        return FileResponse(local_path)
+    return Response(content=await asyncio.to_thread(pics_storage.read_bytes, name), media_type="image/jpeg")
 
 @app.get("/health")
 async def health_check():
@@ -677,16 +1203,165 @@ async def health_check():
     return {
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
-        "version": "1.0.0"
+        "version": "1.0.0",
+        "admission": pixel_budget.stats()
     }
 
-@app.get("/frontend")
-async def serve_frontend():
+@app.get("/cache/results")
+async def result_cache_status():
+    """Result cache statistics"""
+    return await asyncio.to_thread(result_cache.stats)
+
+@app.post("/cache/results/prune")
+async def result_cache_prune():
+    """Forget cached results whose images were removed from pics/"""
+    pruned = await asyncio.to_thread(result_cache.prune)
+    return {"pruned": pruned, **result_cache.stats()}
+
+def scheduler_error(e: SchedulerError) -> HTTPException:
+    """Map a rejected scheduler change to an HTTP error"""
+    return HTTPException(status_code=e.status_code, detail=str(e))
+
+@app.get("/scheduler")
+async def scheduler_status(limit: int = 50):
+    """Posting schedule: accounts, upcoming posts and recent history"""
+    return json_response(await scheduler_get_plan({"limit": limit}))
+
+@app.put("/scheduler/accounts/{username}")
+async def scheduler_set_account(username: str, request: SchedulerAccountRequest):
+    """Create or update an account's slots, quota, spacing and jitter; omitted fields keep their value"""
+    try:
+        account = await asyncio.to_thread(scheduler.set_account, username, request.model_dump())
+    except SchedulerError as e:
+        raise scheduler_error(e)
+    return json_response({"username": username, "account": account})
+
+@app.delete("/scheduler/accounts/{username}", status_code=204)
+async def scheduler_remove_account(username: str):
+    """Stop scheduling posts for an account; its planned posts go back to the backlog"""
+    try:
+        await asyncio.to_thread(scheduler.remove_account, username)
+    except SchedulerError as e:
+        raise scheduler_error(e)
+    return Response(status_code=204)
+
+@app.post("/scheduler/replan")
+async def scheduler_replan(username: Optional[str] = None):
+    """Drop the upcoming posts of one account (or all) and plan them again"""
+    await asyncio.to_thread(scheduler.replan, username)
+    return json_response(await scheduler_get_plan())
+
+@app.patch("/scheduler/plan/{entry_id}")
+async def scheduler_update_entry(entry_id: str, request: ScheduleEntryUpdate):
+    """Move a planned post or swap its image"""
+    try:
+        entry = await asyncio.to_thread(scheduler.update_entry, entry_id, request.run_at, request.filename)
+    except SchedulerError as e:
+        raise scheduler_error(e)
+    return json_response(scheduler.entry_view(entry))
+
+@app.delete("/scheduler/plan/{entry_id}")
+async def scheduler_cancel_entry(entry_id: str):
+    """Cancel a planned post; its slot stays empty and the image returns to the backlog"""
+    try:
+        entry = await asyncio.to_thread(scheduler.update_entry, entry_id, cancel=True)
+    except SchedulerError as e:
+        raise scheduler_error(e)
+    return json_response(scheduler.entry_view(entry))
+
+@app.post("/scheduler/run")
+async def scheduler_run_due():
+    """Post everything that is due now instead of waiting for the next tick"""
+    finished = await scheduler.run_due(instagram_post_handler)
+    return json_response({"finished": [scheduler.entry_view(entry) for entry in finished]})
+
+@app.get("/http/stats")
+async def http_pool_status():
+    """Connection reuse and DNS cache statistics for the Gemini and Instagram HTTP pools"""
+    return http_pool_stats()
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Guard for admin endpoints; they don't exist unless PROFILING_ADMIN_TOKEN is set"""
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not check_admin_token(x_admin_token):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+def profile_export(profile, format: str) -> Response:
+    """Render a profile as speedscope JSON or collapsed stacks"""
+    if format == "collapsed":
+        return Response(content=profile.collapsed(), media_type="text/plain; charset=utf-8")
+    if format == "speedscope":
+        return json_response(profile.speedscope())
+    raise HTTPException(status_code=400, detail="format must be speedscope or collapsed")
+
+@app.get("/admin/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles():
+    """Profiled requests and sessions from every worker, oldest first"""
+    return {"profiles": await asyncio.to_thread(profile_store.list)}
+
+@app.post("/admin/profiles/sessions", dependencies=[Depends(require_admin)])
+async def start_profiling_session(duration: float = 10, interval_ms: float = PROFILING_INTERVAL_MS, include_idle: bool = False):
+    """Sample the worker that receives this request for up to duration seconds (capped by PROFILING_MAX_DURATION)"""
+    try:
+        profile = await asyncio.to_thread(start_session, duration, interval_ms, include_idle)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return profile.summary()
+
+@app.get("/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def get_profile(profile_id: str, format: str = "speedscope"):
+    """Download a profile; a session running in this worker returns the samples collected so far"""
+    profile = await asyncio.to_thread(profile_store.get, profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if profile.remote and profile.running:
+        raise HTTPException(status_code=409, detail="Profile is still running in another worker; retry once it finishes")
+    return profile_export(profile, format)
+
+@app.post("/admin/profiles/{profile_id}/stop", dependencies=[Depends(require_admin)])
+async def stop_profile(profile_id: str):
+    """End a running session early, whichever worker runs it"""
+    profile = await asyncio.to_thread(profile_store.get, profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    await asyncio.to_thread(profile_store.request_stop, profile)
+    return profile.summary()
+
+@app.on_event("startup")
+async def check_storage_layout():
+    """Warn about flat files written before the sharded layout; they are invisible until migrated"""
+    from src.storage import STORAGE_BACKEND, has_legacy_files
+
+    if STORAGE_BACKEND != "sharded":
+        return
+    for area in ("pics", "input_images"):
+        if has_legacy_files(area):
+            logger.warning(f"{area}/ contains files from the old flat layout; run `python -m src.storage migrate {area}`")
+
+@app.on_event("startup")
+async def load_static_assets():
+    """Read and precompress the frontend and static/ into memory before serving"""
+    asset_cache.add_directory("/static", "static")
+    if os.path.exists("frontend_v2.html"):
+        # Loaded after static/ so its asset links can be fingerprinted
+        asset_cache.add_file("/frontend", "frontend_v2.html", fingerprint_html=True)
+
+@app.api_route("/frontend", methods=["GET", "HEAD"])
+async def serve_frontend(request: Request):
     """Serve the frontend HTML"""
-    file_path = "frontend_v2.html"
-    if not os.path.exists(file_path):
+    asset = asset_cache.get("/frontend")
+    if asset is None:
         raise HTTPException(status_code=404, detail="Frontend file not found")
-    return FileResponse(file_path, media_type="text/html")
+    return asset_cache.response(asset, request)
+
+@app.api_route("/static/{asset_path:path}", methods=["GET", "HEAD"])
+async def serve_static(asset_path: str, request: Request):
+    """Serve a static asset; requests fingerprinted with ?v=<version> may be cached forever"""
+    asset = asset_cache.get(f"/static/{asset_path}")
+    if asset is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return asset_cache.response(asset, request, immutable=request.query_params.get("v") == asset.version)
 
 @app.get("/")
 async def root():
@@ -698,6 +1373,7 @@ async def root():
         "endpoints": {
             "mcp": "/mcp - Main MCP protocol endpoint",
             "upload": "/upload - Upload images",
+            "uploads": "/uploads - Resumable chunked uploads (POST to start, PATCH chunks, POST /uploads/{id}/finalize)",
             "process": "/process - Process single image",
             "batch_process": "/process/batch - Batch process images",
             "instagram_login": "/instagram/login - Login to Instagram",
@@ -706,13 +1382,123 @@ async def root():
             "instagram_status": "/instagram/status - Check Instagram status",
             "processed_images": "/images/processed - List processed images",
             "posted_images": "/images/posted - List posted images",
-            "download": "/download/{filename} - Download processed image",
+            "download": "/download/{filename}?rendition=feed|story|reel_cover - Download processed image",
+            "scheduler": "/scheduler - Posting schedule (PUT /scheduler/accounts/{username} to set slots and quotas)",
+            "result_cache": "/cache/results - Result cache statistics (POST /cache/results/prune to drop stale entries)",
             "health": "/health - Health check"
         }
     }
 
-mcp = FastApiMCP(app)
-mcp.mount()
+def mount_mcp():
+    """Mount the fastapi_mcp server on the app (once)"""
+    global mcp
+    if mcp is not None:
+        return
+    from fastapi_mcp import FastApiMCP
+
+    mcp = FastApiMCP(app)
+    mcp.mount()
+
+def prewarm_imports():
+    """Import the heavy SDKs so the first real request doesn't pay for them"""
+    started = time.perf_counter()
+    for name in HEAVY_MODULES:
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            logger.warning(f"Pre-warm import of {name} failed: {e}")
+    logger.info(f"Pre-warmed heavy imports in {time.perf_counter() - started:.2f}s")
+
+async def background_prewarm():
+    """Pre-warm after the port is bound so /health answers immediately"""
+    await asyncio.sleep(STARTUP_PREWARM_DELAY)
+    await asyncio.to_thread(prewarm_imports)
+    mount_mcp()
+
+@app.on_event("startup")
+async def startup_prewarm():
+    """Schedule deferred startup work according to STARTUP_MODE"""
+    if mcp is not None:
+        return
+    if STARTUP_PREWARM:
+        asyncio.create_task(background_prewarm())
+    else:
+        mount_mcp()
+
+async def process_queue_worker():
+    """Process images queued by finalized uploads; the job stays on its upload session until its outcome is recorded"""
+    state = get_state()
+    while True:
+        job = await asyncio.to_thread(state.dequeue, PROCESS_QUEUE)
+        if job is None:
+            await asyncio.sleep(PROCESS_QUEUE_POLL_INTERVAL)
+            continue
+        
+        try:
+            if not await asyncio.to_thread(upload_manager.claim, job):
+                continue
+        except Exception as e:
+            # Busy session or state error: the sweeper queues the job again once it goes stale
+            logger.warning(f"Could not claim queued job for upload {job.get('upload_id')}: {e}")
+            continue
+        try:
+            result = await process_single_image(job["params"])
+        except AdmissionRejected as e:
+            if e.retry_after:
+                # Busy, not broken: put the job back and back off before taking more work
+                await asyncio.to_thread(upload_manager.requeue, job)
+                await asyncio.sleep(e.retry_after)
+                continue
+            result = {"success": False, "filename": job["params"].get("filename"), "error": str(e)}
+        except Exception as e:
+            logger.error(f"Queued processing error: {e}")
+            result = {"success": False, "filename": job["params"].get("filename"), "error": str(e)}
+        
+        try:
+            await asyncio.to_thread(upload_manager.complete, job, result)
+        except Exception as e:
+            logger.error(f"Could not record the outcome of upload {job['upload_id']}: {e}")
+
+async def upload_sweeper():
+    """Drop upload sessions that have seen no chunks for UPLOAD_EXPIRY seconds"""
+    while True:
+        try:
+            await asyncio.to_thread(upload_manager.sweep)
+        except Exception as e:
+            logger.warning(f"Upload sweep failed: {e}")
+        await asyncio.sleep(UPLOAD_SWEEP_INTERVAL)
+
+@app.on_event("startup")
+async def startup_upload_tasks():
+    """Start the processing queue consumers and the stale upload sweeper"""
+    for _ in range(PROCESS_QUEUE_WORKERS):
+        asyncio.create_task(process_queue_worker())
+    asyncio.create_task(upload_sweeper())
+
+async def scheduler_loop():
+    """Plan and post scheduled images every SCHEDULER_TICK_INTERVAL seconds"""
+    while True:
+        try:
+            await scheduler.run_due(instagram_post_handler)
+        except Exception as e:
+            logger.error(f"Scheduler tick failed: {e}")
+        await asyncio.sleep(SCHEDULER_TICK_INTERVAL)
+
+@app.on_event("startup")
+async def startup_scheduler():
+    """Start the posting scheduler; every worker runs it, the runner lock lets one post at a time"""
+    if SCHEDULER_ENABLED:
+        asyncio.create_task(scheduler_loop())
+
+@app.on_event("startup")
+async def startup_prune_result_cache():
+    """Forget cached results for images cleaned out of pics/ while the server was down"""
+    if RESULT_CACHE_ENABLED:
+        asyncio.create_task(asyncio.to_thread(result_cache.prune))
+
+if STARTUP_MODE == "eager":
+    prewarm_imports()
+    mount_mcp()
 
 if __name__ == "__main__":
     # Get port from environment variable (for cloud deployment)
@@ -0,0 +1,158 @@
+import os, asyncio, logging
+from collections import deque
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s - %(message)s')
+
+
+# Largest source image (in pixels) we are willing to decode at all
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", 60_000_000))
+# Decoded pixel memory for all in-flight jobs of the host; uvicorn starts WEB_CONCURRENCY workers
+PIXEL_BUDGET_TOTAL_BYTES = int(os.getenv("PIXEL_BUDGET_TOTAL_BYTES", 384 * 1024 * 1024))
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", 1)))
+# Each worker process admits jobs against its own share, so the host total stays within PIXEL_BUDGET_TOTAL_BYTES
+PIXEL_BUDGET_BYTES = int(os.getenv("PIXEL_BUDGET_BYTES", PIXEL_BUDGET_TOTAL_BYTES // WEB_CONCURRENCY))
+# How many jobs may wait for budget before new ones are rejected outright
+ADMISSION_MAX_WAITING = int(os.getenv("ADMISSION_MAX_WAITING", 8))
+# How long a queued job waits for budget before giving up
+ADMISSION_TIMEOUT = float(os.getenv("ADMISSION_TIMEOUT", 30))
+
+# add_watermark holds the RGBA source, the RGBA watermark layer and their composite at the same time
+BYTES_PER_PIXEL = 4
+WORKING_COPIES = 3
+# Output canvas plus resize intermediates per rendition, bounded by the largest Instagram size
+CANVAS_OVERHEAD_BYTES = 1080 * 1920 * BYTES_PER_PIXEL * 2
+
+
+class AdmissionRejected(Exception):
+    """Raised when an image job cannot be admitted; carries the HTTP status to surface."""
+
+    def __init__(self, message, status_code, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def estimate_footprint(path, renditions=1):
+    """Reads only the image header and returns (width, height, estimated decoded bytes) for processing it into the given number of renditions."""
+    from PIL import Image
+
+    # Let Pillow enforce the same limit for any decode that bypasses admission
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+    try:
+        with Image.open(path) as img:
+            width, height = img.size
+    except Image.DecompressionBombError as e:
+        raise AdmissionRejected(str(e), 413)
+
+    pixels = width * height
+    if pixels > MAX_IMAGE_PIXELS:
+        raise AdmissionRejected(
+            f"Image is {width}x{height} ({pixels} pixels), above the limit of {MAX_IMAGE_PIXELS} pixels",
+            413
+        )
+    return width, height, pixels * BYTES_PER_PIXEL * WORKING_COPIES + CANVAS_OVERHEAD_BYTES * renditions
+
+
+class PixelBudget:
+    """Admits image jobs only while their estimated decoded footprint fits within a byte budget.
+
+    The budget is per process: with several workers each one gets
+    PIXEL_BUDGET_BYTES, by default an equal share of PIXEL_BUDGET_TOTAL_BYTES.
+
+    Waiting jobs are admitted first come, first served. A job that is allowed
+    (within MAX_IMAGE_PIXELS) but larger than the whole budget is not
+    rejected; it waits for the budget to drain and then runs alone, using
+    more than its worker's share while it does.
+    """
+
+    def __init__(self, capacity=PIXEL_BUDGET_BYTES, max_waiting=ADMISSION_MAX_WAITING, timeout=ADMISSION_TIMEOUT):
+        self.capacity = capacity
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.in_use = 0
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.oversized = 0
+        self._queue = deque()
+        self._condition = None
+
+    def _get_condition(self):
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    def _fits(self, cost):
+        return self.in_use + cost <= self.capacity
+
+    async def acquire(self, cost):
+        """Reserves cost bytes, waiting in line if needed, and returns the bytes reserved; raises AdmissionRejected with 429 or 503."""
+        if cost > self.capacity:
+            # Holding the whole budget means it runs alone
+            self.oversized += 1
+            cost = self.capacity
+
+        condition = self._get_condition()
+        async with condition:
+            if not self._queue and self._fits(cost):
+                self._reserve(cost)
+                return cost
+
+            if self.waiting >= self.max_waiting:
+                self.rejected += 1
+                raise AdmissionRejected("Too many images waiting for processing memory", 429, retry_after=5)
+
+            # Only the head of the line may take budget, so a large job isn't overtaken forever by small ones
+            ticket = object()
+            self._queue.append(ticket)
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(condition.wait_for(lambda: self._queue[0] is ticket and self._fits(cost)), self.timeout)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                raise AdmissionRejected("Timed out waiting for processing memory", 503, retry_after=int(self.timeout))
+            finally:
+                self.waiting -= 1
+                self._queue.remove(ticket)
+                condition.notify_all()
+            self._reserve(cost)
+            return cost
+
+    def _reserve(self, cost):
+        self.in_use += cost
+        self.active += 1
+
+    async def release(self, cost):
+        """Returns cost bytes to the budget and wakes queued jobs."""
+        condition = self._get_condition()
+        async with condition:
+            self.in_use -= cost
+            self.active -= 1
+            condition.notify_all()
+
+    @asynccontextmanager
+    async def admit(self, cost):
+        """Context manager holding cost bytes of the budget for the duration of the block."""
+        reserved = await self.acquire(cost)
+        try:
+            yield
+        finally:
+            await self.release(reserved)
+
+    def stats(self):
+        """Returns the current budget usage."""
+        return {
+            "capacity_bytes": self.capacity,
+            "in_use_bytes": self.in_use,
+            "active_jobs": self.active,
+            "waiting_jobs": self.waiting,
+            "rejected_jobs": self.rejected,
+            "oversized_jobs": self.oversized,
+            "max_image_pixels": MAX_IMAGE_PIXELS,
+            "workers": WEB_CONCURRENCY
+        }
+
+
+pixel_budget = PixelBudget()
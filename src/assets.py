@@ -0,0 +1,169 @@
+import os, re, gzip, hashlib, logging, mimetypes
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip alone still works
+    brotli = None
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s - %(message)s')
+
+
+# Re-read assets whose file changed on disk (handy while editing the frontend, costs a stat per request)
+STATIC_ASSET_RELOAD = os.getenv("STATIC_ASSET_RELOAD", "false").lower() in ("1", "true", "yes")
+
+# Below this, compressed bodies aren't worth the extra round of negotiation
+MIN_COMPRESS_SIZE = 512
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+# Local static/ references in HTML that get a ?v=<hash> fingerprint
+STATIC_REFERENCE_RE = re.compile(r'((?:href|src)=")(/?static/([^"?#]+))(")')
+
+
+class Asset:
+    """One file held in memory with its precompressed variants and content hash."""
+
+    def __init__(self, file_path, body, media_type, mtime):
+        self.file_path = file_path
+        self.media_type = media_type
+        self.mtime = mtime
+        self.body = body
+        self.digest = hashlib.sha256(body).hexdigest()
+        self.version = self.digest[:12]
+        self.encodings = {"identity": body}
+
+        if len(body) >= MIN_COMPRESS_SIZE and media_type.startswith(COMPRESSIBLE_TYPES):
+            gzipped = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(gzipped) < len(body):
+                self.encodings["gzip"] = gzipped
+            if brotli is not None:
+                compressed = brotli.compress(body, quality=11)
+                if len(compressed) < len(body):
+                    self.encodings["br"] = compressed
+
+    def etag(self, encoding):
+        """Strong ETag per representation, so a cached gzip body is never revalidated as the brotli one."""
+        suffix = "" if encoding == "identity" else f"-{encoding}"
+        return f'"{self.digest[:32]}{suffix}"'
+
+
+def parse_accept_encoding(header):
+    """Returns {coding: q} from an Accept-Encoding header."""
+    accepted = {}
+    for part in (header or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def negotiate_encoding(asset, accept_encoding):
+    """Picks the smallest variant the client accepts: br, then gzip, then the raw body."""
+    accepted = parse_accept_encoding(accept_encoding)
+    wildcard = accepted.get("*", 0.0)
+    for coding in ("br", "gzip"):
+        if coding in asset.encodings and accepted.get(coding, wildcard) > 0:
+            return coding
+    return "identity"
+
+
+class AssetCache:
+    """Serves a fixed set of files from memory with compression negotiation, ETags and cache headers."""
+
+    def __init__(self):
+        self._assets = {}
+        self._sources = {}
+
+    def add_file(self, url_path, file_path, fingerprint_html=False):
+        """Loads file_path into the cache under url_path."""
+        self._sources[url_path] = (file_path, fingerprint_html)
+        return self._load(url_path)
+
+    def add_directory(self, url_prefix, directory):
+        """Loads every file below directory under url_prefix/<relative path>."""
+        for root, _, files in os.walk(directory):
+            for name in files:
+                file_path = os.path.join(root, name)
+                relative = os.path.relpath(file_path, directory).replace(os.sep, "/")
+                self.add_file(f"{url_prefix}/{relative}", file_path)
+
+    def _load(self, url_path):
+        file_path, fingerprint_html = self._sources[url_path]
+        with open(file_path, "rb") as f:
+            body = f.read()
+        mtime = os.path.getmtime(file_path)
+        media_type = mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+        if media_type.startswith("text/"):
+            media_type += "; charset=utf-8"
+        if fingerprint_html:
+            body = self._fingerprint_references(body.decode("utf8")).encode("utf8")
+        asset = Asset(file_path, body, media_type, mtime)
+        self._assets[url_path] = asset
+        return asset
+
+    def _fingerprint_references(self, html):
+        def replace(match):
+            asset = self._assets.get("/static/" + match.group(3))
+            if asset is None:
+                return match.group(0)
+            return f"{match.group(1)}{match.group(2)}?v={asset.version}{match.group(4)}"
+        return STATIC_REFERENCE_RE.sub(replace, html)
+
+    def get(self, url_path):
+        """Returns the cached Asset for url_path, or None."""
+        asset = self._assets.get(url_path)
+        if asset is not None and STATIC_ASSET_RELOAD:
+            try:
+                if os.path.getmtime(asset.file_path) != asset.mtime:
+                    asset = self._load(url_path)
+            except OSError:
+                return None
+        return asset
+
+    def response(self, asset, request, immutable=False):
+        """Builds the response for asset: 304 on a matching If-None-Match, otherwise the negotiated body."""
+        encoding = negotiate_encoding(asset, request.headers.get("accept-encoding"))
+        etag = asset.etag(encoding)
+        headers = {
+            "ETag": etag,
+            "Vary": "Accept-Encoding",
+            "Cache-Control": IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL,
+        }
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+
+        # If-None-Match uses weak comparison, and proxies that re-encode bodies send W/ tags
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and (if_none_match.strip() == "*" or etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]):
+            return Response(status_code=304, headers=headers)
+
+        body = asset.encodings[encoding]
+        if request.method == "HEAD":
+            headers["Content-Length"] = str(len(body))
+            body = b""
+        return Response(content=body, media_type=asset.media_type, headers=headers)
+
+    def stats(self):
+        return {
+            url_path: {
+                "version": asset.version,
+                "sizes": {encoding: len(body) for encoding, body in asset.encodings.items()}
+            }
+            for url_path, asset in self._assets.items()
+        }
+
+
+asset_cache = AssetCache()
@@ -0,0 +1,314 @@
+"""Shared keep-alive HTTP connection pools for the Gemini and Instagram clients.
+
+Gemini goes through one long-lived genai.Client whose httpx transport keeps
+connections open (HTTP/2 when the h2 package is installed). Every instagrapi
+Client mounts the same pooled requests adapter, so logins and workers in one
+process reuse connections to Instagram. Both pools resolve hosts through a
+small TTL cache. Only their own connections use it; socket.getaddrinfo is
+left alone for the rest of the process.
+"""
+import os, time, socket, logging, ipaddress, threading
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s - %(message)s')
+
+
+# Distinct hosts to keep pools for, and connections kept per host
+HTTP_POOL_HOSTS = int(os.getenv("HTTP_POOL_HOSTS", 10))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", 10))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 60))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() in ("1", "true", "yes")
+# Seconds to cache DNS answers; 0 disables the cache
+DNS_CACHE_TTL = float(os.getenv("DNS_CACHE_TTL", 300))
+
+
+class PoolStats:
+    """Counts requests and newly opened connections for one upstream."""
+
+    def __init__(self):
+        self.requests = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def record_connection(self):
+        with self._lock:
+            self.connections += 1
+
+    def snapshot(self):
+        reused = max(self.requests - self.connections, 0)
+        return {
+            "requests": self.requests,
+            "new_connections": self.connections,
+            "reused_connections": reused,
+            "reuse_rate": round(reused / self.requests, 3) if self.requests else None
+        }
+
+
+gemini_stats = PoolStats()
+instagram_stats = PoolStats()
+
+
+# DNS cache
+class DNSCache:
+    """TTL cache of the addresses a host resolves to, for the pooled connections below."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def addresses(self, host, port):
+        """Returns the IP addresses to try for host, in resolver order; raises socket.gaierror like getaddrinfo."""
+        try:
+            ipaddress.ip_address(host)
+            return [host]
+        except ValueError:
+            pass
+        key = (host, port)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = (now + self.ttl, addresses)
+        return addresses
+
+    def forget(self, host, port):
+        """Drops a cached answer, e.g. after none of its addresses accepted a connection."""
+        with self._lock:
+            self._entries.pop((host, port), None)
+
+    def snapshot(self):
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "ttl": self.ttl,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None
+        }
+
+
+dns_cache = DNSCache(DNS_CACHE_TTL)
+
+
+# Gemini (httpx via google-genai)
+def http2_available():
+    if not HTTP2_ENABLED:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _trace_connections(event_name, info):
+    if event_name == "connection.connect_tcp.complete":
+        gemini_stats.record_connection()
+
+
+def _count_gemini_request(request):
+    gemini_stats.record_request()
+    request.extensions["trace"] = _trace_connections
+
+
+def _cached_dns_backend(backend):
+    """Wraps an httpcore network backend so TCP connects go through dns_cache; TLS still verifies the host name."""
+    import httpcore
+
+    class CachedDNSBackend(httpcore.NetworkBackend):
+        def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+            try:
+                addresses = dns_cache.addresses(host, port)
+            except OSError:
+                # Let the backend raise its own resolution error
+                return backend.connect_tcp(host, port, timeout, local_address, socket_options)
+            error = None
+            for address in addresses:
+                try:
+                    return backend.connect_tcp(address, port, timeout, local_address, socket_options)
+                except (httpcore.ConnectError, httpcore.ConnectTimeout) as e:
+                    error = e
+            dns_cache.forget(host, port)
+            raise error
+
+        def connect_unix_socket(self, path, timeout=None, socket_options=None):
+            return backend.connect_unix_socket(path, timeout, socket_options)
+
+        def sleep(self, seconds):
+            backend.sleep(seconds)
+
+    return CachedDNSBackend()
+
+
+def gemini_transport():
+    """The pooled httpx transport for Gemini, resolving hosts through dns_cache."""
+    import httpx, httpcore
+
+    transport = httpx.HTTPTransport(
+        http2=http2_available(),
+        limits=httpx.Limits(
+            max_connections=HTTP_POOL_HOSTS * HTTP_POOL_MAXSIZE,
+            max_keepalive_connections=HTTP_POOL_MAXSIZE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+        )
+    )
+    # httpx has no public hook for the network backend; only this transport's pool is affected
+    pool = getattr(transport, "_pool", None)
+    if dns_cache.enabled and isinstance(pool, httpcore.ConnectionPool) and hasattr(pool, "_network_backend"):
+        pool._network_backend = _cached_dns_backend(pool._network_backend)
+    return transport
+
+
+def gemini_client_args():
+    """httpx.Client keyword arguments for the shared Gemini client."""
+    return {
+        "transport": gemini_transport(),
+        "event_hooks": {"request": [_count_gemini_request]}
+    }
+
+
+_genai_clients = {}
+_genai_lock = threading.Lock()
+
+
+def get_genai_client(api_key):
+    """Returns the process-wide genai.Client for api_key, built once on the pooled transport."""
+    client = _genai_clients.get(api_key)
+    if client is not None:
+        return client
+    with _genai_lock:
+        if api_key not in _genai_clients:
+            from google import genai
+            from google.genai import types
+
+            try:
+                client = genai.Client(
+                    api_key=api_key,
+                    http_options=types.HttpOptions(client_args=gemini_client_args())
+                )
+            except Exception as e:
+                # Older google-genai releases don't accept client_args; still share one client
+                logger.warning(f"Falling back to the default Gemini transport: {e}")
+                client = genai.Client(api_key=api_key)
+            _genai_clients[api_key] = client
+        return _genai_clients[api_key]
+
+
+# Instagram (requests via instagrapi)
+_instagram_adapter = None
+_adapter_lock = threading.Lock()
+
+
+def _instagram_adapter_for(max_retries):
+    """One pooled adapter shared by every instagrapi session in the process."""
+    global _instagram_adapter
+    if _instagram_adapter is None:
+        with _adapter_lock:
+            if _instagram_adapter is None:
+                from requests.adapters import HTTPAdapter
+
+                class CountingAdapter(HTTPAdapter):
+                    def send(self, request, **kwargs):
+                        instagram_stats.record_request()
+                        return super().send(request, **kwargs)
+
+                    def init_poolmanager(self, *args, **kwargs):
+                        super().init_poolmanager(*args, **kwargs)
+                        self.poolmanager.pool_classes_by_scheme = {
+                            scheme: _counting_pool(pool_class)
+                            for scheme, pool_class in self.poolmanager.pool_classes_by_scheme.items()
+                        }
+
+                _instagram_adapter = CountingAdapter(
+                    pool_connections=HTTP_POOL_HOSTS,
+                    pool_maxsize=HTTP_POOL_MAXSIZE,
+                    max_retries=max_retries
+                )
+    return _instagram_adapter
+
+
+_counting_pools = {}
+
+
+def _cached_dns_connection(connection_class):
+    """Subclass of a urllib3 connection that resolves its host through dns_cache; TLS still verifies the host name."""
+    from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+    class CachedDNSConnection(connection_class):
+        def _new_conn(self):
+            host = self._dns_host
+            try:
+                addresses = dns_cache.addresses(host, self.port)
+            except OSError:
+                # Let urllib3 raise its own NameResolutionError
+                return super()._new_conn()
+            error = None
+            try:
+                for address in addresses:
+                    self._dns_host = address
+                    try:
+                        return super()._new_conn()
+                    except (NewConnectionError, ConnectTimeoutError) as e:
+                        error = e
+            finally:
+                self._dns_host = host
+            dns_cache.forget(host, self.port)
+            raise error
+
+    return CachedDNSConnection
+
+
+def _counting_pool(pool_class):
+    """Subclass of a urllib3 connection pool that counts newly opened connections (and resolves through dns_cache)."""
+    if pool_class not in _counting_pools:
+        class CountingPool(pool_class):
+            if dns_cache.enabled:
+                ConnectionCls = _cached_dns_connection(pool_class.ConnectionCls)
+
+            def _new_conn(self):
+                instagram_stats.record_connection()
+                return super()._new_conn()
+
+        _counting_pools[pool_class] = CountingPool
+    return _counting_pools[pool_class]
+
+
+def configure_instagram_client(cl):
+    """Mounts the shared pooled adapter on an instagrapi Client's private and public sessions."""
+    for session in (getattr(cl, "private", None), getattr(cl, "public", None)):
+        if session is None:
+            continue
+        # Keep instagrapi's own retry policy
+        max_retries = session.get_adapter("https://").max_retries
+        adapter = _instagram_adapter_for(max_retries)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+    return cl
+
+
+def stats():
+    """Connection reuse and DNS cache statistics for the shared pools."""
+    return {
+        "gemini": dict(gemini_stats.snapshot(), http2=http2_available()),
+        "instagram": instagram_stats.snapshot(),
+        "dns": dns_cache.snapshot(),
+        "limits": {"hosts": HTTP_POOL_HOSTS, "per_host": HTTP_POOL_MAXSIZE, "keepalive_expiry": HTTP_KEEPALIVE_EXPIRY}
+    }
@@ -2,14 +2,16 @@ import os
 from dotenv import load_dotenv
 from instagrapi import Client
 
+from src.state import get_state
+from src.http_pool import configure_instagram_client
+
 load_dotenv()
 
 def login():
     """Uses the instagrapi to login to the user's accounts and creates a session.json which can be reused later to login directly without having to execute this method and hence prevent possible flagging as a bot."""
     username = os.getenv("IG_USERNAME")
-    password = os.getenv("IG_PASSWORD")    
-    print(username)
-    print(password)
-    cl = Client()
+    password = os.getenv("IG_PASSWORD")
+    cl = configure_instagram_client(Client())
     cl.login(username, password)
     cl.dump_settings("session.json")
+    get_state().save_session(username, cl.get_settings())
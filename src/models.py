@@ -18,11 +18,26 @@ class ImageProcessRequest(BaseModel):
     custom_caption: Optional[str] = None
     watermark_text: Optional[str] = "©PnC"
     watermark_opacity: Optional[int] = 128
+    renditions: Optional[List[str]] = None
 
 class BatchProcessRequest(BaseModel):
     filenames: List[str]
     watermark_text: Optional[str] = "©PnC"
     watermark_opacity: Optional[int] = 128
+    renditions: Optional[List[str]] = None
+
+class UploadCreateRequest(BaseModel):
+    filename: str
+    length: int
+    content_type: Optional[str] = "image/jpeg"
+    checksum: Optional[str] = None
+
+class UploadFinalizeRequest(BaseModel):
+    process: bool = False
+    custom_caption: Optional[str] = None
+    watermark_text: Optional[str] = "©PnC"
+    watermark_opacity: Optional[int] = 128
+    renditions: Optional[List[str]] = None
 
 class InstagramLoginRequest(BaseModel):
     username: str
@@ -30,4 +45,19 @@ class InstagramLoginRequest(BaseModel):
 
 class InstagramPostRequest(BaseModel):
     filename: str
-    custom_caption: Optional[str] = None
\ No newline at end of file
+    custom_caption: Optional[str] = None
+    rendition: Optional[str] = "feed"
+    username: Optional[str] = None
+
+class SchedulerAccountRequest(BaseModel):
+    slots: Optional[List[str]] = None
+    daily_quota: Optional[int] = None
+    min_spacing_minutes: Optional[int] = None
+    jitter_minutes: Optional[int] = None
+    rendition: Optional[str] = None
+    timezone: Optional[str] = None
+    enabled: Optional[bool] = None
+
+class ScheduleEntryUpdate(BaseModel):
+    run_at: Optional[str] = None
+    filename: Optional[str] = None
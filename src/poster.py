@@ -1,44 +1,67 @@
-import os, glob, logging
-from instagrapi import Client
+import logging
+from typing import TYPE_CHECKING
+
+from src.state import get_state, ledger_key, normalize_ledger_key, LockNotAcquired
+from src.storage import get_storage
+
+if TYPE_CHECKING:
+    from instagrapi import Client
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s - %(message)s')
 
 
 OUTPUT_FOLDER = 'pics'
+# Posted ledger lives in the shared state backend (src/state.py); this file is only imported from once
 POSTED_LIST_FILE = 'pics.txt'
+# Upper bound on how long a single upload may hold its per-image post lock
+POST_LOCK_TTL = 300
 
 HASHTAGS = "\n\n\n\n\n#ArtofVisuals #InstaPhotography #CreativeStudio #ExploreToCreate #DigitalArtist #MinimalDesign #TypographyLove #ContentCreator #ExplorePage"
 
 def load_posted_pics():
-    """Loads the list of previously posted image filenames from a text file, returning them as a list. If the file does not exist or cannot be read, returns an empty list.Loads the list of previously posted image filenames from a text file, returning them as a list. If the file does not exist or cannot be read, returns an empty list."""
-    try:
-        with open(POSTED_LIST_FILE, "r", encoding="utf8") as f:
-            return f.read().splitlines()
-    except Exception:
-        return []
+    """Loads the list of previously posted image paths from the shared posted ledger, in posting order."""
+    return list(dict.fromkeys(normalize_ledger_key(key) for key in get_state().posted()))
 
 def save_posted_pic(pic):
-    """Appends the given image filename to the list of posted images in the text file to keep track of uploaded posts."""
-    with open(POSTED_LIST_FILE, "a", encoding="utf8") as f:
-        f.write(pic + "\n")
+    """Records the given image path in the shared posted ledger. Returns False if it was already recorded."""
+    return get_state().mark_posted(pic)
 
-def post_new_image(cl: Client, posted_pic_list):
-    """Scans the output folder for unposted JPG images, uploads the first unposted image to Instagram with a generated caption, and records it in the posted list. Returns True if a post was successfully uploaded, otherwise False."""
-    pics = sorted(glob.glob(os.path.join(OUTPUT_FOLDER, "*.jpg")))
+def post_new_image(cl: "Client", posted_pic_list):
+    """Walks the output storage for unposted feed images, oldest first, uploads the first one to Instagram with a generated caption, and records it in the posted list. Returns True if a post was successfully uploaded, otherwise False."""
+    from src.process_image import caption_from_filename
 
-    for pic in pics:
+    storage = get_storage(OUTPUT_FOLDER)
+    posted_pic_list = set(posted_pic_list)
+
+    for name in storage.unposted(lambda name: "/" not in name):
+        pic = ledger_key(name, OUTPUT_FOLDER)
         if pic in posted_pic_list:
             continue
 
-        pic_name = os.path.basename(pic)
-        caption = os.path.splitext(pic_name)[0].replace("_", " ") + HASHTAGS
+        caption = caption_from_filename(pic) + HASHTAGS
 
         try:
-            cl.photo_upload(pic, caption)
-            save_posted_pic(pic)
-            return True
+            # Another worker or replica may be posting the same image right now
+            with get_state().lock(f"post:{pic}", ttl=POST_LOCK_TTL):
+                if get_state().is_posted(pic):
+                    continue
+                with storage.reading(name) as local_path:
+                    cl.photo_upload(local_path, caption)
+                save_posted_pic(pic)
+                storage.mark_posted(name)
+        except LockNotAcquired:
+            continue
         except Exception as e:
             return False
+
+        # Counts against the scheduler's quota and spacing; the post itself already succeeded
+        from src.scheduler import scheduler
+
+        try:
+            scheduler.record_post(cl.username)
+        except Exception as e:
+            logger.warning(f"Couldn't count post for {cl.username}: {e}")
+        return True
         
     return False
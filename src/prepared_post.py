@@ -0,0 +1,165 @@
+"""Prepared-post records: everything the post step needs, computed once while processing.
+
+render_image stores a record in each rendition's storage metadata, next to the
+image in pics/. It holds the final caption (with HASHTAGS), the pixel size,
+the byte size, a sha256 of the encoded JPEG and the upload parameters. At post
+time upload_prepared() reads the file once, checks the checksum and sends
+those exact bytes. instagrapi's photo_upload instead re-decodes the image,
+crops and re-encodes it in prepare_image(), opens it a second time for its
+dimensions, and sleeps a fixed 3 seconds before configuring.
+
+rupload() mirrors instagrapi's private upload call, so the prepared path is
+only taken with an instagrapi release it was checked against
+(SUPPORTED_INSTAGRAPI_VERSIONS). Records only describe images this server
+rendered; anything without a valid record, or any other instagrapi version,
+goes through instagrapi's regular photo_upload path.
+"""
+import os, sys, json, time, random, hashlib, logging
+from functools import lru_cache
+from importlib import metadata
+from uuid import uuid4
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s - %(message)s')
+
+
+RECORD_VERSION = 1
+# Seconds before the first configure call; instagrapi waits 3, and Instagram may reject a configure that comes sooner
+PREPARED_CONFIGURE_DELAY = float(os.getenv("PREPARED_CONFIGURE_DELAY", 3))
+PREPARED_CONFIGURE_RETRY_DELAY = float(os.getenv("PREPARED_CONFIGURE_RETRY_DELAY", 3))
+PREPARED_CONFIGURE_ATTEMPTS = 10
+# instagrapi releases whose photo_rupload rupload() was checked against
+SUPPORTED_INSTAGRAPI_VERSIONS = ("2.1.5",)
+
+# Instagram's limits, as applied by instagrapi's prepare_image(): (min, max) aspect ratio and max size
+UPLOAD_LIMITS = {
+    "feed": ((4 / 5, 90 / 47), (1080, 1350)),
+    "story": ((9 / 16, 90 / 47), (1080, 1920)),
+}
+MIN_UPLOAD_SIZE = (320, 167)
+
+
+class PreparedPostMismatch(Exception):
+    """The image in pics/ no longer matches its prepared-post record."""
+
+
+@lru_cache(maxsize=1)
+def rupload_supported():
+    """True when the installed instagrapi is one rupload() mirrors; checked once per process."""
+    module = sys.modules.get("instagrapi")
+    version = getattr(module, "__version__", None)
+    if version is None:
+        try:
+            version = metadata.version("instagrapi")
+        except metadata.PackageNotFoundError:
+            version = None
+    if version not in SUPPORTED_INSTAGRAPI_VERSIONS:
+        logger.warning(f"instagrapi {version} is not one prepared posts support ({', '.join(SUPPORTED_INSTAGRAPI_VERSIONS)}); posting through photo_upload")
+        return False
+    return True
+
+
+def upload_ready(rendition, width, height):
+    """True when instagrapi's prepare_image() would neither crop nor resize the image, so its bytes can be sent as is."""
+    if rendition not in UPLOAD_LIMITS:
+        return False
+    (min_ratio, max_ratio), (max_width, max_height) = UPLOAD_LIMITS[rendition]
+    ratio = width / height
+    return (
+        min_ratio <= ratio <= max_ratio
+        and width <= max_width and height <= max_height
+        and width >= MIN_UPLOAD_SIZE[0] and height >= MIN_UPLOAD_SIZE[1]
+    )
+
+
+def build_record(rendition, caption, width, height, data):
+    """The prepared-post record for one encoded rendition."""
+    return {
+        "version": RECORD_VERSION,
+        "rendition": rendition,
+        "caption": caption,
+        "width": width,
+        "height": height,
+        "size": len(data),
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "upload": {
+            "media_type": "image/jpeg",
+            "for_story": rendition == "story",
+            "ready": upload_ready(rendition, width, height)
+        }
+    }
+
+
+def prepared_record(entry):
+    """Returns the usable prepared-post record from a storage entry's metadata, or None."""
+    record = ((entry or {}).get("metadata") or {}).get("prepared")
+    if not record or record.get("version") != RECORD_VERSION or not record["upload"].get("ready"):
+        return None
+    if record["size"] != entry.get("size"):
+        return None
+    return record
+
+
+def read_verified(path, record):
+    """Reads the image once and checks it against the record's size and sha256."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) != record["size"] or hashlib.sha256(data).hexdigest() != record["sha256"]:
+        raise PreparedPostMismatch(f"{path} changed since it was prepared")
+    return data
+
+
+def rupload(cl, data):
+    """Sends already-prepared JPEG bytes to Instagram's upload endpoint; mirrors instagrapi 2.1.5's photo_rupload minus prepare_image."""
+    from instagrapi import config
+    from instagrapi.exceptions import PhotoNotUpload
+
+    upload_id = str(int(time.time() * 1000))
+    upload_name = f"{upload_id}_0_{random.randint(1000000000, 9999999999)}"
+    rupload_params = {
+        "retry_context": '{"num_step_auto_retry":0,"num_reupload":0,"num_step_manual_retry":0}',
+        "media_type": "1",
+        "xsharing_user_ids": "[]",
+        "upload_id": upload_id,
+        "image_compression": json.dumps({"lib_name": "moz", "lib_version": "3.1.m", "quality": "80"}),
+    }
+    headers = {
+        "Accept-Encoding": "gzip",
+        "X-Instagram-Rupload-Params": json.dumps(rupload_params),
+        "X_FB_PHOTO_WATERFALL_ID": str(uuid4()),
+        "X-Entity-Type": "image/jpeg",
+        "Offset": "0",
+        "X-Entity-Name": upload_name,
+        "X-Entity-Length": str(len(data)),
+        "Content-Type": "application/octet-stream",
+        "Content-Length": str(len(data)),
+    }
+    response = cl.private.post(f"https://{config.API_DOMAIN}/rupload_igphoto/{upload_name}", data=data, headers=headers)
+    cl.request_log(response)
+    if response.status_code != 200:
+        raise PhotoNotUpload(response.text, response=response, **cl.last_json)
+    return upload_id
+
+
+def upload_prepared(cl, path, record, caption):
+    """Posts a prepared image as a feed post or story; returns the instagrapi Media."""
+    from instagrapi.exceptions import PhotoConfigureError, PhotoConfigureStoryError
+    from instagrapi.extractors import extract_media_v1
+
+    data = read_verified(path, record)
+    for_story = record["upload"]["for_story"]
+    upload_id = rupload(cl, data)
+    configure = cl.photo_configure_to_story if for_story else cl.photo_configure
+
+    delay = PREPARED_CONFIGURE_DELAY
+    for attempt in range(PREPARED_CONFIGURE_ATTEMPTS):
+        if delay:
+            time.sleep(delay)
+        if configure(upload_id, record["width"], record["height"], caption):
+            media = cl.last_json.get("media")
+            cl.expose()
+            return extract_media_v1(media)
+        logger.debug(f"Configure attempt #{attempt} for {path} not accepted yet")
+        delay = PREPARED_CONFIGURE_RETRY_DELAY
+    error = PhotoConfigureStoryError if for_story else PhotoConfigureError
+    raise error(response=cl.last_response, **cl.last_json)
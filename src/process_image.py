@@ -1,15 +1,16 @@
 import os, re, logging, coloredlogs
 from PIL import Image, ImageOps, ImageDraw, ImageFont
-from google import genai
+
+from src.http_pool import get_genai_client
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s - %(message)s')
 
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-INPUT_FOLDER = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'input_images')
-OUTPUT_FOLDER = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'pics')
-os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+
+WATERMARK_FONT_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "fonts", "Heavitas.ttf")
+WATERMARK_FONT_SIZE = 15
 
 INSTAGRAM_SIZES = {
     'square': (1080, 1080),
@@ -17,9 +18,17 @@ INSTAGRAM_SIZES = {
     'portrait': (1080, 1350)
 }
 
+# Extra canvases rendered from the same decoded source; 'feed' uses INSTAGRAM_SIZES by orientation
+RENDITION_SIZES = {
+    'story': (1080, 1920),
+    'reel_cover': (1080, 1920)
+}
+RENDITIONS = ['feed'] + list(RENDITION_SIZES)
+RENDITIONS_SUBFOLDER = 'renditions'
+
 def generate_caption(prompt):
     """Generates an Instagram-style caption using Gemini LLM based on the description inferred from the image filename."""
-    client = genai.Client(api_key=GEMINI_API_KEY)
+    client = get_genai_client(GEMINI_API_KEY)
     response = client.models.generate_content(
         model="gemini-2.0-flash",
         contents=prompt
@@ -37,15 +46,19 @@ def sanitize_filename(text):
     """Converts a string into a filesystem-safe filename by removing special characters and limiting length."""
     return "".join(c if c.isalnum() or c in (' ', '-', '_', '#') else '' for c in text).strip().replace(" ", "_")[:100]
 
-def add_watermark(image, text="©PnC", opacity=128, margin=(20, 20), font_size=15):
+def caption_from_filename(filename):
+    """Rebuilds the caption encoded in a processed image's filename, dropping any collision suffix."""
+    stem = re.sub(r'__[0-9a-f]{8,64}$', '', os.path.splitext(os.path.basename(filename))[0])
+    return stem.replace("_", " ")
+
+def add_watermark(image, text="©PnC", opacity=128, margin=(20, 20), font_size=WATERMARK_FONT_SIZE):
     """Adds a semi-transparent watermark to the bottom-center of an image using a specified font."""
     if image.mode != 'RGBA':
         image = image.convert('RGBA')
     watermark_layer = Image.new('RGBA', image.size, (0, 0, 0, 0))
     draw = ImageDraw.Draw(watermark_layer)
-    font_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "fonts", "Heavitas.ttf")
     try:
-        font = ImageFont.truetype(font_path, font_size)
+        font = ImageFont.truetype(WATERMARK_FONT_PATH, font_size)
     except IOError:
         font = ImageFont.load_default()
     text_size = draw.textbbox((0, 0), text, font=font)
@@ -92,36 +105,77 @@ def resize_and_center(image, orientation):
     canvas.paste(image, (offset_x, offset_y))
     return canvas
 
+def fit_to_canvas(image, size):
+    """Scales an image to fit entirely inside a white canvas of the given size, centered."""
+    target_width, target_height = size
+    scale = min(target_width / image.width, target_height / image.height)
+    resized = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))), Image.LANCZOS)
+    canvas = Image.new('RGB', size, (255, 255, 255))
+    canvas.paste(resized, ((target_width - resized.width) // 2, (target_height - resized.height) // 2))
+    return canvas
+
+def fill_canvas(image, size):
+    """Scales and center-crops an image so it covers the whole canvas of the given size."""
+    return ImageOps.fit(image, size, Image.LANCZOS)
+
+def render_rendition(image, rendition):
+    """Renders one rendition canvas from an already transposed and watermarked image. Returns (canvas, orientation)."""
+    orientation = get_orientation(image)
+    if rendition == 'feed':
+        return resize_and_center(image, orientation), orientation
+    if rendition == 'story':
+        return fit_to_canvas(image, RENDITION_SIZES['story']), orientation
+    if rendition == 'reel_cover':
+        return fill_canvas(image, RENDITION_SIZES['reel_cover']), orientation
+    raise ValueError(f"Unknown rendition: {rendition}")
+
+def rendition_name(output_filename, rendition):
+    """Returns the storage name of a rendition; the feed rendition is the processed image itself (<name>.jpg)."""
+    if rendition == 'feed':
+        return output_filename
+    stem = os.path.splitext(output_filename)[0]
+    return f"{RENDITIONS_SUBFOLDER}/{stem}/{rendition}.jpg"
+
 def process_input_images():
-    """Processes all images in the input folder by watermarking, resizing, generating captions, saving with clean filenames, and removing originals."""
+    """Processes all images in input storage by watermarking, resizing, generating captions, saving them to pics storage under clean names, and removing originals."""
+    from src.storage import get_storage
+    from src.result_cache import content_digest, reserve_output_name
+
     logger.info("Processing input images...")
-    for filename in os.listdir(INPUT_FOLDER):
-        if filename.lower().endswith(('.jpg', '.jpeg', '.png')):
-            logger.info(f"Processing file: {filename}")
-            input_path = os.path.join(INPUT_FOLDER, filename)
-            try:
+    input_storage = get_storage("input_images")
+    pics_storage = get_storage("pics")
+    for entry in input_storage.list():
+        filename = entry["name"]
+        if "/" in filename or not filename.lower().endswith(('.jpg', '.jpeg', '.png')):
+            continue
+        logger.info(f"Processing file: {filename}")
+        output_filename = None
+        try:
+            with input_storage.reading(filename) as input_path:
                 with Image.open(input_path) as img:
                     img = ImageOps.exif_transpose(img)
                     img = add_watermark(img)
                     orientation = get_orientation(img)
                     img = resize_and_center(img, orientation)
 
+                prompt = f"Write a cool Instagram caption for this photo described as {os.path.splitext(filename)[0]}\nOnly generate the caption nothing else."
+                caption = generate_caption(prompt)
+                if not caption:
+                    raise ValueError("Caption generation failed")
 
-                    prompt = f"Write a cool Instagram caption for this photo described as {os.path.splitext(filename)[0]}\nOnly generate the caption nothing else."
-                    caption = generate_caption(prompt)
-                    if not caption:
-                        raise ValueError("Caption generation failed")
-
-                    caption = remove_hashtags(caption)
-                    clean_name = sanitize_filename(caption)
-                    output_filename = f"{clean_name}.jpg"
-                    output_path = os.path.join(OUTPUT_FOLDER, output_filename)
+                caption = remove_hashtags(caption)
+                clean_name = sanitize_filename(caption)
+                # Never replace an existing (possibly posted) image with the same caption
+                output_filename = reserve_output_name(pics_storage, clean_name, content_digest(input_path))
 
-                    img.save(output_path, format='JPEG', quality=95)
-                    logger.info(f"Saved processed image as: {output_filename}")
+            with pics_storage.writing(output_filename) as output_path:
+                img.save(output_path, format='JPEG', quality=95)
+            logger.info(f"Saved processed image as: {output_filename}")
 
-                os.remove(input_path)
-                logger.info(f"Deleted original file: {filename}")
+            input_storage.delete(filename)
+            logger.info(f"Deleted original file: {filename}")
 
-            except Exception as e:
-                logger.error(f"Failed to process {filename}: {e}")
\ No newline at end of file
+        except Exception as e:
+            if output_filename and not pics_storage.exists(output_filename):
+                pics_storage.release(output_filename)
+            logger.error(f"Failed to process {filename}: {e}")
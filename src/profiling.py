@@ -0,0 +1,391 @@
+"""Sampling profiler for live requests and time-boxed whole-process sessions.
+
+Profiling is only available when PROFILING_ADMIN_TOKEN is set, and every use
+needs that token in the X-Admin-Token header. A request opts in with an
+X-Profile: 1 header or ?profile=1; its response then carries an X-Profile-Id
+to fetch from /admin/profiles/{id} as speedscope JSON or collapsed stacks
+(flamegraph.pl, inferno, speedscope all read those).
+
+The sampler is a background thread reading sys._current_frames(), so nothing
+is instrumented: without an opted-in request or a running session there is no
+sampling thread, and without PROFILING_ADMIN_TOKEN the middleware is not even
+installed.
+
+A profile samples the worker process that runs it. Profiles are published to
+the shared state backend when they start and finish, so any worker can list,
+download or stop them. Only one whole-process session runs at a time across
+all workers.
+"""
+import os, sys, hmac, time, uuid, asyncio, logging, threading
+from collections import Counter, OrderedDict
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s - %(message)s')
+
+
+PROFILING_ADMIN_TOKEN = os.getenv("PROFILING_ADMIN_TOKEN")
+PROFILING_ENABLED = bool(PROFILING_ADMIN_TOKEN)
+PROFILING_INTERVAL_MS = float(os.getenv("PROFILING_INTERVAL_MS", 5))
+# Upper bound for whole-process sessions and for a single profiled request
+PROFILING_MAX_DURATION = float(os.getenv("PROFILING_MAX_DURATION", 60))
+# Profiles kept in the shared state; the oldest finished ones are dropped first
+PROFILING_MAX_STORED = int(os.getenv("PROFILING_MAX_STORED", 20))
+# Also write every finished profile here as <id>.speedscope.json
+PROFILING_DIR = os.getenv("PROFILING_DIR")
+
+RECORD_PREFIX = "profiling:profile:"
+INDEX_KEY = "profiling:index"
+STOP_PREFIX = "profiling:stop:"
+SESSION_LOCK = "profiling:session"
+# How often a running profile checks whether another worker asked it to stop
+STOP_CHECK_INTERVAL = 0.25
+
+PROFILE_HEADER = b"x-profile"
+TOKEN_HEADER = b"x-admin-token"
+
+# Leaf frames of threads waiting for work; left out unless include_idle is set
+IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+
+def check_admin_token(token):
+    """True when profiling is enabled and token matches PROFILING_ADMIN_TOKEN."""
+    if not PROFILING_ENABLED or not token:
+        return False
+    return hmac.compare_digest(token.encode("utf8"), PROFILING_ADMIN_TOKEN.encode("utf8"))
+
+
+class Profile:
+    """Stack samples of every thread, collected by a sampler thread between start() and stop()."""
+
+    def __init__(self, name, kind, interval_ms=PROFILING_INTERVAL_MS, max_duration=PROFILING_MAX_DURATION, include_idle=False):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.kind = kind
+        self.interval = max(interval_ms, 0.5) / 1000
+        self.max_duration = min(max_duration, PROFILING_MAX_DURATION)
+        self.include_idle = include_idle
+        self.started_at = None
+        self.started = None
+        self.ended = None
+        self.sample_count = 0
+        # {thread name: Counter({(frame key, ...): seconds})}
+        self.stacks = {}
+        self.frames = {}
+        # Loaded from the shared state rather than sampled in this process
+        self.remote = False
+        self.remote_running = False
+        self.session_token = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self.remote_running or (self._thread is not None and self.ended is None)
+
+    @property
+    def duration(self):
+        if self.started is None:
+            return 0.0
+        return (self.ended or time.perf_counter()) - self.started
+
+    def start(self):
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name=f"profiler-{self.id}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        return self
+
+    def _run(self):
+        me = threading.get_ident()
+        last = last_check = time.perf_counter()
+        deadline = self.started + self.max_duration
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            self._sample(me, now - last)
+            last = now
+            if now >= deadline:
+                break
+            if now - last_check >= STOP_CHECK_INTERVAL:
+                last_check = now
+                if profile_store.stop_requested(self.id):
+                    break
+        self.ended = time.perf_counter()
+        profile_store.finish(self)
+
+    def _sample(self, sampler_ident, weight):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        with self._lock:
+            for ident, frame in sys._current_frames().items():
+                if ident == sampler_ident or names.get(ident, "").startswith("profiler-"):
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    key = (code.co_filename, code.co_name, code.co_firstlineno)
+                    if key not in self.frames:
+                        self.frames[key] = len(self.frames)
+                    stack.append(key)
+                    frame = frame.f_back
+                if not stack:
+                    continue
+                if not self.include_idle and (os.path.basename(stack[0][0]), stack[0][1]) in IDLE_FRAMES:
+                    continue
+                stack.reverse()
+                thread_name = names.get(ident, f"thread-{ident}")
+                self.stacks.setdefault(thread_name, Counter())[tuple(stack)] += weight
+            self.sample_count += 1
+
+    def summary(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "kind": self.kind,
+            "running": self.running,
+            "started_at": self.started_at,
+            "duration_s": round(self.duration, 3),
+            "interval_ms": self.interval * 1000,
+            "samples": self.sample_count,
+            "threads": sorted(self.stacks)
+        }
+
+    def to_record(self):
+        """The profile as a JSON-compatible value for the shared state."""
+        with self._lock:
+            return {
+                "summary": self.summary(),
+                "frames": [list(key) for key, _ in sorted(self.frames.items(), key=lambda item: item[1])],
+                "stacks": {
+                    thread_name: [[[self.frames[key] for key in stack], seconds] for stack, seconds in stacks.items()]
+                    for thread_name, stacks in self.stacks.items()
+                }
+            }
+
+    @classmethod
+    def from_record(cls, record):
+        """Rebuilds a profile published by any worker; it can be exported but not stopped directly."""
+        summary = record["summary"]
+        profile = cls(summary["name"], summary["kind"], summary["interval_ms"])
+        profile.id = summary["id"]
+        profile.started_at = summary["started_at"]
+        profile.started, profile.ended = 0.0, summary["duration_s"]
+        profile.sample_count = summary["samples"]
+        profile.remote = True
+        profile.remote_running = _still_running(summary)
+        frames = [tuple(key) for key in record.get("frames", [])]
+        profile.frames = {key: index for index, key in enumerate(frames)}
+        profile.stacks = {
+            thread_name: Counter({tuple(frames[index] for index in stack): seconds for stack, seconds in stacks})
+            for thread_name, stacks in record.get("stacks", {}).items()
+        }
+        return profile
+
+    def collapsed(self):
+        """Collapsed stacks ("thread;outer;inner weight_ms" per line) for flamegraph.pl, inferno or speedscope."""
+        lines = []
+        with self._lock:
+            for thread_name, stacks in sorted(self.stacks.items()):
+                for stack, seconds in stacks.items():
+                    path = ";".join([thread_name.replace(";", ":")] + [frame_label(key) for key in stack])
+                    lines.append(f"{path} {max(int(round(seconds * 1000)), 1)}")
+        return "\n".join(sorted(lines)) + "\n"
+
+    def speedscope(self):
+        """speedscope's file format: shared frames plus one sampled profile per thread."""
+        with self._lock:
+            frames = sorted(self.frames.items(), key=lambda item: item[1])
+            profiles = []
+            for thread_name, stacks in sorted(self.stacks.items()):
+                samples = [[self.frames[key] for key in stack] for stack in stacks]
+                weights = [round(seconds, 6) for seconds in stacks.values()]
+                profiles.append({
+                    "type": "sampled",
+                    "name": thread_name,
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": round(sum(weights), 6),
+                    "samples": samples,
+                    "weights": weights
+                })
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": self.name,
+            "exporter": "gramgateway",
+            "activeProfileIndex": 0,
+            "shared": {"frames": [{"name": key[1], "file": key[0], "line": key[2]} for key, _ in frames]},
+            "profiles": profiles
+        }
+
+
+def frame_label(key):
+    filename, name, line = key
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+def _still_running(summary):
+    """Whether a published profile is still sampling; a worker that died mid-profile leaves it marked running."""
+    return summary["running"] and time.time() - summary["started_at"] < PROFILING_MAX_DURATION + 10
+
+
+class ProfileStore:
+    """Profiles published to the shared state backend, oldest first; profiles running in this process are also kept locally."""
+
+    def __init__(self, capacity=PROFILING_MAX_STORED):
+        self.capacity = capacity
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _publish(self, profile):
+        from src.state import get_state
+
+        state = get_state()
+        state.set_value(RECORD_PREFIX + profile.id, profile.to_record())
+        with state.lock(INDEX_KEY, ttl=10, wait=5):
+            index = state.get_value(INDEX_KEY, [])
+            if profile.id not in index:
+                index.append(profile.id)
+            # Drop the oldest finished profiles beyond capacity
+            while len(index) > self.capacity:
+                record = state.get_value(RECORD_PREFIX + index[0])
+                if record is not None and _still_running(record["summary"]):
+                    break
+                state.delete_value(RECORD_PREFIX + index.pop(0))
+            state.set_value(INDEX_KEY, index)
+
+    def add(self, profile):
+        with self._lock:
+            self._local[profile.id] = profile
+        self._publish(profile)
+        return profile
+
+    def get(self, profile_id):
+        """The local profile if it runs here, otherwise the published one, or None."""
+        from src.state import get_state
+
+        profile = self._local.get(profile_id)
+        if profile is not None:
+            return profile
+        record = get_state().get_value(RECORD_PREFIX + profile_id)
+        return Profile.from_record(record) if record is not None else None
+
+    def list(self):
+        from src.state import get_state
+
+        state = get_state()
+        summaries = []
+        for profile_id in state.get_value(INDEX_KEY, []):
+            local = self._local.get(profile_id)
+            if local is not None:
+                summaries.append(local.summary())
+                continue
+            record = state.get_value(RECORD_PREFIX + profile_id)
+            if record is not None:
+                summaries.append(record["summary"])
+        return summaries
+
+    def request_stop(self, profile):
+        """Stops a profile here, or asks the worker running it to stop."""
+        from src.state import get_state
+
+        if not profile.remote:
+            return profile.stop()
+        get_state().set_value(STOP_PREFIX + profile.id, True)
+        return profile
+
+    def stop_requested(self, profile_id):
+        from src.state import get_state
+
+        return bool(get_state().get_value(STOP_PREFIX + profile_id))
+
+    def finish(self, profile):
+        """Publishes a finished profile and frees its session slot; runs on the sampler thread."""
+        from src.state import get_state
+
+        state = get_state()
+        try:
+            self._publish(profile)
+            state.delete_value(STOP_PREFIX + profile.id)
+            if profile.session_token:
+                state.release_lock(SESSION_LOCK, profile.session_token)
+        except Exception as e:
+            logger.warning(f"Could not publish profile {profile.id}: {e}")
+        with self._lock:
+            self._local.pop(profile.id, None)
+
+        if not PROFILING_DIR:
+            return
+        from src.serialization import dumps
+
+        try:
+            os.makedirs(PROFILING_DIR, exist_ok=True)
+            with open(os.path.join(PROFILING_DIR, f"{profile.id}.speedscope.json"), "wb") as f:
+                f.write(dumps(profile.speedscope()))
+        except OSError as e:
+            logger.warning(f"Could not write profile {profile.id}: {e}")
+
+
+profile_store = ProfileStore()
+
+
+def start_session(duration, interval_ms=PROFILING_INTERVAL_MS, include_idle=False):
+    """Starts a time-boxed profile of this worker process; only one session runs at a time across all workers."""
+    from src.state import get_state
+
+    duration = min(duration, PROFILING_MAX_DURATION)
+    # Expires on its own if this worker dies mid-session
+    token = get_state().acquire_lock(SESSION_LOCK, duration + 10)
+    if token is None:
+        raise RuntimeError("A profiling session is already running")
+    profile = Profile(f"session {duration:g}s (pid {os.getpid()})", "session", interval_ms, duration, include_idle)
+    profile.session_token = token
+    return profile_store.add(profile.start())
+
+
+class ProfilingMiddleware:
+    """ASGI middleware that profiles requests sent with X-Profile: 1 (or ?profile=1) and a valid X-Admin-Token."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._opted_in(scope):
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        if not check_admin_token(headers.get(TOKEN_HEADER, b"").decode("latin1")):
+            return await self.app(scope, receive, send)
+
+        profile = await asyncio.to_thread(profile_store.add, Profile(f"{scope['method']} {scope['path']}", "request").start())
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-profile-id", profile.id.encode("ascii"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            await asyncio.to_thread(profile.stop)
+            logger.info(f"Profiled {profile.name} in {profile.duration:.3f}s ({profile.sample_count} samples): {profile.id}")
+
+    @staticmethod
+    def _opted_in(scope):
+        for name, value in scope["headers"]:
+            if name == PROFILE_HEADER:
+                return value not in (b"", b"0", b"false")
+        query = scope.get("query_string", b"")
+        return b"profile=" in query and any(
+            part in (b"profile=1", b"profile=true") for part in query.split(b"&")
+        )
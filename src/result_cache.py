@@ -0,0 +1,184 @@
+import os, json, time, hashlib, logging
+
+from src.state import get_state
+from src.storage import get_storage
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s - %(message)s')
+
+
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+# Least recently used entries beyond this are forgotten (their images in pics/ are left alone)
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", 2000))
+
+ENTRY_PREFIX = "result_cache:entry:"
+# Queue of {"digest", "queued"} in insertion order, for eviction
+ORDER_QUEUE = "result_cache:order"
+LEGACY_INDEX_KEY = "result_cache:index"
+# A hit refreshes an entry's last use at most this often (seconds)
+TOUCH_INTERVAL = 60
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest
+
+
+def content_digest(input_path):
+    """Hash of the input bytes alone; names outputs when there is no result key."""
+    return _hash_file(input_path).hexdigest()
+
+
+def result_key(input_path, params):
+    """Content hash of the input bytes plus every parameter that affects the output image or caption."""
+    from src.process_image import INSTAGRAM_SIZES, RENDITION_SIZES, WATERMARK_FONT_PATH, WATERMARK_FONT_SIZE
+
+    digest = _hash_file(input_path)
+
+    try:
+        font_stat = os.stat(WATERMARK_FONT_PATH)
+        font = [os.path.basename(WATERMARK_FONT_PATH), font_stat.st_size, int(font_stat.st_mtime)]
+    except OSError:
+        font = None
+
+    digest.update(json.dumps({
+        "watermark_text": params.get("watermark_text"),
+        "watermark_opacity": params.get("watermark_opacity"),
+        "custom_caption": params.get("custom_caption"),
+        "renditions": params.get("renditions"),
+        "font": font,
+        "font_size": WATERMARK_FONT_SIZE,
+        "sizes": INSTAGRAM_SIZES,
+        "rendition_sizes": RENDITION_SIZES,
+    }, sort_keys=True).encode("utf8"))
+    return digest.hexdigest()
+
+
+def reserve_output_name(storage, clean_name, digest):
+    """Atomically claims <clean_name>.jpg in storage, falling back to <clean_name>__<hash prefix>.jpg on collision.
+
+    The suffix grows from 8 hex digits to the whole digest until a free name is found, so an existing output is never overwritten.
+    """
+    candidates = [f"{clean_name}.jpg"] + [f"{clean_name}__{digest[:length]}.jpg" for length in range(8, len(digest) + 1, 4)]
+    for candidate in candidates:
+        if storage.reserve(candidate):
+            return candidate
+    raise FileExistsError(f"No free output name for {clean_name}.jpg")
+
+
+class ResultCache:
+    """Maps content hashes to previously produced processing results, kept in the shared state backend.
+
+    Each result is its own state value, so lookups and stores of different
+    inputs never contend. Eviction uses the CLOCK approximation of LRU: digests
+    are queued in insertion order, and once there are more than max_entries the
+    oldest ones are evicted unless they were used since they were queued, in
+    which case they go to the back of the queue.
+    """
+
+    def __init__(self, area="pics", max_entries=RESULT_CACHE_MAX_ENTRIES):
+        self.area = area
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def _outputs_exist(self, entry):
+        storage = get_storage(self.area)
+        return all(storage.exists(name) for name in entry["outputs"])
+
+    def get(self, digest):
+        """Returns the cached result for digest, or None. Entries whose images were removed from pics/ are dropped."""
+        state = get_state()
+        entry = state.get_value(ENTRY_PREFIX + digest)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        if not self._outputs_exist(entry):
+            state.delete_value(ENTRY_PREFIX + digest)
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        now = time.time()
+        # Recency only needs to be coarse; don't rewrite the entry on every hit
+        if now - entry.get("last_used", 0) > TOUCH_INTERVAL:
+            state.set_value(ENTRY_PREFIX + digest, dict(entry, last_used=now))
+        return entry["result"]
+
+    def put(self, digest, result):
+        """Remembers a successful result; outputs are the rendition storage names."""
+        state = get_state()
+        outputs = list(result.get("renditions", {}).values()) or [result["processed_filename"]]
+        now = time.time()
+        is_new = state.get_value(ENTRY_PREFIX + digest) is None
+        state.set_value(ENTRY_PREFIX + digest, {"result": result, "outputs": outputs, "created": now, "last_used": now})
+        if is_new:
+            state.enqueue(ORDER_QUEUE, {"digest": digest, "queued": now})
+            self._evict()
+
+    def _evict(self):
+        state = get_state()
+        # Two passes at most: the first gives recently used entries a second chance, the second evicts them
+        for _ in range(2 * state.queue_size(ORDER_QUEUE)):
+            if state.queue_size(ORDER_QUEUE) <= self.max_entries:
+                return
+            item = state.dequeue(ORDER_QUEUE)
+            if item is None:
+                return
+            entry = state.get_value(ENTRY_PREFIX + item["digest"])
+            if entry is None:
+                continue
+            if entry.get("last_used", 0) > item["queued"]:
+                state.enqueue(ORDER_QUEUE, {"digest": item["digest"], "queued": time.time()})
+                continue
+            state.delete_value(ENTRY_PREFIX + item["digest"])
+
+    def _import_index(self):
+        """Moves entries from the single JSON index older versions kept into the eviction queue."""
+        state = get_state()
+        index = state.get_value(LEGACY_INDEX_KEY)
+        if index is None:
+            return
+        for digest, used in sorted(index.items(), key=lambda item: item[1]):
+            state.enqueue(ORDER_QUEUE, {"digest": digest, "queued": used})
+        state.delete_value(LEGACY_INDEX_KEY)
+
+    def prune(self):
+        """Drops every entry whose images no longer exist in pics/; returns how many were dropped."""
+        state = get_state()
+        self._import_index()
+        stale = 0
+        # Cycle the queue once, keeping live entries in their order
+        for _ in range(state.queue_size(ORDER_QUEUE)):
+            item = state.dequeue(ORDER_QUEUE)
+            if item is None:
+                break
+            entry = state.get_value(ENTRY_PREFIX + item["digest"])
+            if entry is not None and self._outputs_exist(entry):
+                state.enqueue(ORDER_QUEUE, item)
+                continue
+            state.delete_value(ENTRY_PREFIX + item["digest"])
+            stale += 1
+        if stale:
+            logger.info(f"Pruned {stale} result cache entries for images removed from {self.area}/")
+        return stale
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "enabled": RESULT_CACHE_ENABLED,
+            # Includes entries dropped on lookup until the next prune
+            "entries": get_state().queue_size(ORDER_QUEUE),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None
+        }
+
+
+result_cache = ResultCache()
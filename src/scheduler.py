@@ -0,0 +1,451 @@
+"""Posting scheduler: plans the unposted backlog in pics/ into per-account time slots and posts when they come due.
+
+Each account has daily slots, either points ("09:00") or engagement windows
+("18:00-20:30"), in its own timezone. It also has a daily quota, a minimum
+spacing between posts and a jitter. The plan only covers the next
+SCHEDULER_HORIZON_DAYS: the oldest unposted images go into the earliest free
+slots across all accounts, and the plan is topped up on every tick. Its size
+therefore depends on the slots, not on how many images are waiting, and the
+backlog is read lazily from the storage index.
+
+The plan, the account settings, the per-account post counts and a short
+history live in the shared state backend, so they survive restarts. Only
+one worker runs due posts at a time, guarded by a state lock. Posts made
+outside the scheduler (post_next, manual posts) are counted through
+record_post(), so they use up quota and respect spacing too.
+"""
+import os, time, uuid, random, logging
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from src.state import get_state, ledger_key, LockNotAcquired
+from src.storage import get_storage
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s - %(message)s')
+
+
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "false").lower() in ("1", "true", "yes")
+SCHEDULER_TIMEZONE = os.getenv("SCHEDULER_TIMEZONE", "UTC")
+SCHEDULER_HORIZON_DAYS = int(os.getenv("SCHEDULER_HORIZON_DAYS", 7))
+SCHEDULER_TICK_INTERVAL = float(os.getenv("SCHEDULER_TICK_INTERVAL", 30))
+# A planned post this late (e.g. the server was down) is dropped and its image replanned
+SCHEDULER_MISSED_GRACE = float(os.getenv("SCHEDULER_MISSED_GRACE", 3600))
+SCHEDULER_HISTORY = int(os.getenv("SCHEDULER_HISTORY", 200))
+
+ACCOUNTS_KEY = "scheduler:accounts"
+PLAN_KEY = "scheduler:plan"
+HISTORY_KEY = "scheduler:history"
+COUNTS_PREFIX = "scheduler:counts:"
+RUNNER_LOCK = "scheduler:runner"
+RUNNER_LOCK_TTL = 900
+
+ACCOUNT_DEFAULTS = {
+    "slots": ["09:00", "13:00", "19:00-21:00"],
+    "daily_quota": 3,
+    "min_spacing_minutes": 120,
+    "jitter_minutes": 10,
+    "rendition": "feed",
+    "timezone": None,
+    "enabled": True
+}
+
+
+class SchedulerError(Exception):
+    """An invalid scheduler change; status_code is the HTTP status to answer with."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def parse_slot(spec):
+    """Parses "HH:MM" or "HH:MM-HH:MM" into (start minute, end minute) of the day."""
+    def minute(text):
+        hours, _, minutes = text.strip().partition(":")
+        value = int(hours) * 60 + int(minutes or 0)
+        if not 0 <= value < 24 * 60:
+            raise ValueError
+        return value
+
+    try:
+        start, _, end = spec.partition("-")
+        start = minute(start)
+        end = minute(end) if end else start
+    except ValueError:
+        raise SchedulerError(f"Invalid slot: {spec} (expected HH:MM or HH:MM-HH:MM)")
+    if end < start:
+        raise SchedulerError(f"Slot window ends before it starts: {spec}")
+    return start, end
+
+
+def iter_unposted(rendition):
+    """Yields the feed filenames of unposted images that have the rendition, oldest first."""
+    from src.process_image import RENDITIONS_SUBFOLDER
+
+    if rendition == "feed":
+        match = lambda name: "/" not in name
+    else:
+        match = lambda name: name.startswith(f"{RENDITIONS_SUBFOLDER}/") and name.endswith(f"/{rendition}.jpg")
+    state = get_state()
+    for pic_name in get_storage("pics").unposted(match):
+        if state.is_posted(ledger_key(pic_name)):
+            continue
+        yield pic_name if rendition == "feed" else pic_name.split("/")[1] + ".jpg"
+
+
+def clock(minute):
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+
+def rendition_path(entry):
+    from src.process_image import rendition_name
+
+    return rendition_name(entry["filename"], entry["rendition"])
+
+
+def iso(timestamp, tz):
+    return datetime.fromtimestamp(timestamp, tz).isoformat(timespec="seconds")
+
+
+class PostScheduler:
+    """Plans and runs posts; every method reads and writes the shared state, so any worker can serve it."""
+
+    def __init__(self):
+        self.last_tick = None
+
+    # Accounts
+    def accounts(self):
+        return get_state().get_value(ACCOUNTS_KEY, {})
+
+    def set_account(self, username, settings):
+        """Creates or updates an account's schedule, then replans its open slots."""
+        account = dict(ACCOUNT_DEFAULTS, **self.accounts().get(username, {}))
+        account.update({key: value for key, value in settings.items() if value is not None})
+        for spec in account["slots"]:
+            parse_slot(spec)
+        if account["daily_quota"] < 0 or account["min_spacing_minutes"] < 0 or account["jitter_minutes"] < 0:
+            raise SchedulerError("daily_quota, min_spacing_minutes and jitter_minutes must not be negative")
+        if account["rendition"] not in ("feed", "story"):
+            raise SchedulerError("rendition must be feed or story")
+        try:
+            ZoneInfo(account["timezone"] or SCHEDULER_TIMEZONE)
+        except Exception:
+            raise SchedulerError(f"Unknown timezone: {account['timezone']}")
+
+        state = get_state()
+        with state.lock(ACCOUNTS_KEY, ttl=10, wait=5):
+            accounts = self.accounts()
+            accounts[username] = account
+            state.set_value(ACCOUNTS_KEY, accounts)
+        self.replan(username)
+        return account
+
+    def remove_account(self, username):
+        state = get_state()
+        with state.lock(ACCOUNTS_KEY, ttl=10, wait=5):
+            accounts = self.accounts()
+            if accounts.pop(username, None) is None:
+                raise SchedulerError(f"No schedule for account: {username}", 404)
+            state.set_value(ACCOUNTS_KEY, accounts)
+        self.replan(username)
+
+    def _tz(self, account):
+        return ZoneInfo(account.get("timezone") or SCHEDULER_TIMEZONE)
+
+    # Counts
+    def _counts(self, username, tz):
+        counts = get_state().get_value(COUNTS_PREFIX + username, {"days": {}, "last_post": None})
+        today = datetime.now(tz).date()
+        # Only the current planning horizon matters
+        counts["days"] = {day: n for day, n in counts["days"].items() if datetime.fromisoformat(day).date() >= today - timedelta(days=1)}
+        return counts
+
+    def record_post(self, username, posted_at=None):
+        """Counts a post against the account's quota and spacing, whichever path posted it."""
+        accounts = self.accounts()
+        if username not in accounts:
+            return
+        posted_at = posted_at or time.time()
+        tz = self._tz(accounts[username])
+        state = get_state()
+        try:
+            with state.lock(COUNTS_PREFIX + username, ttl=10, wait=5):
+                counts = self._counts(username, tz)
+                day = datetime.fromtimestamp(posted_at, tz).date().isoformat()
+                counts["days"][day] = counts["days"].get(day, 0) + 1
+                counts["last_post"] = max(counts["last_post"] or 0, posted_at)
+                state.set_value(COUNTS_PREFIX + username, counts)
+        except LockNotAcquired as e:
+            # The post went out either way; only the quota bookkeeping is behind
+            logger.warning(f"Couldn't count post for {username}: {e}")
+
+    # Plan
+    def _load_plan(self):
+        return get_state().get_value(PLAN_KEY, [])
+
+    def _save_plan(self, plan):
+        plan.sort(key=lambda entry: entry["run_at"])
+        get_state().set_value(PLAN_KEY, plan)
+
+    def _archive(self, entries):
+        if not entries:
+            return
+        state = get_state()
+        history = state.get_value(HISTORY_KEY, []) + entries
+        state.set_value(HISTORY_KEY, history[-SCHEDULER_HISTORY:])
+
+    def _slot_candidates(self, username, account, now, plan):
+        """Free (slot key, run_at) pairs for one account within the horizon, honouring quota and spacing."""
+        tz = self._tz(account)
+        counts = self._counts(username, tz)
+        spacing = account["min_spacing_minutes"] * 60
+        jitter = account["jitter_minutes"] * 60
+        mine = [entry for entry in plan if entry["account"] == username]
+        # A cancelled post keeps its slot empty, but no longer counts against quota or spacing
+        slot_keys = {entry["slot"] for entry in mine}
+        mine = [entry for entry in mine if entry["status"] != "cancelled"]
+        taken = [entry["run_at"] for entry in mine]
+        if counts["last_post"]:
+            taken.append(counts["last_post"])
+        per_day = dict(counts["days"])
+        for entry in mine:
+            per_day[entry["day"]] = per_day.get(entry["day"], 0) + 1
+
+        windows = sorted(parse_slot(spec) for spec in account["slots"])
+        today = datetime.now(tz).date()
+        for offset in range(SCHEDULER_HORIZON_DAYS):
+            day = today + timedelta(days=offset)
+            midnight = datetime(day.year, day.month, day.day, tzinfo=tz).timestamp()
+            for start, end in windows:
+                if per_day.get(day.isoformat(), 0) >= account["daily_quota"]:
+                    break
+                key = f"{day.isoformat()} {clock(start)}" + (f"-{clock(end)}" if end != start else "")
+                window_start = midnight + start * 60 - (jitter if start == end else 0)
+                window_end = midnight + end * 60 + (jitter if start == end else 0)
+                if key in slot_keys or window_end < now:
+                    continue
+                # Any time in the window that keeps min spacing from every other post of this account
+                low = max(window_start, now)
+                choices = [t for t in (random.uniform(low, window_end), low, window_end) if low <= t <= window_end]
+                run_at = next((t for t in choices if all(abs(t - other) >= spacing for other in taken)), None)
+                if run_at is None:
+                    continue
+                taken.append(run_at)
+                per_day[day.isoformat()] = per_day.get(day.isoformat(), 0) + 1
+                yield key, day.isoformat(), run_at
+
+    def replan(self, username=None):
+        """Drops planned (not yet running) posts for username, or everyone, and plans again."""
+        state = get_state()
+        with state.lock(PLAN_KEY, ttl=60, wait=30):
+            plan = [entry for entry in self._load_plan() if entry["status"] != "planned" or (username and entry["account"] != username)]
+            self._save_plan(plan)
+        return self.plan()
+
+    def plan(self, now=None):
+        """Tops the plan up: the oldest unposted images go into the earliest free slots of every enabled account."""
+        now = now or time.time()
+        state = get_state()
+        accounts = {name: account for name, account in self.accounts().items() if account.get("enabled", True)}
+        with state.lock(PLAN_KEY, ttl=60, wait=30):
+            plan = self._load_plan()
+
+            # Slots missed while nobody was running (or whose account is gone) go back to the backlog
+            missed = [e for e in plan if e["status"] == "planned" and (e["run_at"] < now - SCHEDULER_MISSED_GRACE or e["account"] not in accounts)]
+            for entry in missed:
+                entry.update(status="missed", finished_at=now)
+            # A worker that died mid-post leaves its entry in "posting"; the ledger decides whether it went out
+            stale = [e for e in plan if e["status"] == "posting" and e["started_at"] < now - RUNNER_LOCK_TTL]
+            for entry in stale:
+                entry.update(status="posted" if state.is_posted(ledger_key(rendition_path(entry))) else "failed", finished_at=now)
+            missed += stale
+            self._archive(missed)
+            # Cancelled slots are held until they pass
+            plan = [e for e in plan if e not in missed and not (e["status"] == "cancelled" and e["run_at"] < now)]
+
+            candidates = []
+            for username, account in accounts.items():
+                for key, day, run_at in self._slot_candidates(username, account, now, plan):
+                    candidates.append((run_at, username, key, day))
+            candidates.sort()
+
+            planned = {(entry["filename"], entry["rendition"]) for entry in plan if entry["status"] != "cancelled"}
+            backlogs = {}
+            added = 0
+            for run_at, username, key, day in candidates:
+                rendition = accounts[username]["rendition"]
+                backlog = backlogs.setdefault(rendition, iter_unposted(rendition))
+                filename = None
+                for candidate in backlog:
+                    if (candidate, rendition) not in planned:
+                        filename = candidate
+                        break
+                if filename is None:
+                    continue
+                planned.add((filename, rendition))
+                plan.append({
+                    "id": uuid.uuid4().hex[:12],
+                    "account": username,
+                    "filename": filename,
+                    "rendition": rendition,
+                    "slot": key,
+                    "day": day,
+                    "run_at": run_at,
+                    "status": "planned"
+                })
+                added += 1
+            self._save_plan(plan)
+        if added:
+            logger.info(f"Scheduled {added} posts")
+        return plan
+
+    def update_entry(self, entry_id, run_at=None, filename=None, cancel=False):
+        """Moves a planned post (run_at is ISO 8601, in the account's timezone unless it has an offset), swaps its image, or cancels it."""
+        state = get_state()
+        with state.lock(PLAN_KEY, ttl=60, wait=30):
+            plan = self._load_plan()
+            entry = next((e for e in plan if e["id"] == entry_id), None)
+            if entry is None:
+                raise SchedulerError(f"No planned post: {entry_id}", 404)
+            if entry["status"] != "planned":
+                raise SchedulerError(f"Post is already {entry['status']}", 409)
+            if cancel:
+                # The slot stays empty; the image goes back to the backlog for a later slot
+                entry.update(status="cancelled", finished_at=time.time())
+                self._archive([entry])
+                self._save_plan(plan)
+                return entry
+            if filename:
+                if not get_storage("pics").exists(rendition_path(dict(entry, filename=filename))):
+                    raise SchedulerError(f"Image not found: {filename} ({entry['rendition']})", 404)
+                if any(e["filename"] == filename and e["rendition"] == entry["rendition"] and e["status"] != "cancelled" for e in plan if e is not entry):
+                    raise SchedulerError(f"{filename} is already scheduled", 409)
+                entry["filename"] = filename
+            if run_at is not None:
+                tz = self._tz(self.accounts().get(entry["account"], {}))
+                try:
+                    when = datetime.fromisoformat(run_at)
+                except ValueError:
+                    raise SchedulerError(f"Invalid run_at: {run_at} (expected an ISO 8601 time)")
+                when = when if when.tzinfo else when.replace(tzinfo=tz)
+                entry["run_at"] = when.timestamp()
+                entry["slot"] = f"manual {entry['id']}"
+                entry["day"] = when.astimezone(tz).date().isoformat()
+            self._save_plan(plan)
+        return entry
+
+    # Running
+    async def run_due(self, post, now=None):
+        """Posts every due entry through post(params); only one worker at a time. Returns the finished entries."""
+        import asyncio
+
+        state = get_state()
+        token = await asyncio.to_thread(state.acquire_lock, RUNNER_LOCK, RUNNER_LOCK_TTL)
+        if token is None:
+            return []
+        finished = []
+        try:
+            await asyncio.to_thread(self.plan, now)
+            now = now or time.time()
+            accounts = await asyncio.to_thread(self.accounts)
+            plan = await asyncio.to_thread(self._load_plan)
+            for entry in [e for e in plan if e["status"] == "planned" and e["run_at"] <= now]:
+                started = await asyncio.to_thread(self._start, entry, accounts.get(entry["account"]), now)
+                if started is None:
+                    continue
+                if started["status"] != "posting":
+                    finished.append(started)
+                    continue
+
+                entry = started
+                try:
+                    result = await post({"filename": entry["filename"], "rendition": entry["rendition"], "username": entry["account"]})
+                except Exception as e:
+                    result = {"success": False, "error": str(e)}
+                if result.get("success"):
+                    status = "posted"
+                elif result.get("locked") or "already been posted" in (result.get("error") or ""):
+                    status = "skipped"
+                else:
+                    status = "failed"
+                finished.append(await asyncio.to_thread(self._finish, entry["id"], status, result))
+                logger.info(f"Scheduled post {entry['id']} of {entry['filename']} as {entry['account']}: {status}")
+        finally:
+            await asyncio.to_thread(state.release_lock, RUNNER_LOCK, token)
+            self.last_tick = time.time()
+        return finished
+
+    def _start(self, entry, account, now):
+        """Marks a due entry as posting and returns it as it now stands, or returns it finished as skipped; None if it has to wait or changed since the plan was read."""
+        if account is None:
+            return None
+        counts = self._counts(entry["account"], self._tz(account))
+        spacing = account["min_spacing_minutes"] * 60
+        state = get_state()
+        with state.lock(PLAN_KEY, ttl=60, wait=30):
+            plan = self._load_plan()
+            # Earlier posts of this tick take a while; the entry may have been cancelled, moved or swapped meanwhile
+            entry = next((e for e in plan if e["id"] == entry["id"]), None)
+            if entry is None or entry["status"] != "planned" or entry["run_at"] > now:
+                return None
+            if counts["last_post"] and now - counts["last_post"] < spacing:
+                # Posted by hand meanwhile: keep the spacing
+                entry["run_at"] = counts["last_post"] + spacing
+                self._save_plan(plan)
+                return None
+            # The quota of the day the slot belongs to, even when it runs just after midnight
+            if counts["days"].get(entry["day"], 0) >= account["daily_quota"]:
+                return self._close(plan, entry, "skipped", {"error": "Daily quota reached"})
+            entry.update(status="posting", started_at=time.time())
+            self._save_plan(plan)
+            return dict(entry)
+
+    def _set_entry(self, entry_id, **changes):
+        state = get_state()
+        with state.lock(PLAN_KEY, ttl=60, wait=30):
+            plan = self._load_plan()
+            for entry in plan:
+                if entry["id"] == entry_id:
+                    entry.update(changes)
+            self._save_plan(plan)
+
+    def _finish(self, entry_id, status, result):
+        state = get_state()
+        with state.lock(PLAN_KEY, ttl=60, wait=30):
+            plan = self._load_plan()
+            return self._close(plan, next(e for e in plan if e["id"] == entry_id), status, result)
+
+    def _close(self, plan, entry, status, result):
+        """Moves entry from the plan into the history; the caller holds the plan lock."""
+        plan.remove(entry)
+        entry.update(status=status, finished_at=time.time(), result={key: result.get(key) for key in ("post_url", "media_id", "error") if result.get(key)})
+        self._save_plan(plan)
+        self._archive([entry])
+        return entry
+
+    # Views
+    def entry_view(self, entry, accounts=None):
+        """A plan entry with run_at as ISO 8601 in its account's timezone."""
+        account = (accounts if accounts is not None else self.accounts()).get(entry["account"], {})
+        return dict(entry, run_at=iso(entry["run_at"], self._tz(account)))
+
+    def describe(self, limit=50):
+        """The schedule as shown over REST and MCP: accounts, upcoming posts and recent history."""
+        accounts = self.accounts()
+        plan = self._load_plan()
+        default_tz = ZoneInfo(SCHEDULER_TIMEZONE)
+        view = lambda entry: self.entry_view(entry, accounts)
+
+        return {
+            "enabled": SCHEDULER_ENABLED,
+            "last_tick": iso(self.last_tick, default_tz) if self.last_tick else None,
+            "horizon_days": SCHEDULER_HORIZON_DAYS,
+            "accounts": accounts,
+            "planned_count": sum(entry["status"] == "planned" for entry in plan),
+            "plan": [view(entry) for entry in plan[:limit]],
+            "history": get_state().get_value(HISTORY_KEY, [])[-limit:]
+        }
+
+
+scheduler = PostScheduler()
@@ -0,0 +1,45 @@
+import os, json, logging
+from typing import Any, Optional
+from fastapi.responses import JSONResponse, ORJSONResponse, Response
+
+try:
+    import orjson
+except ImportError:  # fall back to the stdlib encoder
+    orjson = None
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s - %(message)s')
+
+
+# Serialize responses with orjson and skip FastAPI's jsonable_encoder pass for handler results
+FAST_JSON = os.getenv("FAST_JSON", "true").lower() in ("1", "true", "yes") and orjson is not None
+
+JSONResponseClass = ORJSONResponse if FAST_JSON else JSONResponse
+
+
+def dumps(obj: Any, indent: bool = False) -> bytes:
+    """Encodes obj as UTF-8 JSON bytes."""
+    if FAST_JSON:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    return json.dumps(obj, indent=2 if indent else None, ensure_ascii=False).encode("utf8")
+
+
+def json_response(content: Any, status_code: int = 200, headers: Optional[dict] = None) -> Response:
+    """Wraps an already JSON-compatible handler result (plain dicts, lists, strings and numbers) in a response.
+
+    Returning a Response bypasses FastAPI's jsonable_encoder walk over the
+    payload and any response_model validation, so routes using it declare
+    no response_model.
+    """
+    return JSONResponseClass(content, status_code=status_code, headers=headers)
+
+
+def mcp_response(request_id: Optional[str], result: Optional[dict] = None, error: Optional[dict] = None) -> Response:
+    """Encodes a JSON-RPC response in one pass, without building and re-validating an MCPResponse model."""
+    body = {"jsonrpc": "2.0", "id": request_id, "result": result, "error": error}
+    return Response(content=dumps(body), media_type="application/json")
+
+
+def mcp_text_result(result: Any) -> dict:
+    """Builds an MCP tools/call result carrying the handler result as compact JSON text."""
+    return {"content": [{"type": "text", "text": dumps(result).decode("utf8")}]}
@@ -0,0 +1,422 @@
+import os, json, time, uuid, sqlite3, logging, posixpath, threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s - %(message)s')
+
+
+# "sqlite" (one host, any number of workers), "redis" (several hosts) or "memory" (single process only)
+STATE_BACKEND = os.getenv("STATE_BACKEND", "sqlite").lower()
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", "state.db")
+STATE_REDIS_URL = os.getenv("STATE_REDIS_URL", "redis://localhost:6379/0")
+STATE_KEY_PREFIX = os.getenv("STATE_KEY_PREFIX", "gramgateway:")
+
+# Pre-existing single-process files, imported once into an empty store
+LEGACY_POSTED_LIST_FILE = "pics.txt"
+LEGACY_SESSION_FILE = "session.json"
+
+
+class LockNotAcquired(Exception):
+    """Raised when a distributed lock is held by someone else."""
+
+
+def normalize_ledger_key(key):
+    """Normalizes a posted-ledger key written on any platform: "pics\\a.jpg" and "./pics/a.jpg" both become "pics/a.jpg"."""
+    key = key.strip().replace("\\", "/")
+    return posixpath.normpath(key) if key else key
+
+
+def ledger_key(name, area="pics"):
+    """The posted-ledger key of a stored file; every reader and writer of the ledger goes through this."""
+    return normalize_ledger_key(f"{area}/{name}")
+
+
+class StateBackend(ABC):
+    """State shared by every worker and replica: Instagram sessions, the posted ledger, job queues, locks and small values."""
+
+    # Session store
+    @abstractmethod
+    def get_session(self, username):
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_session(self, username, settings):
+        raise NotImplementedError
+
+    # Posted ledger
+    @abstractmethod
+    def posted(self):
+        """Returns every posted key in the order they were posted."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def is_posted(self, key):
+        raise NotImplementedError
+
+    @abstractmethod
+    def mark_posted(self, key):
+        """Records key as posted; returns False if it already was."""
+        raise NotImplementedError
+
+    # Job/post queues
+    @abstractmethod
+    def enqueue(self, queue, payload):
+        raise NotImplementedError
+
+    @abstractmethod
+    def dequeue(self, queue):
+        """Atomically pops the oldest payload of queue, or returns None."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def queue_size(self, queue):
+        raise NotImplementedError
+
+    # Locks
+    @abstractmethod
+    def acquire_lock(self, name, ttl):
+        """Returns a token if the lock was taken, otherwise None. Locks expire after ttl seconds."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def release_lock(self, name, token):
+        raise NotImplementedError
+
+    # Small JSON values
+    @abstractmethod
+    def get_value(self, key, default=None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_value(self, key, value):
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_value(self, key):
+        raise NotImplementedError
+
+    @contextmanager
+    def lock(self, name, ttl=300, wait=0.0):
+        """Holds the named lock for the block, waiting up to wait seconds; raises LockNotAcquired otherwise."""
+        deadline = time.monotonic() + wait
+        token = self.acquire_lock(name, ttl)
+        while token is None and time.monotonic() < deadline:
+            time.sleep(0.05)
+            token = self.acquire_lock(name, ttl)
+        if token is None:
+            raise LockNotAcquired(f"Lock is held: {name}")
+        try:
+            yield token
+        finally:
+            self.release_lock(name, token)
+
+    def import_legacy_files(self):
+        """Seeds an empty store from pics.txt and session.json left by single-process deployments."""
+        posted = self.posted()
+        if not posted and os.path.exists(LEGACY_POSTED_LIST_FILE):
+            with open(LEGACY_POSTED_LIST_FILE, "r", encoding="utf8") as f:
+                for line in f.read().splitlines():
+                    if line.strip():
+                        self.mark_posted(normalize_ledger_key(line))
+            logger.info(f"Imported posted ledger from {LEGACY_POSTED_LIST_FILE}")
+        else:
+            # Stores seeded before keys were normalized may hold Windows-style "pics\\name" entries
+            for key in posted:
+                if normalize_ledger_key(key) != key and self.mark_posted(normalize_ledger_key(key)):
+                    logger.info(f"Normalized posted ledger key {key}")
+
+        username = os.getenv("IG_USERNAME")
+        if username and self.get_session(username) is None and os.path.exists(LEGACY_SESSION_FILE) and os.path.getsize(LEGACY_SESSION_FILE) > 0:
+            try:
+                with open(LEGACY_SESSION_FILE, "r", encoding="utf8") as f:
+                    self.save_session(username, json.load(f))
+                logger.info(f"Imported Instagram session from {LEGACY_SESSION_FILE}")
+            except ValueError as e:
+                logger.warning(f"Ignoring unreadable {LEGACY_SESSION_FILE}: {e}")
+
+
+class SQLiteStateBackend(StateBackend):
+    """State in a local SQLite database; safe across workers on one host thanks to SQLite's file locking."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (username TEXT PRIMARY KEY, settings TEXT NOT NULL, updated REAL NOT NULL);
+        CREATE TABLE IF NOT EXISTS posted (id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT UNIQUE NOT NULL, posted_at REAL NOT NULL);
+        CREATE TABLE IF NOT EXISTS queue (id INTEGER PRIMARY KEY AUTOINCREMENT, queue TEXT NOT NULL, payload TEXT NOT NULL, created REAL NOT NULL);
+        CREATE INDEX IF NOT EXISTS queue_by_name ON queue (queue, id);
+        CREATE TABLE IF NOT EXISTS locks (name TEXT PRIMARY KEY, token TEXT NOT NULL, expires REAL NOT NULL);
+        CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+    """
+
+    def __init__(self, path=STATE_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._conn().executescript(self.SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _write(self):
+        """Runs the block in an immediate (write-locked) transaction."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def get_session(self, username):
+        row = self._conn().execute("SELECT settings FROM sessions WHERE username = ?", (username,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_session(self, username, settings):
+        with self._write() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (username, settings, updated) VALUES (?, ?, ?)",
+                (username, json.dumps(settings), time.time())
+            )
+
+    def posted(self):
+        return [row[0] for row in self._conn().execute("SELECT key FROM posted ORDER BY id")]
+
+    def is_posted(self, key):
+        return self._conn().execute("SELECT 1 FROM posted WHERE key = ?", (key,)).fetchone() is not None
+
+    def mark_posted(self, key):
+        with self._write() as conn:
+            cursor = conn.execute("INSERT OR IGNORE INTO posted (key, posted_at) VALUES (?, ?)", (key, time.time()))
+            return cursor.rowcount == 1
+
+    def enqueue(self, queue, payload):
+        with self._write() as conn:
+            cursor = conn.execute(
+                "INSERT INTO queue (queue, payload, created) VALUES (?, ?, ?)",
+                (queue, json.dumps(payload), time.time())
+            )
+            return str(cursor.lastrowid)
+
+    def dequeue(self, queue):
+        with self._write() as conn:
+            row = conn.execute("SELECT id, payload FROM queue WHERE queue = ? ORDER BY id LIMIT 1", (queue,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("DELETE FROM queue WHERE id = ?", (row[0],))
+            return json.loads(row[1])
+
+    def queue_size(self, queue):
+        return self._conn().execute("SELECT COUNT(*) FROM queue WHERE queue = ?", (queue,)).fetchone()[0]
+
+    def acquire_lock(self, name, ttl):
+        token = uuid.uuid4().hex
+        now = time.time()
+        with self._write() as conn:
+            conn.execute("DELETE FROM locks WHERE name = ? AND expires <= ?", (name, now))
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO locks (name, token, expires) VALUES (?, ?, ?)",
+                (name, token, now + ttl)
+            )
+            return token if cursor.rowcount == 1 else None
+
+    def release_lock(self, name, token):
+        with self._write() as conn:
+            conn.execute("DELETE FROM locks WHERE name = ? AND token = ?", (name, token))
+
+    def get_value(self, key, default=None):
+        row = self._conn().execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_value(self, key, value):
+        with self._write() as conn:
+            conn.execute("INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+    def delete_value(self, key):
+        with self._write() as conn:
+            conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+
+
+class NetworkStateBackend(StateBackend):
+    """State in a network key-value store shared by several hosts.
+
+    The store only needs the small subset of the redis-py client API used below
+    (get/set/delete/sadd/sismember/rpush/lpop/lrange/llen), so a redis.Redis
+    created with decode_responses=True works as is and InMemoryStore stands in
+    for it in tests.
+    """
+
+    def __init__(self, store, prefix=STATE_KEY_PREFIX):
+        self.store = store
+        self.prefix = prefix
+
+    def _key(self, *parts):
+        return self.prefix + ":".join(parts)
+
+    def get_session(self, username):
+        raw = self.store.get(self._key("session", username))
+        return json.loads(raw) if raw else None
+
+    def save_session(self, username, settings):
+        self.store.set(self._key("session", username), json.dumps(settings))
+
+    def posted(self):
+        return list(self.store.lrange(self._key("posted", "order"), 0, -1))
+
+    def is_posted(self, key):
+        return bool(self.store.sismember(self._key("posted", "set"), key))
+
+    def mark_posted(self, key):
+        if not self.store.sadd(self._key("posted", "set"), key):
+            return False
+        self.store.rpush(self._key("posted", "order"), key)
+        return True
+
+    def enqueue(self, queue, payload):
+        job_id = uuid.uuid4().hex
+        self.store.rpush(self._key("queue", queue), json.dumps(dict(payload, _id=job_id)))
+        return job_id
+
+    def dequeue(self, queue):
+        raw = self.store.lpop(self._key("queue", queue))
+        if raw is None:
+            return None
+        payload = json.loads(raw)
+        payload.pop("_id", None)
+        return payload
+
+    def queue_size(self, queue):
+        return self.store.llen(self._key("queue", queue))
+
+    def acquire_lock(self, name, ttl):
+        token = uuid.uuid4().hex
+        if self.store.set(self._key("lock", name), token, nx=True, ex=max(1, int(ttl))):
+            return token
+        return None
+
+    def release_lock(self, name, token):
+        # Not atomic, but the TTL bounds the damage if the lock expired and was re-taken in between
+        key = self._key("lock", name)
+        if self.store.get(key) == token:
+            self.store.delete(key)
+
+    def get_value(self, key, default=None):
+        raw = self.store.get(self._key("kv", key))
+        return json.loads(raw) if raw is not None else default
+
+    def set_value(self, key, value):
+        self.store.set(self._key("kv", key), json.dumps(value))
+
+    def delete_value(self, key):
+        self.store.delete(self._key("kv", key))
+
+
+class InMemoryStore:
+    """Thread-safe in-process stand-in for the redis-py subset NetworkStateBackend uses."""
+
+    def __init__(self):
+        self._data = {}
+        self._expires = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key):
+        expires = self._expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return self._data.get(key)
+
+    def get(self, key):
+        with self._lock:
+            return self._live(key)
+
+    def set(self, key, value, nx=False, ex=None):
+        with self._lock:
+            if nx and self._live(key) is not None:
+                return None
+            self._data[key] = value
+            if ex is not None:
+                self._expires[key] = time.monotonic() + ex
+            else:
+                self._expires.pop(key, None)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._expires.pop(key, None)
+            return 1 if self._data.pop(key, None) is not None else 0
+
+    def sadd(self, key, member):
+        with self._lock:
+            members = self._data.setdefault(key, set())
+            if member in members:
+                return 0
+            members.add(member)
+            return 1
+
+    def sismember(self, key, member):
+        with self._lock:
+            return member in self._data.get(key, set())
+
+    def rpush(self, key, value):
+        with self._lock:
+            items = self._data.setdefault(key, [])
+            items.append(value)
+            return len(items)
+
+    def lpop(self, key):
+        with self._lock:
+            items = self._data.get(key)
+            return items.pop(0) if items else None
+
+    def lrange(self, key, start, end):
+        with self._lock:
+            items = self._data.get(key, [])
+            return items[start:] if end == -1 else items[start:end + 1]
+
+    def llen(self, key):
+        with self._lock:
+            return len(self._data.get(key, []))
+
+
+def create_state_backend(kind=STATE_BACKEND):
+    """Builds the configured state backend."""
+    if kind == "sqlite":
+        return SQLiteStateBackend(STATE_DB_PATH)
+    if kind == "redis":
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("STATE_BACKEND=redis requires the redis package (pip install redis)")
+        return NetworkStateBackend(redis.Redis.from_url(STATE_REDIS_URL, decode_responses=True))
+    if kind == "memory":
+        return NetworkStateBackend(InMemoryStore())
+    raise ValueError(f"Unknown STATE_BACKEND: {kind}")
+
+
+_state = None
+_state_lock = threading.Lock()
+
+
+def get_state():
+    """Returns the process-wide state backend, creating it (and importing legacy files) on first use."""
+    global _state
+    if _state is None:
+        with _state_lock:
+            if _state is None:
+                state = create_state_backend()
+                state.import_legacy_files()
+                _state = state
+    return _state
+
+
+def set_state(state):
+    """Replaces the process-wide state backend, e.g. with a NetworkStateBackend(InMemoryStore()) in tests."""
+    global _state
+    _state = state
@@ -0,0 +1,590 @@
+"""Pluggable storage for pics/ and input_images/.
+
+Files are addressed by logical names such as "Sunset.jpg" or
+"renditions/Sunset/story.jpg". The default backend shards them on disk by
+name hash and keeps an append-only manifest (ordering, metadata and posted
+state) so listing never scans directories. The object backend keeps them in
+an S3-style object store; LocalObjectStore is a local stand-in for it.
+
+Migrate an existing flat directory into the configured backend with:
+
+    python -m src.storage migrate pics
+    python -m src.storage migrate input_images
+"""
+import os, sys, json, time, shutil, hashlib, logging, argparse, tempfile, threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-worker only, no cross-process manifest locking
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s - %(message)s')
+
+
+# "sharded" (local disk) or "object" (S3-compatible object store)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sharded").lower()
+STORAGE_BUCKET = os.getenv("STORAGE_BUCKET", "gramgateway")
+STORAGE_ENDPOINT_URL = os.getenv("STORAGE_ENDPOINT_URL")
+# Use the local object-store stand-in rooted at this directory instead of S3
+STORAGE_LOCAL_OBJECT_ROOT = os.getenv("STORAGE_LOCAL_OBJECT_ROOT")
+
+MANIFEST_FILE = "manifest.jsonl"
+POSTED_PREFIX = ".posted/"
+META_PREFIX = ".meta/"
+
+
+def validate_name(name):
+    """Rejects names that could escape the store."""
+    normalized = os.path.normpath(name).replace(os.sep, "/")
+    if not name or normalized != name or name.startswith(("/", "../")) or name == ".." or name.startswith("."):
+        raise ValueError(f"Invalid storage name: {name}")
+    return name
+
+
+class StorageBackend(ABC):
+    """A named collection of files with insertion order, small metadata and a posted flag."""
+
+    @abstractmethod
+    def exists(self, name):
+        raise NotImplementedError
+
+    @abstractmethod
+    def info(self, name):
+        """Returns {"name", "size", "created", "modified", "posted", "metadata"} or None."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def list(self, prefix=""):
+        """Returns info dicts for every name starting with prefix, oldest first."""
+        raise NotImplementedError
+
+    def unposted(self, match=None):
+        """Yields names of unposted files, oldest first, optionally filtered by match(name)."""
+        for entry in self.list():
+            if not entry["posted"] and (match is None or match(entry["name"])):
+                yield entry["name"]
+
+    def local_path(self, name):
+        """Returns a persistent local path for name if the backend has one, otherwise None."""
+        return None
+
+    @abstractmethod
+    def reserve(self, name):
+        """Atomically claims name for a later write; returns False if it is taken."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def release(self, name):
+        """Drops a reservation that was never written."""
+        raise NotImplementedError
+
+    @contextmanager
+    def writing(self, name, metadata=None):
+        """Yields a local path to write name to; it is committed when the block exits cleanly."""
+        fd, tmp_path = tempfile.mkstemp(suffix=os.path.splitext(name)[1], dir=self._tmp_dir())
+        os.close(fd)
+        try:
+            yield tmp_path
+            self.put_file(name, tmp_path, metadata)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @abstractmethod
+    def put_file(self, name, src_path, metadata=None):
+        """Moves a local file into the store as name."""
+        raise NotImplementedError
+
+    @abstractmethod
+    @contextmanager
+    def reading(self, name):
+        """Yields a local filesystem path holding name's bytes."""
+        raise NotImplementedError
+
+    def read_bytes(self, name):
+        with self.reading(name) as path:
+            with open(path, "rb") as f:
+                return f.read()
+
+    @abstractmethod
+    def delete(self, name):
+        raise NotImplementedError
+
+    @abstractmethod
+    def mark_posted(self, name):
+        raise NotImplementedError
+
+    def _tmp_dir(self):
+        return None
+
+
+class ShardedDiskStorage(StorageBackend):
+    """Files at <root>/<h0h1>/<h2h3>/<name> (h = sha1 of name) indexed by an append-only manifest.
+
+    Every worker keeps the manifest in memory and tails the file for lines
+    appended by other workers; appends are serialized with flock.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.manifest_path = os.path.join(root, MANIFEST_FILE)
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.RLock()
+        self._entries = {}
+        self._unposted = {}
+        self._inode = None
+        self._offset = 0
+
+    def path(self, name):
+        digest = hashlib.sha1(validate_name(name).encode("utf8")).hexdigest()
+        return os.path.join(self.root, digest[:2], digest[2:4], name)
+
+    def _tmp_dir(self):
+        tmp_dir = os.path.join(self.root, ".tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        return tmp_dir
+
+    # Manifest
+    def _apply(self, record):
+        name = record["name"]
+        op = record["op"]
+        if op == "put":
+            previous = self._entries.get(name)
+            self._entries[name] = {
+                "name": name,
+                "size": record["size"],
+                "created": previous["created"] if previous else record["time"],
+                "modified": record["time"],
+                "posted": previous["posted"] if previous else False,
+                "metadata": record.get("metadata") or {}
+            }
+            if not self._entries[name]["posted"]:
+                self._unposted.setdefault(name, None)
+        elif op == "delete":
+            self._entries.pop(name, None)
+            self._unposted.pop(name, None)
+        elif op == "posted":
+            if name in self._entries:
+                self._entries[name]["posted"] = True
+            self._unposted.pop(name, None)
+
+    def _refresh(self):
+        """Applies manifest lines appended since the last read (by this or any other worker)."""
+        try:
+            stat = os.stat(self.manifest_path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            if stat.st_ino != self._inode:
+                # First load, or another worker compacted the manifest
+                self._entries, self._unposted, self._offset, self._inode = {}, {}, 0, stat.st_ino
+            if stat.st_size <= self._offset:
+                return
+            with open(self.manifest_path, "rb") as f:
+                f.seek(self._offset)
+                data = f.read()
+            # Only consume complete lines; a concurrent append may still be in flight
+            end = data.rfind(b"\n") + 1
+            for line in data[:end].splitlines():
+                if line.strip():
+                    self._apply(json.loads(line))
+            self._offset += end
+
+    def _append(self, *records):
+        payload = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records).encode("utf8")
+        while True:
+            with open(self.manifest_path, "ab") as f:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    # A compaction may have replaced the file while we waited for the lock
+                    if os.fstat(f.fileno()).st_ino != os.stat(self.manifest_path).st_ino:
+                        continue
+                    f.write(payload)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    break
+                finally:
+                    if fcntl:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+        self._refresh()
+
+    def compact(self):
+        """Rewrites the manifest with one line per live file, dropping history."""
+        self._refresh()
+        with open(self.manifest_path, "ab") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._refresh()
+                tmp_path = self.manifest_path + ".compact"
+                with open(tmp_path, "w", encoding="utf8") as f:
+                    for entry in self._entries.values():
+                        f.write(json.dumps({"op": "put", "name": entry["name"], "size": entry["size"], "time": entry["created"], "metadata": entry["metadata"]}, ensure_ascii=False) + "\n")
+                        if entry["posted"]:
+                            f.write(json.dumps({"op": "posted", "name": entry["name"], "time": entry["modified"]}, ensure_ascii=False) + "\n")
+                os.replace(tmp_path, self.manifest_path)
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+        self._refresh()
+
+    # StorageBackend
+    def exists(self, name):
+        self._refresh()
+        return name in self._entries
+
+    def info(self, name):
+        self._refresh()
+        entry = self._entries.get(name)
+        return dict(entry) if entry else None
+
+    def list(self, prefix=""):
+        self._refresh()
+        with self._lock:
+            return [dict(entry) for name, entry in self._entries.items() if name.startswith(prefix)]
+
+    def unposted(self, match=None):
+        self._refresh()
+        with self._lock:
+            names = [name for name in self._unposted if match is None or match(name)]
+        yield from names
+
+    def local_path(self, name):
+        return self.path(name) if self.exists(name) else None
+
+    def reserve(self, name):
+        if self.exists(name):
+            return False
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        os.close(fd)
+        return True
+
+    def release(self, name):
+        path = self.path(name)
+        if not self.exists(name) and os.path.exists(path) and os.path.getsize(path) == 0:
+            os.remove(path)
+
+    def put_file(self, name, src_path, metadata=None):
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        size = os.path.getsize(src_path)
+        try:
+            os.replace(src_path, path)
+        except OSError:
+            # Different filesystem
+            shutil.move(src_path, path)
+        self._append({"op": "put", "name": name, "size": size, "time": time.time(), "metadata": metadata or {}})
+
+    @contextmanager
+    def reading(self, name):
+        if not self.exists(name):
+            raise FileNotFoundError(name)
+        yield self.path(name)
+
+    def delete(self, name):
+        if not self.exists(name):
+            return
+        path = self.path(name)
+        if os.path.exists(path):
+            os.remove(path)
+        self._append({"op": "delete", "name": name, "time": time.time()})
+
+    def mark_posted(self, name):
+        if self.exists(name):
+            self._append({"op": "posted", "name": name, "time": time.time()})
+
+
+class ObjectStorage(StorageBackend):
+    """Files as objects <prefix><name> in an S3-style store; metadata and posted flags are small side objects."""
+
+    def __init__(self, client, bucket, prefix=""):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def _key(self, name):
+        return self.prefix + validate_name(name)
+
+    def _meta(self, name):
+        try:
+            return json.loads(self.client.get_object(self.bucket, self.prefix + META_PREFIX + name))
+        except KeyError:
+            return None
+
+    def exists(self, name):
+        return self._meta(name) is not None
+
+    def info(self, name):
+        meta = self._meta(name)
+        if meta is None:
+            return None
+        meta["posted"] = self.client.head_object(self.bucket, self.prefix + POSTED_PREFIX + name) is not None
+        return meta
+
+    def list(self, prefix=""):
+        posted = {key[len(self.prefix + POSTED_PREFIX):] for key in self.client.list_objects(self.bucket, self.prefix + POSTED_PREFIX + prefix)}
+        entries = []
+        for key in self.client.list_objects(self.bucket, self.prefix + META_PREFIX + prefix):
+            meta = json.loads(self.client.get_object(self.bucket, key))
+            meta["posted"] = meta["name"] in posted
+            entries.append(meta)
+        entries.sort(key=lambda entry: entry["created"])
+        return entries
+
+    def reserve(self, name):
+        return self.client.put_object(self.bucket, self._key(name), b"", if_none_match="*")
+
+    def release(self, name):
+        if not self.exists(name):
+            self.client.delete_object(self.bucket, self._key(name))
+
+    def put_file(self, name, src_path, metadata=None):
+        with open(src_path, "rb") as f:
+            data = f.read()
+        os.remove(src_path)
+        now = time.time()
+        previous = self._meta(name)
+        self.client.put_object(self.bucket, self._key(name), data)
+        self.client.put_object(self.bucket, self.prefix + META_PREFIX + name, json.dumps({
+            "name": name,
+            "size": len(data),
+            "created": previous["created"] if previous else now,
+            "modified": now,
+            "metadata": metadata or {}
+        }).encode("utf8"))
+
+    @contextmanager
+    def reading(self, name):
+        try:
+            data = self.client.get_object(self.bucket, self._key(name))
+        except KeyError:
+            raise FileNotFoundError(name)
+        fd, tmp_path = tempfile.mkstemp(suffix=os.path.splitext(name)[1])
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            yield tmp_path
+        finally:
+            os.remove(tmp_path)
+
+    def delete(self, name):
+        for key in (self._key(name), self.prefix + META_PREFIX + name, self.prefix + POSTED_PREFIX + name):
+            self.client.delete_object(self.bucket, key)
+
+    def mark_posted(self, name):
+        self.client.put_object(self.bucket, self.prefix + POSTED_PREFIX + name, b"")
+
+
+class LocalObjectStore:
+    """Object-store client backed by a local directory, for tests and development.
+
+    Implements the same small API as S3ObjectStoreClient.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+
+    def _path(self, bucket, key):
+        return os.path.join(self.root, bucket, *key.split("/"))
+
+    def put_object(self, bucket, key, data, if_none_match=None):
+        path = self._path(bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._lock:
+            if if_none_match == "*" and os.path.exists(path):
+                return False
+            tmp_path = path + ".part"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return True
+
+    def get_object(self, bucket, key):
+        try:
+            with open(self._path(bucket, key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            raise KeyError(key)
+
+    def head_object(self, bucket, key):
+        try:
+            return {"size": os.path.getsize(self._path(bucket, key))}
+        except FileNotFoundError:
+            return None
+
+    def delete_object(self, bucket, key):
+        try:
+            os.remove(self._path(bucket, key))
+        except FileNotFoundError:
+            pass
+
+    def list_objects(self, bucket, prefix=""):
+        base = os.path.join(self.root, bucket)
+        keys = []
+        for root, _, files in os.walk(base):
+            for name in files:
+                if name.endswith(".part"):
+                    continue
+                key = os.path.relpath(os.path.join(root, name), base).replace(os.sep, "/")
+                if key.startswith(prefix):
+                    keys.append(key)
+        return sorted(keys)
+
+
+class S3ObjectStoreClient:
+    """Adapts a boto3 S3 client to the object-store API used by ObjectStorage."""
+
+    def __init__(self, endpoint_url=None):
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError("STORAGE_BACKEND=object requires boto3 (pip install boto3) or STORAGE_LOCAL_OBJECT_ROOT")
+        self.s3 = boto3.client("s3", endpoint_url=endpoint_url)
+
+    def put_object(self, bucket, key, data, if_none_match=None):
+        kwargs = {"IfNoneMatch": if_none_match} if if_none_match else {}
+        try:
+            self.s3.put_object(Bucket=bucket, Key=key, Body=data, **kwargs)
+        except self.s3.exceptions.ClientError as e:
+            if e.response.get("Error", {}).get("Code") == "PreconditionFailed":
+                return False
+            raise
+        return True
+
+    def get_object(self, bucket, key):
+        try:
+            return self.s3.get_object(Bucket=bucket, Key=key)["Body"].read()
+        except self.s3.exceptions.NoSuchKey:
+            raise KeyError(key)
+
+    def head_object(self, bucket, key):
+        try:
+            return {"size": self.s3.head_object(Bucket=bucket, Key=key)["ContentLength"]}
+        except self.s3.exceptions.ClientError:
+            return None
+
+    def delete_object(self, bucket, key):
+        self.s3.delete_object(Bucket=bucket, Key=key)
+
+    def list_objects(self, bucket, prefix=""):
+        keys = []
+        for page in self.s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+            keys.extend(item["Key"] for item in page.get("Contents", []))
+        return keys
+
+
+def create_storage(area, kind=STORAGE_BACKEND):
+    """Builds the configured backend for an area ("pics" or "input_images")."""
+    if kind == "sharded":
+        return ShardedDiskStorage(area)
+    if kind == "object":
+        client = LocalObjectStore(STORAGE_LOCAL_OBJECT_ROOT) if STORAGE_LOCAL_OBJECT_ROOT else S3ObjectStoreClient(STORAGE_ENDPOINT_URL)
+        return ObjectStorage(client, STORAGE_BUCKET, prefix=f"{area}/")
+    raise ValueError(f"Unknown STORAGE_BACKEND: {kind}")
+
+
+_storages = {}
+_storages_lock = threading.Lock()
+
+
+def get_storage(area):
+    """Returns the process-wide backend for an area."""
+    if area not in _storages:
+        with _storages_lock:
+            if area not in _storages:
+                _storages[area] = create_storage(area)
+    return _storages[area]
+
+
+def set_storage(area, storage):
+    """Replaces the backend for an area, e.g. with ObjectStorage(LocalObjectStore(tmp), "test") in tests."""
+    _storages[area] = storage
+
+
+def legacy_files(directory):
+    """Lists files written flat (pre-sharding) into directory as (name, path), oldest first."""
+    files = []
+    for root, dirs, names in os.walk(directory):
+        relative_root = os.path.relpath(root, directory)
+        if relative_root == ".":
+            # Skip shard directories and bookkeeping
+            dirs[:] = [d for d in dirs if not (len(d) == 2 and all(c in "0123456789abcdef" for c in d)) and not d.startswith(".")]
+        for name in names:
+            if relative_root == "." and (name == MANIFEST_FILE or name.startswith(".")):
+                continue
+            path = os.path.join(root, name)
+            logical = name if relative_root == "." else f"{relative_root.replace(os.sep, '/')}/{name}"
+            files.append((logical, path))
+    files.sort(key=lambda item: os.path.getmtime(item[1]))
+    return files
+
+
+def has_legacy_files(directory):
+    """Cheap check (top level only) for flat files that still need `python -m src.storage migrate`."""
+    if not os.path.isdir(directory):
+        return False
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name == MANIFEST_FILE or entry.name.startswith("."):
+                continue
+            if entry.is_file() or entry.name == "renditions":
+                return True
+    return False
+
+
+def migrate(directory, storage, posted_keys=()):
+    """Moves flat files from directory into storage, oldest first, carrying over posted state. Returns the count."""
+    from src.state import ledger_key, normalize_ledger_key
+
+    # Ledgers written on Windows hold "pics\\name" keys
+    posted_keys = {normalize_ledger_key(key) for key in posted_keys}
+    migrated = 0
+    for name, path in legacy_files(directory):
+        if storage.exists(name):
+            continue
+        mtime = os.path.getmtime(path)
+        storage.put_file(name, path, {"migrated_mtime": mtime})
+        if ledger_key(name, directory) in posted_keys:
+            storage.mark_posted(name)
+        migrated += 1
+    # Remove now-empty legacy folders such as renditions/<name>/
+    for root, _, _ in os.walk(directory, topdown=False):
+        if root != directory and not os.listdir(root):
+            os.rmdir(root)
+    return migrated
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Storage maintenance for pics/ and input_images/")
+    sub = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = sub.add_parser("migrate", help="move a flat directory into the configured storage backend")
+    migrate_parser.add_argument("area", choices=["pics", "input_images"])
+    compact_parser = sub.add_parser("compact", help="rewrite a sharded manifest without history")
+    compact_parser.add_argument("area", choices=["pics", "input_images"])
+    args = parser.parse_args(argv)
+
+    storage = get_storage(args.area)
+    if args.command == "migrate":
+        from src.state import get_state
+
+        count = migrate(args.area, storage, get_state().posted())
+        print(f"Migrated {count} files from {args.area}/ into the {STORAGE_BACKEND} backend")
+    elif args.command == "compact":
+        if not isinstance(storage, ShardedDiskStorage):
+            parser.error("compact only applies to STORAGE_BACKEND=sharded")
+        storage.compact()
+        print(f"Compacted {storage.manifest_path}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,411 @@
+"""Resumable, chunked uploads into input_images/, in the style of tus.
+
+A session is created with the final byte length, then chunks are PATCHed at
+explicit offsets. Chunks may arrive in any order, in parallel, and may be
+retried; each can carry an Upload-Checksum ("sha256 <base64 digest>") that is
+checked before the bytes are written. Received byte ranges are tracked in the
+shared state backend, so any worker can take the next chunk as long as the
+workers share UPLOAD_STAGING_DIR (one host, or a shared volume).
+
+Finalizing waits for chunk writes still in flight, checks that every byte
+arrived and then moves the staged file into input storage with a single
+rename. It can also put the image on the
+processing queue. The job is recorded on the session before it is queued and
+only marked done once it has been processed, so a job lost to a crashed worker
+is queued again by the sweeper. Sessions that see no activity for
+UPLOAD_EXPIRY seconds are swept, along with their staged bytes.
+"""
+import os, time, uuid, base64, hashlib, logging
+from contextlib import ExitStack, contextmanager
+
+from src.state import get_state, LockNotAcquired
+from src.storage import get_storage, validate_name
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s - %(message)s')
+
+
+UPLOAD_STAGING_DIR = os.getenv("UPLOAD_STAGING_DIR", os.path.join("input_images", ".uploads"))
+UPLOAD_MAX_SIZE = int(os.getenv("UPLOAD_MAX_SIZE", 200 * 1024 * 1024))
+UPLOAD_MAX_CHUNK = int(os.getenv("UPLOAD_MAX_CHUNK", 16 * 1024 * 1024))
+# Seconds without a chunk before a session and its staged bytes are dropped
+UPLOAD_EXPIRY = int(os.getenv("UPLOAD_EXPIRY", 24 * 3600))
+UPLOAD_SWEEP_INTERVAL = float(os.getenv("UPLOAD_SWEEP_INTERVAL", 600))
+# Seconds a processing job may stay queued or in flight before the sweeper assumes its worker died and queues it again
+UPLOAD_PROCESS_TIMEOUT = float(os.getenv("UPLOAD_PROCESS_TIMEOUT", 900))
+
+SESSION_PREFIX = "upload:session:"
+INDEX_KEY = "upload:index"
+PROCESS_QUEUE = "process"
+CHECKSUM_ALGORITHMS = ("sha256", "sha1", "md5")
+# A chunk write registered longer ago than this is assumed to have died with its worker
+WRITER_TTL = 60
+# How long finalize waits for chunk writes still in flight
+FINALIZE_WAIT = 10
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Status code tus uses for a chunk whose checksum doesn't match
+CHECKSUM_MISMATCH = 460
+
+
+class UploadError(Exception):
+    """A request the upload protocol can't accept; status_code is the HTTP status to answer with."""
+
+    def __init__(self, message, status_code=400, session=None, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.session = session
+        self.retry_after = retry_after
+
+
+def parse_checksum(header):
+    """Parses "<algorithm> <base64 digest>" into (algorithm, digest bytes)."""
+    algorithm, _, encoded = (header or "").strip().partition(" ")
+    algorithm = algorithm.lower()
+    if algorithm not in CHECKSUM_ALGORITHMS:
+        raise UploadError(f"Unsupported checksum algorithm: {algorithm or 'missing'} (supported: {', '.join(CHECKSUM_ALGORITHMS)})")
+    try:
+        return algorithm, base64.b64decode(encoded.strip(), validate=True)
+    except ValueError:
+        raise UploadError("Checksum digest must be base64")
+
+
+def merge_range(ranges, start, end):
+    """Adds [start, end) to a sorted list of disjoint [start, end) ranges."""
+    merged = []
+    for r_start, r_end in sorted(ranges + [[start, end]]):
+        if merged and r_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], r_end)
+        else:
+            merged.append([r_start, r_end])
+    return merged
+
+
+def contiguous_offset(ranges):
+    """Bytes received without a gap from the start: where a sequential client resumes."""
+    if ranges and ranges[0][0] == 0:
+        return ranges[0][1]
+    return 0
+
+
+def live_writers(session):
+    """Chunk writes in flight on a session, as {token: expiry}."""
+    now = time.time()
+    return {token: expires for token, expires in (session.get("writers") or {}).items() if expires > now}
+
+
+def missing_ranges(ranges, length):
+    missing = []
+    position = 0
+    for start, end in ranges:
+        if start > position:
+            missing.append([position, start])
+        position = max(position, end)
+    if position < length:
+        missing.append([position, length])
+    return missing
+
+
+class UploadManager:
+    """Upload sessions kept in the shared state backend, with bytes staged in UPLOAD_STAGING_DIR."""
+
+    def __init__(self, area="input_images", staging_dir=UPLOAD_STAGING_DIR):
+        self.area = area
+        self.staging_dir = staging_dir
+
+    def _part_path(self, upload_id):
+        return os.path.join(self.staging_dir, f"{upload_id}.part")
+
+    @contextmanager
+    def _lock(self, upload_id):
+        """Holds the session's lock; a session busy for too long answers 503 so the client retries."""
+        with ExitStack() as stack:
+            try:
+                stack.enter_context(get_state().lock(SESSION_PREFIX + upload_id, ttl=60, wait=10))
+            except LockNotAcquired:
+                raise UploadError("Upload is busy, retry shortly", 503, retry_after=1)
+            yield
+
+    def _save(self, session):
+        get_state().set_value(SESSION_PREFIX + session["id"], session)
+
+    def _update_index(self, update):
+        """Only called when a session is created or removed; expiry lives on the session itself."""
+        state = get_state()
+        with state.lock(INDEX_KEY, ttl=10, wait=5):
+            index = state.get_value(INDEX_KEY, {})
+            update(index)
+            state.set_value(INDEX_KEY, index)
+
+    def _touch(self, session):
+        session["expires"] = int(time.time()) + UPLOAD_EXPIRY
+
+    def get(self, upload_id):
+        """Returns the session, raising 404 for unknown or expired ones."""
+        session = get_state().get_value(SESSION_PREFIX + upload_id)
+        if session is None or session["expires"] < time.time():
+            raise UploadError("Upload not found", 404)
+        return session
+
+    def create(self, filename, length, content_type, checksum=None):
+        """Starts a session for a file of length bytes and preallocates its staging file."""
+        validate_name(filename)
+        if "/" in filename:
+            raise UploadError("Filename must not contain '/'")
+        if not content_type.startswith("image/"):
+            raise UploadError("File must be an image")
+        if length <= 0 or length > UPLOAD_MAX_SIZE:
+            raise UploadError(f"Upload length must be between 1 and {UPLOAD_MAX_SIZE} bytes", 413)
+        if checksum:
+            parse_checksum(checksum)
+
+        session = {
+            "id": uuid.uuid4().hex,
+            "filename": filename,
+            "length": length,
+            "content_type": content_type,
+            "checksum": checksum,
+            "ranges": [],
+            "status": "uploading",
+            "created": int(time.time()),
+            "result": None,
+            "job": None,
+            "writers": {}
+        }
+        os.makedirs(self.staging_dir, exist_ok=True)
+        with open(self._part_path(session["id"]), "wb") as f:
+            f.truncate(length)
+        self._touch(session)
+        self._save(session)
+        self._update_index(lambda index: index.__setitem__(session["id"], session["created"]))
+        logger.info(f"Started upload {session['id']} for {filename} ({length} bytes)")
+        return session
+
+    def write_chunk(self, upload_id, offset, data, checksum=None):
+        """Writes data at offset; rewriting bytes that already arrived (a retried chunk) is harmless."""
+        session = self.get(upload_id)
+        if session["status"] != "uploading":
+            raise UploadError(f"Upload is {session['status']}", 409, session)
+        if len(data) > UPLOAD_MAX_CHUNK:
+            raise UploadError(f"Chunks may be at most {UPLOAD_MAX_CHUNK} bytes", 413)
+        if offset < 0 or offset + len(data) > session["length"]:
+            raise UploadError(f"Chunk [{offset}, {offset + len(data)}) is outside the upload's {session['length']} bytes", 409, session)
+        if checksum:
+            algorithm, expected = parse_checksum(checksum)
+            if hashlib.new(algorithm, data).digest() != expected:
+                raise UploadError("Chunk checksum mismatch", CHECKSUM_MISMATCH, session)
+
+        # Registered under the lock, so finalize waits for this write instead of racing it
+        token = uuid.uuid4().hex
+        with self._lock(upload_id):
+            session = self.get(upload_id)
+            if session["status"] != "uploading":
+                raise UploadError(f"Upload is {session['status']}", 409, session)
+            session["writers"] = dict(live_writers(session), **{token: time.time() + WRITER_TTL})
+            self._save(session)
+
+        written = False
+        try:
+            # Disjoint (or identical, when retried) chunks write in parallel, each through its own handle
+            with open(self._part_path(upload_id), "r+b") as f:
+                f.seek(offset)
+                f.write(data)
+            written = True
+        except FileNotFoundError:
+            # Cancelled or swept meanwhile
+            raise UploadError("Upload not found", 404)
+        finally:
+            with self._lock(upload_id):
+                try:
+                    session = self.get(upload_id)
+                except UploadError:
+                    session = None
+                if session is not None:
+                    (session.get("writers") or {}).pop(token, None)
+                    if written:
+                        session["ranges"] = merge_range(session["ranges"], offset, offset + len(data))
+                        self._touch(session)
+                    self._save(session)
+        if session is None:
+            raise UploadError("Upload not found", 404)
+        return session
+
+    def finalize(self, upload_id):
+        """Checks the upload is complete and intact, then atomically moves it into input storage."""
+        deadline = time.monotonic() + FINALIZE_WAIT
+        while True:
+            with self._lock(upload_id):
+                session = self.get(upload_id)
+                if session["status"] != "uploading":
+                    raise UploadError(f"Upload is {session['status']}", 409, session)
+                # Chunks still being written may complete the upload; wait for them first
+                if not live_writers(session):
+                    missing = missing_ranges(session["ranges"], session["length"])
+                    if missing:
+                        raise UploadError(f"Upload is incomplete: {len(missing)} byte ranges missing", 409, session)
+                    session["status"] = "finalizing"
+                    session["writers"] = {}
+                    self._save(session)
+                    break
+            if time.monotonic() >= deadline:
+                raise UploadError("Chunks are still being written, retry shortly", 409, session, retry_after=1)
+            time.sleep(0.05)
+
+        part_path = self._part_path(upload_id)
+        try:
+            if session["checksum"]:
+                algorithm, expected = parse_checksum(session["checksum"])
+                digest = hashlib.new(algorithm)
+                with open(part_path, "rb") as f:
+                    for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                        digest.update(chunk)
+                if digest.digest() != expected:
+                    # Something passed chunk checks but the whole doesn't match: start the bytes over
+                    session.update(status="uploading", ranges=[])
+                    self._save(session)
+                    raise UploadError("Upload checksum mismatch; the file must be sent again", CHECKSUM_MISMATCH, session)
+
+            get_storage(self.area).put_file(session["filename"], part_path, {
+                "content_type": session["content_type"],
+                "upload_id": upload_id
+            })
+        except UploadError:
+            raise
+        except Exception:
+            session["status"] = "uploading"
+            self._save(session)
+            raise
+
+        session["status"] = "complete"
+        self._touch(session)
+        self._save(session)
+        logger.info(f"Finalized upload {upload_id}: {session['filename']}")
+        return session
+
+    def enqueue_processing(self, session, params):
+        """Records a processing job on the finalized session, then puts it on the shared processing queue."""
+        job = {"upload_id": session["id"], "params": dict(params, filename=session["filename"])}
+        with self._lock(session["id"]):
+            session = self.get(session["id"])
+            session["status"] = "queued"
+            self._queue_job(session, job)
+        return session
+
+    def _queue_job(self, session, job):
+        """Saves job on the session under a fresh id before queueing it; the caller holds the session's lock."""
+        job = dict(job, job_id=uuid.uuid4().hex)
+        session["job"] = {"id": job["job_id"], "params": job["params"], "since": time.time()}
+        self._touch(session)
+        self._save(session)
+        get_state().enqueue(PROCESS_QUEUE, job)
+
+    def claim(self, job):
+        """Marks a dequeued job as processing; False for a stale copy of a job that was queued again since."""
+        with self._lock(job["upload_id"]):
+            try:
+                session = self.get(job["upload_id"])
+            except UploadError:
+                return False
+            if session["status"] != "queued" or (session.get("job") or {}).get("id") != job.get("job_id"):
+                return False
+            session["status"] = "processing"
+            session["job"]["since"] = time.time()
+            self._touch(session)
+            self._save(session)
+            return True
+
+    def requeue(self, job):
+        """Puts a claimed job back on the queue, e.g. when processing is temporarily refused."""
+        with self._lock(job["upload_id"]):
+            try:
+                session = self.get(job["upload_id"])
+            except UploadError:
+                return None
+            if (session.get("job") or {}).get("id") != job.get("job_id"):
+                return None
+            session["status"] = "queued"
+            self._queue_job(session, job)
+            return session
+
+    def complete(self, job, result):
+        """Records a job's outcome, which acknowledges it; ignored if the job was queued again in the meantime."""
+        with self._lock(job["upload_id"]):
+            try:
+                session = self.get(job["upload_id"])
+            except UploadError:
+                return None
+            if (session.get("job") or {}).get("id") != job.get("job_id"):
+                return None
+            session["status"] = "processed" if result.get("success") else "failed"
+            session["result"] = result
+            session["job"] = None
+            self._touch(session)
+            self._save(session)
+            return session
+
+    def delete(self, upload_id):
+        """Cancels a session and drops its staged bytes."""
+        self.get(upload_id)
+        self._remove(upload_id)
+
+    def _remove(self, upload_id):
+        get_state().delete_value(SESSION_PREFIX + upload_id)
+        self._update_index(lambda index: index.pop(upload_id, None))
+        part_path = self._part_path(upload_id)
+        if os.path.exists(part_path):
+            os.remove(part_path)
+
+    def _requeue_stale(self, upload_id):
+        """Queues a session's job again if its worker seems to have died; True if it did."""
+        state = get_state()
+        with self._lock(upload_id):
+            session = state.get_value(SESSION_PREFIX + upload_id)
+            if not session or not session.get("job") or session["status"] not in ("queued", "processing"):
+                return False
+            if session["job"]["since"] + UPLOAD_PROCESS_TIMEOUT > time.time():
+                return False
+            # A queued job may just be waiting behind others; it is only lost once the queue has drained
+            if session["status"] == "queued" and state.queue_size(PROCESS_QUEUE):
+                return False
+            session["status"] = "queued"
+            self._queue_job(session, {"upload_id": upload_id, "params": session["job"]["params"]})
+            return True
+
+    def sweep(self):
+        """Drops sessions (and staged bytes) past their expiry and queues lost processing jobs again; returns how many sessions were dropped."""
+        now = time.time()
+        expired, requeued = [], 0
+        for upload_id in list(get_state().get_value(INDEX_KEY, {})):
+            session = get_state().get_value(SESSION_PREFIX + upload_id)
+            if session is None or session["expires"] < now:
+                expired.append(upload_id)
+                continue
+            try:
+                requeued += self._requeue_stale(upload_id)
+            except UploadError:
+                continue
+        for upload_id in expired:
+            self._remove(upload_id)
+        if expired:
+            logger.info(f"Expired {len(expired)} upload sessions")
+        if requeued:
+            logger.warning(f"Queued {requeued} stalled processing jobs again")
+        return len(expired)
+
+    def describe(self, session):
+        """Public view of a session: progress, the ranges still missing and any processing result."""
+        received = sum(end - start for start, end in session["ranges"])
+        return {
+            "upload_id": session["id"],
+            "filename": session["filename"],
+            "length": session["length"],
+            "received": received,
+            "offset": contiguous_offset(session["ranges"]),
+            "missing": missing_ranges(session["ranges"], session["length"]),
+            "status": session["status"],
+            "expires_at": session["expires"],
+            "result": session["result"]
+        }
+
+
+upload_manager = UploadManager()
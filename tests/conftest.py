@@ -0,0 +1,20 @@
+import pytest
+
+from src import state, storage
+
+
+@pytest.fixture(autouse=True)
+def memory_state(monkeypatch):
+    """Every test gets its own in-process state backend."""
+    backend = state.NetworkStateBackend(state.InMemoryStore())
+    monkeypatch.setattr(state, "_state", backend)
+    return backend
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Runs the test in an empty directory with fresh pics/ and input_images/ storage."""
+    monkeypatch.chdir(tmp_path)
+    for area in ("pics", "input_images"):
+        monkeypatch.setitem(storage._storages, area, storage.ShardedDiskStorage(str(tmp_path / area)))
+    return tmp_path
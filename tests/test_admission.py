@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+from PIL import Image
+
+from src import admission
+from src.admission import AdmissionRejected, PixelBudget, estimate_footprint
+
+
+def write_image(path, width, height):
+    Image.new("RGB", (width, height)).save(path, format="PNG")
+    return str(path)
+
+
+def test_estimate_footprint_counts_working_copies_and_renditions(tmp_path):
+    path = write_image(tmp_path / "a.png", 100, 50)
+    width, height, cost = estimate_footprint(path, renditions=2)
+    assert (width, height) == (100, 50)
+    assert cost == 100 * 50 * admission.BYTES_PER_PIXEL * admission.WORKING_COPIES + admission.CANVAS_OVERHEAD_BYTES * 2
+
+
+@pytest.mark.filterwarnings("ignore::PIL.Image.DecompressionBombWarning")
+def test_estimate_footprint_rejects_images_above_the_pixel_limit(tmp_path, monkeypatch):
+    # estimate_footprint sets Pillow's own limit too
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", Image.MAX_IMAGE_PIXELS)
+    path = write_image(tmp_path / "a.png", 100, 50)
+    monkeypatch.setattr(admission, "MAX_IMAGE_PIXELS", 100 * 50)
+    assert estimate_footprint(path)[:2] == (100, 50)
+    monkeypatch.setattr(admission, "MAX_IMAGE_PIXELS", 100 * 50 - 1)
+    with pytest.raises(AdmissionRejected) as e:
+        estimate_footprint(path)
+    assert e.value.status_code == 413
+
+
+def test_oversized_job_waits_for_the_budget_and_runs_alone():
+    async def scenario():
+        budget = PixelBudget(capacity=100, max_waiting=4, timeout=5)
+        order = []
+        release_small = asyncio.Event()
+
+        async def job(name, cost, hold=None):
+            async with budget.admit(cost):
+                order.append((name, budget.in_use))
+                if hold is not None:
+                    await hold.wait()
+
+        first = asyncio.create_task(job("a", 60, release_small))
+        await asyncio.sleep(0)
+        big = asyncio.create_task(job("big", 500))
+        await asyncio.sleep(0)
+        # Fits next to "a", but must not overtake the oversized job queued before it
+        late = asyncio.create_task(job("c", 10))
+        await asyncio.sleep(0.01)
+        assert order == [("a", 60)]
+        release_small.set()
+        await asyncio.gather(first, big, late)
+        return budget, order
+
+    budget, order = asyncio.run(scenario())
+    assert order == [("a", 60), ("big", 100), ("c", 10)]
+    assert budget.stats()["oversized_jobs"] == 1
+    assert budget.in_use == 0 and budget.active == 0
+
+
+def test_rejects_when_too_many_jobs_are_waiting():
+    async def scenario():
+        budget = PixelBudget(capacity=100, max_waiting=1, timeout=5)
+        await budget.acquire(100)
+        waiter = asyncio.create_task(budget.acquire(50))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as e:
+            await budget.acquire(50)
+        await budget.release(100)
+        await waiter
+        return budget, e.value
+
+    budget, error = asyncio.run(scenario())
+    assert error.status_code == 429 and error.retry_after
+    assert budget.rejected == 1
+
+
+def test_times_out_waiting_for_budget():
+    async def scenario():
+        budget = PixelBudget(capacity=100, max_waiting=4, timeout=0.01)
+        await budget.acquire(80)
+        with pytest.raises(AdmissionRejected) as e:
+            await budget.acquire(40)
+        return budget, e.value
+
+    budget, error = asyncio.run(scenario())
+    assert error.status_code == 503
+    assert budget.waiting == 0 and budget.in_use == 80
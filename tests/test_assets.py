@@ -0,0 +1,94 @@
+import os
+
+import pytest
+
+from src import assets
+from src.assets import IMMUTABLE_CACHE_CONTROL, REVALIDATE_CACHE_CONTROL, AssetCache, negotiate_encoding, parse_accept_encoding
+
+CSS = b"body { color: #333; margin: 0 auto; }\n" * 100
+
+
+class Request:
+    def __init__(self, method="GET", **headers):
+        self.method = method
+        self.headers = {key.replace("_", "-"): value for key, value in headers.items()}
+
+
+@pytest.fixture
+def site(tmp_path):
+    (tmp_path / "static").mkdir()
+    (tmp_path / "static" / "styles.css").write_bytes(CSS)
+    (tmp_path / "static" / "tiny.css").write_bytes(b"p{}")
+    (tmp_path / "index.html").write_text('<link href="/static/styles.css"><script src="static/missing.js"></script>', encoding="utf8")
+    cache = AssetCache()
+    cache.add_directory("/static", str(tmp_path / "static"))
+    cache.add_file("/frontend", str(tmp_path / "index.html"), fingerprint_html=True)
+    return cache
+
+
+def test_parse_accept_encoding():
+    assert parse_accept_encoding("gzip;q=0.5, BR , identity;q=bad,") == {"gzip": 0.5, "br": 1.0, "identity": 0.0}
+    assert parse_accept_encoding(None) == {}
+
+
+def test_negotiation_prefers_the_smallest_accepted_variant(site):
+    asset = site.get("/static/styles.css")
+    assert set(asset.encodings) == {"identity", "gzip"} | ({"br"} if assets.brotli else set())
+    best = "br" if assets.brotli else "gzip"
+    assert negotiate_encoding(asset, "gzip, br") == best
+    assert negotiate_encoding(asset, "gzip, br;q=0") == "gzip"
+    assert negotiate_encoding(asset, "*") == best
+    assert negotiate_encoding(asset, "*, gzip;q=0, br;q=0") == "identity"
+    assert negotiate_encoding(asset, None) == "identity"
+    # Bodies below MIN_COMPRESS_SIZE are never compressed
+    assert negotiate_encoding(site.get("/static/tiny.css"), "gzip, br") == "identity"
+
+
+def test_response_sets_etag_per_encoding_and_answers_304(site):
+    asset = site.get("/static/styles.css")
+    gzipped = site.response(asset, Request(accept_encoding="gzip"))
+    plain = site.response(asset, Request())
+
+    assert gzipped.status_code == 200 and gzipped.headers["content-encoding"] == "gzip"
+    assert gzipped.body == asset.encodings["gzip"]
+    assert gzipped.headers["vary"] == "Accept-Encoding"
+    assert gzipped.headers["cache-control"] == REVALIDATE_CACHE_CONTROL
+    assert gzipped.headers["etag"] != plain.headers["etag"]
+
+    etag = gzipped.headers["etag"]
+    assert site.response(asset, Request(accept_encoding="gzip", if_none_match=f'"other", {etag}')).status_code == 304
+    # Proxies that re-encode turn ETags weak; If-None-Match uses weak comparison
+    assert site.response(asset, Request(accept_encoding="gzip", if_none_match=f"W/{etag}")).status_code == 304
+    assert site.response(asset, Request(if_none_match="*")).status_code == 304
+    # The gzip ETag does not validate the identity body
+    assert site.response(asset, Request(if_none_match=etag)).status_code == 200
+
+
+def test_head_and_immutable_responses(site):
+    asset = site.get("/static/styles.css")
+    response = site.response(asset, Request("HEAD"), immutable=True)
+    assert response.body == b""
+    assert response.headers["content-length"] == str(len(CSS))
+    assert response.headers["cache-control"] == IMMUTABLE_CACHE_CONTROL
+
+
+def test_html_references_are_fingerprinted(site):
+    html = site.get("/frontend").body.decode("utf8")
+    version = site.get("/static/styles.css").version
+    assert f'href="/static/styles.css?v={version}"' in html
+    # References to files the cache doesn't hold are left alone
+    assert 'src="static/missing.js"' in html
+    assert site.get("/frontend").media_type == "text/html; charset=utf-8"
+
+
+def test_changed_files_are_reloaded_when_enabled(site, tmp_path, monkeypatch):
+    path = tmp_path / "static" / "styles.css"
+    old = site.get("/static/styles.css")
+    path.write_bytes(CSS + b"a { color: red; }")
+    os.utime(path, (old.mtime + 10, old.mtime + 10))
+    assert site.get("/static/styles.css") is old
+
+    monkeypatch.setattr(assets, "STATIC_ASSET_RELOAD", True)
+    assert site.get("/static/styles.css").version != old.version
+    path.unlink()
+    assert site.get("/static/styles.css") is None
@@ -0,0 +1,71 @@
+import os
+
+import pytest
+
+from src.state import LEGACY_POSTED_LIST_FILE, ledger_key, normalize_ledger_key
+from src.storage import ShardedDiskStorage, migrate
+
+
+@pytest.mark.parametrize("key, expected", [
+    ("pics/a.jpg", "pics/a.jpg"),
+    ("pics\\a.jpg", "pics/a.jpg"),
+    ("pics\\renditions\\a\\story.jpg", "pics/renditions/a/story.jpg"),
+    ("pics//a.jpg", "pics/a.jpg"),
+    ("./pics/a.jpg", "pics/a.jpg"),
+])
+def test_normalize_ledger_key(key, expected):
+    assert normalize_ledger_key(key) == expected
+
+
+def test_ledger_key_matches_normalized_legacy_keys():
+    assert ledger_key("a.jpg") == "pics/a.jpg"
+    assert ledger_key("renditions/a/story.jpg") == normalize_ledger_key("pics\\renditions\\a\\story.jpg")
+    assert ledger_key("a.jpg", "input_images") == "input_images/a.jpg"
+
+
+def test_import_normalizes_legacy_posted_list(workdir, memory_state):
+    with open(LEGACY_POSTED_LIST_FILE, "w", encoding="utf8") as f:
+        f.write("pics\\a.jpg\npics/b.jpg\n\n")
+    memory_state.import_legacy_files()
+    assert memory_state.posted() == ["pics/a.jpg", "pics/b.jpg"]
+    assert memory_state.is_posted(ledger_key("a.jpg"))
+
+
+def test_import_normalizes_keys_already_in_the_store(workdir, memory_state):
+    memory_state.mark_posted("pics\\a.jpg")
+    memory_state.import_legacy_files()
+    assert memory_state.is_posted(ledger_key("a.jpg"))
+    # Importing again adds nothing
+    memory_state.import_legacy_files()
+    assert memory_state.posted() == ["pics\\a.jpg", "pics/a.jpg"]
+
+
+def test_migrate_carries_posted_state(workdir):
+    os.makedirs("pics/renditions/b")
+    for name in ("a.jpg", "b.jpg", "renditions/b/story.jpg"):
+        with open(os.path.join("pics", name), "wb") as f:
+            f.write(name.encode())
+    storage = ShardedDiskStorage(str(workdir / "pics"))
+
+    migrated = migrate("pics", storage, ["pics\\a.jpg", "pics\\renditions\\b\\story.jpg"])
+
+    assert migrated == 3
+    assert sorted(entry["name"] for entry in storage.list()) == ["a.jpg", "b.jpg", "renditions/b/story.jpg"]
+    assert list(storage.unposted()) == ["b.jpg"]
+    assert not os.path.exists("pics/a.jpg")
+    assert not os.path.exists("pics/renditions")
+    with storage.reading("a.jpg") as path, open(path, "rb") as f:
+        assert f.read() == b"a.jpg"
+
+
+def test_migrate_skips_names_already_stored(workdir):
+    os.makedirs("pics", exist_ok=True)
+    with open("pics/a.jpg", "wb") as f:
+        f.write(b"new")
+    storage = ShardedDiskStorage(str(workdir / "pics"))
+    with storage.writing("a.jpg") as path, open(path, "wb") as f:
+        f.write(b"old")
+
+    assert migrate("pics", storage) == 0
+    with storage.reading("a.jpg") as path, open(path, "rb") as f:
+        assert f.read() == b"old"
@@ -0,0 +1,141 @@
+import sys
+import types
+
+import pytest
+
+from src import prepared_post
+from src.prepared_post import PreparedPostMismatch, build_record, prepared_record, read_verified, upload_prepared, upload_ready
+from src.storage import get_storage
+
+DATA = b"\xff\xd8prepared jpeg bytes\xff\xd9"
+
+
+def entry(record, size=len(DATA)):
+    return {"name": "a.jpg", "size": size, "metadata": {"prepared": record}}
+
+
+def test_upload_ready_matches_instagram_limits():
+    assert upload_ready("feed", 1080, 1350)
+    assert upload_ready("feed", 1080, 1080)
+    assert not upload_ready("feed", 1080, 1351)
+    assert not upload_ready("feed", 1000, 1300)
+    assert upload_ready("story", 1080, 1920)
+    assert not upload_ready("story", 300, 533)
+    assert not upload_ready("reel_cover", 1080, 1920)
+
+
+def test_prepared_record_only_accepts_current_ready_records():
+    record = build_record("feed", "caption", 1080, 1350, DATA)
+    assert prepared_record(entry(record)) == record
+    assert prepared_record(entry(dict(record, version=record["version"] + 1))) is None
+    assert prepared_record(entry(build_record("reel_cover", "caption", 1080, 1920, DATA))) is None
+    # The file was replaced after rendering
+    assert prepared_record(entry(record, size=len(DATA) + 1)) is None
+    assert prepared_record({"name": "a.jpg", "size": 1, "metadata": {}}) is None
+    assert prepared_record(None) is None
+
+
+def test_read_verified_detects_changed_bytes(tmp_path):
+    path = tmp_path / "a.jpg"
+    path.write_bytes(DATA)
+    record = build_record("feed", "caption", 1080, 1350, DATA)
+    assert read_verified(str(path), record) == DATA
+    path.write_bytes(DATA[::-1])
+    with pytest.raises(PreparedPostMismatch):
+        read_verified(str(path), record)
+
+
+@pytest.fixture
+def fake_instagrapi(monkeypatch):
+    """Just the instagrapi modules upload_prepared imports."""
+    class PhotoConfigureError(Exception):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args)
+
+    package = types.ModuleType("instagrapi")
+    package.__version__ = "2.1.5"
+    package.config = types.SimpleNamespace(API_DOMAIN="i.instagram.com")
+    package.exceptions = types.SimpleNamespace(PhotoNotUpload=PhotoConfigureError, PhotoConfigureError=PhotoConfigureError, PhotoConfigureStoryError=PhotoConfigureError)
+    package.extractors = types.SimpleNamespace(extract_media_v1=lambda media: types.SimpleNamespace(**media))
+    monkeypatch.setitem(sys.modules, "instagrapi", package)
+    for name in ("config", "exceptions", "extractors"):
+        monkeypatch.setitem(sys.modules, f"instagrapi.{name}", getattr(package, name))
+    monkeypatch.setattr(prepared_post, "PREPARED_CONFIGURE_DELAY", 0)
+    monkeypatch.setattr(prepared_post, "PREPARED_CONFIGURE_RETRY_DELAY", 0)
+    prepared_post.rupload_supported.cache_clear()
+    yield package
+    prepared_post.rupload_supported.cache_clear()
+
+
+class Client:
+    """Records what upload_prepared sends; configure is accepted on the given attempt."""
+
+    def __init__(self, accept_on=1):
+        self.accept_on = accept_on
+        self.sent = []
+        self.configured = []
+        self.last_json = {}
+        self.last_response = None
+        self.private = types.SimpleNamespace(post=self._post)
+        self.username = "acct"
+
+    def _post(self, url, data, headers):
+        self.sent.append((url, data, headers))
+        return types.SimpleNamespace(status_code=200, text="")
+
+    def request_log(self, response):
+        pass
+
+    def photo_configure(self, upload_id, width, height, caption):
+        self.configured.append((upload_id, width, height, caption))
+        if len(self.configured) < self.accept_on:
+            return False
+        self.last_json = {"media": {"code": "ABC", "id": "1_2"}}
+        return True
+
+    photo_configure_to_story = photo_configure
+
+    def expose(self):
+        pass
+
+    def photo_upload(self, path, caption):
+        self.uploaded = (path, caption)
+        return types.SimpleNamespace(code="LEGACY", id="3_4")
+
+
+def test_upload_prepared_sends_the_stored_bytes_and_retries_configure(tmp_path, fake_instagrapi):
+    path = tmp_path / "a.jpg"
+    path.write_bytes(DATA)
+    client = Client(accept_on=3)
+
+    media = upload_prepared(client, str(path), build_record("feed", "caption", 1080, 1350, DATA), "caption")
+
+    assert media.code == "ABC"
+    [(url, data, headers)] = client.sent
+    assert url.startswith("https://i.instagram.com/rupload_igphoto/") and data == DATA
+    assert headers["X-Entity-Length"] == str(len(DATA))
+    assert [call[1:] for call in client.configured] == [(1080, 1350, "caption")] * 3
+
+
+def test_rupload_needs_a_supported_instagrapi(fake_instagrapi):
+    assert prepared_post.rupload_supported()
+    prepared_post.rupload_supported.cache_clear()
+    fake_instagrapi.__version__ = "9.9.9"
+    assert not prepared_post.rupload_supported()
+
+
+def test_post_falls_back_when_the_image_changed(workdir, fake_instagrapi, monkeypatch):
+    import main
+
+    record = build_record("feed", "Prepared caption", 1080, 1350, DATA)
+    with get_storage("pics").writing("a.jpg", {"prepared": record}) as path, open(path, "wb") as f:
+        # Same size, different bytes: passes the size check, fails the checksum
+        f.write(DATA[::-1])
+    client = Client()
+
+    result = main.post_image(client, "a.jpg", "feed", None)
+
+    assert result["success"] and result["media_id"] == "3_4"
+    assert client.sent == []
+    assert client.uploaded[1] == "Prepared caption"
+    assert list(get_storage("pics").unposted()) == []
@@ -0,0 +1,132 @@
+import asyncio
+
+import pytest
+from PIL import Image
+
+from src import result_cache as result_cache_module
+from src.result_cache import ENTRY_PREFIX, LEGACY_INDEX_KEY, ORDER_QUEUE, ResultCache, content_digest, reserve_output_name
+from src.storage import get_storage
+
+DIGEST = "0123456789abcdef" * 4
+
+
+def store(name, data=b"jpeg"):
+    with get_storage("pics").writing(name) as path, open(path, "wb") as f:
+        f.write(data)
+
+
+def result(name):
+    return {"success": True, "processed_filename": name, "renditions": {"feed": name}}
+
+
+def test_output_name_suffix_grows_until_free(workdir):
+    pics = get_storage("pics")
+    assert reserve_output_name(pics, "clean", DIGEST) == "clean.jpg"
+    assert reserve_output_name(pics, "clean", DIGEST) == f"clean__{DIGEST[:8]}.jpg"
+    assert reserve_output_name(pics, "clean", DIGEST) == f"clean__{DIGEST[:12]}.jpg"
+    # Finished outputs count as taken too
+    store("other.jpg")
+    assert reserve_output_name(pics, "other", DIGEST) == f"other__{DIGEST[:8]}.jpg"
+
+
+def test_output_name_gives_up_when_every_suffix_is_taken():
+    class Full:
+        def reserve(self, name):
+            return False
+
+    with pytest.raises(FileExistsError):
+        reserve_output_name(Full(), "clean", DIGEST)
+
+
+def test_hit_and_missing_output(workdir, memory_state):
+    cache = ResultCache()
+    store("a.jpg")
+    assert cache.get("d1") is None
+    cache.put("d1", result("a.jpg"))
+    assert cache.get("d1") == result("a.jpg")
+
+    get_storage("pics").delete("a.jpg")
+    assert cache.get("d1") is None
+    assert memory_state.get_value(ENTRY_PREFIX + "d1") is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_eviction_gives_recently_used_entries_a_second_chance(workdir, memory_state, monkeypatch):
+    monkeypatch.setattr(result_cache_module, "TOUCH_INTERVAL", -1)
+    cache = ResultCache(max_entries=2)
+    for name in ("a", "b", "c"):
+        store(f"{name}.jpg")
+    cache.put("a", result("a.jpg"))
+    cache.put("b", result("b.jpg"))
+    # "a" was used after it was queued, so "b" goes first
+    cache.get("a")
+    cache.put("c", result("c.jpg"))
+
+    assert memory_state.queue_size(ORDER_QUEUE) == 2
+    assert memory_state.get_value(ENTRY_PREFIX + "b") is None
+    assert cache.get("a") and cache.get("c")
+
+
+def test_prune_drops_entries_whose_images_are_gone(workdir, memory_state):
+    cache = ResultCache()
+    for name in ("a", "b"):
+        store(f"{name}.jpg")
+        cache.put(name, result(f"{name}.jpg"))
+    # Entries from the single-index layout are imported first
+    store("legacy.jpg")
+    memory_state.set_value(ENTRY_PREFIX + "legacy", {"result": result("legacy.jpg"), "outputs": ["legacy.jpg"], "created": 1, "last_used": 1})
+    memory_state.set_value(LEGACY_INDEX_KEY, {"legacy": 1})
+    get_storage("pics").delete("a.jpg")
+
+    assert cache.prune() == 1
+    assert memory_state.get_value(LEGACY_INDEX_KEY) is None
+    assert cache.stats()["entries"] == 2
+    assert cache.get("b") and cache.get("legacy")
+
+
+@pytest.fixture
+def processing(workdir):
+    import main
+
+    def add_input(name, color):
+        with get_storage("input_images").writing(name) as path:
+            Image.new("RGB", (400, 500), color).save(path, format="JPEG")
+
+    return main, add_input
+
+
+def test_concurrent_retries_share_one_render(processing, monkeypatch):
+    main, add_input = processing
+    monkeypatch.setattr(main, "RESULT_CACHE_ENABLED", True)
+    add_input("a.jpg", "red")
+    params = {"filename": "a.jpg", "custom_caption": "Sunset", "renditions": ["feed"]}
+
+    async def scenario():
+        return await asyncio.gather(main.process_single_image(params), main.process_single_image(params))
+
+    first, second = asyncio.run(scenario())
+    assert first["success"] and second["success"]
+    assert first["processed_filename"] == second["processed_filename"] == "Sunset.jpg"
+    assert bool(first.get("deduplicated")) != bool(second.get("deduplicated"))
+
+    # The same bytes again are served from the cache
+    add_input("b.jpg", "red")
+    again = asyncio.run(main.process_single_image(dict(params, filename="b.jpg")))
+    assert again["cached"] and again["processed_filename"] == "Sunset.jpg"
+
+
+def test_outputs_are_never_overwritten_without_the_cache(processing, monkeypatch, memory_state):
+    main, add_input = processing
+    monkeypatch.setattr(main, "RESULT_CACHE_ENABLED", False)
+    add_input("a.jpg", "red")
+    first = asyncio.run(main.process_single_image({"filename": "a.jpg", "custom_caption": "Sunset", "renditions": ["feed"]}))
+    get_storage("pics").mark_posted(first["processed_filename"])
+
+    add_input("b.jpg", "blue")
+    with get_storage("input_images").reading("b.jpg") as path:
+        digest = content_digest(path)
+    second = asyncio.run(main.process_single_image({"filename": "b.jpg", "custom_caption": "Sunset", "renditions": ["feed"]}))
+
+    assert first["processed_filename"] == "Sunset.jpg"
+    assert second["processed_filename"] == f"Sunset__{digest[:8]}.jpg"
+    assert list(get_storage("pics").unposted()) == [second["processed_filename"]]
@@ -0,0 +1,158 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from src import scheduler as scheduler_module
+from src.scheduler import ACCOUNT_DEFAULTS, ACCOUNTS_KEY, COUNTS_PREFIX, PLAN_KEY, PostScheduler, SchedulerError, parse_slot
+
+UTC = ZoneInfo("UTC")
+
+
+@pytest.fixture
+def scheduler(memory_state, monkeypatch):
+    scheduler = PostScheduler()
+    # Planning needs images in storage; these tests place entries by hand
+    monkeypatch.setattr(scheduler, "plan", lambda now=None: scheduler._load_plan())
+    return scheduler
+
+
+def add_account(state, username="acct", **settings):
+    account = dict(ACCOUNT_DEFAULTS, **dict({"timezone": "UTC", "jitter_minutes": 0}, **settings))
+    state.set_value(ACCOUNTS_KEY, {username: account})
+    return account
+
+
+def entry(entry_id, run_at, day=None, username="acct"):
+    return {
+        "id": entry_id,
+        "account": username,
+        "filename": f"{entry_id}.jpg",
+        "rendition": "feed",
+        "slot": f"slot {entry_id}",
+        "day": day or datetime.fromtimestamp(run_at, UTC).date().isoformat(),
+        "run_at": run_at,
+        "status": "planned"
+    }
+
+
+def run(scheduler, now):
+    posted = []
+
+    async def post(params):
+        posted.append(params["filename"])
+        scheduler.record_post(params["username"], now)
+        return {"success": True}
+
+    finished = asyncio.run(scheduler.run_due(post, now))
+    return {e["id"]: e["status"] for e in finished}, posted
+
+
+def test_parse_slot():
+    assert parse_slot("09:30") == (570, 570)
+    assert parse_slot("18:00-20:30") == (1080, 1230)
+    for spec in ("25:00", "20:00-18:00", "noon"):
+        with pytest.raises(SchedulerError):
+            parse_slot(spec)
+
+
+def test_quota_counts_against_the_entry_day(scheduler, memory_state):
+    add_account(memory_state, daily_quota=1, min_spacing_minutes=0)
+    now = time.time()
+    today = datetime.now(UTC).date()
+    yesterday = (today - timedelta(days=1)).isoformat()
+    memory_state.set_value(COUNTS_PREFIX + "acct", {"days": {today.isoformat(): 1}, "last_post": None})
+    # Yesterday's slot running late still has yesterday's quota left; today's is used up
+    memory_state.set_value(PLAN_KEY, [entry("late", now - 20, yesterday), entry("today", now - 10)])
+
+    statuses, posted = run(scheduler, now)
+
+    assert statuses == {"late": "posted", "today": "skipped"}
+    assert posted == ["late.jpg"]
+
+
+def test_spacing_defers_due_posts(scheduler, memory_state):
+    add_account(memory_state, daily_quota=5, min_spacing_minutes=60)
+    now = time.time()
+    memory_state.set_value(COUNTS_PREFIX + "acct", {"days": {}, "last_post": now - 600})
+    memory_state.set_value(PLAN_KEY, [entry("due", now - 10)])
+
+    statuses, posted = run(scheduler, now)
+
+    assert statuses == {} and posted == []
+    deferred = memory_state.get_value(PLAN_KEY)[0]
+    assert deferred["status"] == "planned"
+    assert deferred["run_at"] == pytest.approx(now - 600 + 3600)
+
+
+def test_slot_candidates_respect_quota_and_spacing(scheduler, memory_state, monkeypatch):
+    monkeypatch.setattr(scheduler_module, "SCHEDULER_HORIZON_DAYS", 2)
+    account = add_account(memory_state, slots=["09:00", "09:30", "12:00"], daily_quota=2, min_spacing_minutes=60)
+    midnight = datetime.combine(datetime.now(UTC).date(), datetime.min.time(), UTC).timestamp()
+
+    candidates = list(scheduler._slot_candidates("acct", account, midnight, []))
+
+    by_day = {}
+    for key, day, run_at in candidates:
+        by_day.setdefault(day, []).append(run_at)
+    assert len(by_day) == 2
+    for times in by_day.values():
+        # 09:30 is too close to 09:00, so each day gets 09:00 and 12:00
+        assert len(times) == 2
+        assert times[1] - times[0] == 3 * 3600
+
+
+def test_record_post_counts_by_day_in_the_account_timezone(scheduler, memory_state):
+    add_account(memory_state, timezone="Asia/Tokyo")
+    today = datetime.now(UTC).date()
+    # 20:00 UTC is already the next day in Tokyo
+    posted_at = datetime.combine(today, datetime.min.time(), UTC).timestamp() + 20 * 3600
+    scheduler.record_post("acct", posted_at)
+    counts = memory_state.get_value(COUNTS_PREFIX + "acct")
+    assert counts == {"days": {(today + timedelta(days=1)).isoformat(): 1}, "last_post": posted_at}
+
+
+def test_entries_changed_during_an_earlier_post_are_respected(scheduler, memory_state):
+    add_account(memory_state, daily_quota=5, min_spacing_minutes=0)
+    now = time.time()
+    memory_state.set_value(PLAN_KEY, [entry("a", now - 30), entry("b", now - 20), entry("c", now - 10)])
+    posted = []
+
+    async def post(params):
+        posted.append(params["filename"])
+        if params["filename"] == "a.jpg":
+            # Edited through the REST API while "a" is uploading
+            scheduler.update_entry("b", cancel=True)
+            plan = memory_state.get_value(PLAN_KEY)
+            for e in plan:
+                if e["id"] == "c":
+                    e["filename"] = "swapped.jpg"
+            memory_state.set_value(PLAN_KEY, plan)
+        return {"success": True}
+
+    finished = asyncio.run(scheduler.run_due(post, now))
+
+    assert posted == ["a.jpg", "swapped.jpg"]
+    assert [(e["id"], e["status"], e["filename"]) for e in finished] == [("a", "posted", "a.jpg"), ("c", "posted", "swapped.jpg")]
+
+
+def test_posts_made_outside_the_scheduler_count(scheduler, memory_state, workdir):
+    from src.poster import post_new_image
+    from src.storage import get_storage
+
+    add_account(memory_state)
+    with get_storage("pics").writing("a.jpg") as path, open(path, "wb") as f:
+        f.write(b"jpeg")
+
+    class Client:
+        username = "acct"
+        uploads = []
+
+        def photo_upload(self, path, caption):
+            self.uploads.append(path)
+
+    assert post_new_image(Client(), [])
+    counts = memory_state.get_value(COUNTS_PREFIX + "acct")
+    assert sum(counts["days"].values()) == 1 and counts["last_post"]
@@ -0,0 +1,36 @@
+import pytest
+from PIL import Image
+
+from src import process_image
+from src.storage import StorageBackend, get_storage
+
+
+def add_input(name, color):
+    with get_storage("input_images").writing(name) as path:
+        Image.new("RGB", (400, 500), color).save(path, format="JPEG")
+
+
+def test_process_input_images_goes_through_storage(workdir, monkeypatch):
+    monkeypatch.setattr(process_image, "generate_caption", lambda prompt: "Golden hour #sun")
+    add_input("a.jpg", "red")
+    add_input("b.png", "blue")
+    pics = get_storage("pics")
+    with pics.writing("Golden_hour.jpg") as path, open(path, "wb") as f:
+        f.write(b"already posted")
+    pics.mark_posted("Golden_hour.jpg")
+
+    process_image.process_input_images()
+
+    assert get_storage("input_images").list() == []
+    names = [name for name in pics.unposted()]
+    assert len(names) == 2 and all(name.startswith("Golden_hour__") for name in names)
+    assert pics.read_bytes("Golden_hour.jpg") == b"already posted"
+    with pics.reading(names[0]) as path, Image.open(path) as img:
+        assert img.format == "JPEG"
+    # Nothing is written next to the storage shards
+    assert not [p.name for p in (workdir / "pics").iterdir() if p.suffix == ".jpg"]
+
+
+def test_storage_backend_is_abstract():
+    with pytest.raises(TypeError):
+        StorageBackend()
@@ -0,0 +1,162 @@
+import os
+import base64
+import hashlib
+
+import pytest
+
+from src import uploads
+from src.storage import get_storage
+from src.uploads import PROCESS_QUEUE, SESSION_PREFIX, UploadError, UploadManager, contiguous_offset, merge_range, missing_ranges
+
+
+def checksum(data, algorithm="sha256"):
+    return f"{algorithm} {base64.b64encode(hashlib.new(algorithm, data).digest()).decode()}"
+
+
+@pytest.fixture
+def manager(workdir):
+    return UploadManager(staging_dir=str(workdir / "staging"))
+
+
+@pytest.fixture
+def data():
+    return os.urandom(3000)
+
+
+def test_range_bookkeeping():
+    ranges = merge_range([], 2000, 3000)
+    ranges = merge_range(ranges, 0, 1000)
+    assert ranges == [[0, 1000], [2000, 3000]]
+    assert contiguous_offset(ranges) == 1000
+    assert missing_ranges(ranges, 3000) == [[1000, 2000]]
+    ranges = merge_range(ranges, 1000, 2000)
+    assert ranges == [[0, 3000]]
+    assert missing_ranges(ranges, 3000) == []
+
+
+def test_chunks_resume_out_of_order_and_finalize(manager, data):
+    session = manager.create("a.jpg", len(data), "image/jpeg", checksum(data))
+    manager.write_chunk(session["id"], 2000, data[2000:], checksum(data[2000:]))
+    manager.write_chunk(session["id"], 0, data[:1000])
+    # A retried chunk is harmless
+    manager.write_chunk(session["id"], 0, data[:1000])
+
+    view = manager.describe(manager.get(session["id"]))
+    assert view["offset"] == 1000
+    assert view["received"] == 2000
+    assert view["missing"] == [[1000, 2000]]
+    with pytest.raises(UploadError) as e:
+        manager.finalize(session["id"])
+    assert e.value.status_code == 409
+
+    manager.write_chunk(session["id"], 1000, data[1000:2000])
+    assert manager.finalize(session["id"])["status"] == "complete"
+    with get_storage("input_images").reading("a.jpg") as path, open(path, "rb") as f:
+        assert f.read() == data
+
+
+def test_rejects_bad_chunks(manager, data):
+    session = manager.create("a.jpg", len(data), "image/jpeg")
+    with pytest.raises(UploadError) as e:
+        manager.write_chunk(session["id"], 0, data[:100], checksum(b"other"))
+    assert e.value.status_code == uploads.CHECKSUM_MISMATCH
+    with pytest.raises(UploadError) as e:
+        manager.write_chunk(session["id"], 2999, data[:2])
+    assert e.value.status_code == 409
+    assert manager.get(session["id"])["ranges"] == []
+
+
+def test_whole_file_checksum_mismatch_starts_over(manager, data):
+    session = manager.create("a.jpg", len(data), "image/jpeg", checksum(b"something else"))
+    manager.write_chunk(session["id"], 0, data)
+    with pytest.raises(UploadError) as e:
+        manager.finalize(session["id"])
+    assert e.value.status_code == uploads.CHECKSUM_MISMATCH
+    assert manager.get(session["id"])["ranges"] == []
+    assert not get_storage("input_images").exists("a.jpg")
+
+
+def test_busy_session_answers_503(manager, data, memory_state, monkeypatch):
+    session = manager.create("a.jpg", len(data), "image/jpeg")
+    real_lock = memory_state.lock
+    monkeypatch.setattr(memory_state, "lock", lambda name, ttl=300, wait=0.0: real_lock(name, ttl, 0))
+    with memory_state.lock(SESSION_PREFIX + session["id"]):
+        with pytest.raises(UploadError) as e:
+            manager.write_chunk(session["id"], 0, data[:10])
+    assert e.value.status_code == 503 and e.value.retry_after
+
+
+def test_sweep_drops_expired_sessions(manager, data, monkeypatch):
+    session = manager.create("a.jpg", len(data), "image/jpeg")
+    part_path = os.path.join(manager.staging_dir, f"{session['id']}.part")
+    assert manager.sweep() == 0
+    monkeypatch.setattr(uploads, "UPLOAD_EXPIRY", -1)
+    manager.write_chunk(session["id"], 0, data[:10])
+    assert manager.sweep() == 1
+    assert not os.path.exists(part_path)
+    with pytest.raises(UploadError):
+        manager.get(session["id"])
+
+
+def test_lost_processing_job_is_queued_again(manager, data, memory_state, monkeypatch):
+    session = manager.create("a.jpg", len(data), "image/jpeg")
+    manager.write_chunk(session["id"], 0, data)
+    session = manager.enqueue_processing(manager.finalize(session["id"]), {"watermark_text": "x"})
+
+    job = memory_state.dequeue(PROCESS_QUEUE)
+    assert job["params"]["filename"] == "a.jpg"
+    assert manager.claim(job)
+    # The worker dies here; nothing is requeued until the job goes stale
+    manager.sweep()
+    assert memory_state.queue_size(PROCESS_QUEUE) == 0
+    monkeypatch.setattr(uploads, "UPLOAD_PROCESS_TIMEOUT", -1)
+    manager.sweep()
+    assert manager.get(session["id"])["status"] == "queued"
+
+    retry = memory_state.dequeue(PROCESS_QUEUE)
+    assert retry["job_id"] != job["job_id"]
+    # The first worker's copy is stale and can no longer claim or complete the job
+    assert manager.complete(job, {"success": True}) is None
+    assert not manager.claim(job)
+    assert manager.claim(retry)
+    assert manager.complete(retry, {"success": True})["status"] == "processed"
+
+
+def test_finalize_waits_for_chunks_in_flight(manager, data, monkeypatch):
+    import builtins
+    import threading
+
+    session = manager.create("a.jpg", len(data), "image/jpeg")
+    manager.write_chunk(session["id"], 0, data[:2000])
+    started, resume = threading.Event(), threading.Event()
+
+    def slow_open(path, mode="r", *args, **kwargs):
+        if mode == "r+b":
+            started.set()
+            resume.wait(5)
+        return builtins.open(path, mode, *args, **kwargs)
+
+    monkeypatch.setattr(uploads, "open", slow_open, raising=False)
+    monkeypatch.setattr(uploads, "FINALIZE_WAIT", 0.1)
+    writer = threading.Thread(target=manager.write_chunk, args=(session["id"], 2000, data[2000:]))
+    writer.start()
+    assert started.wait(5)
+
+    with pytest.raises(UploadError) as e:
+        manager.finalize(session["id"])
+    assert e.value.status_code == 409 and e.value.retry_after
+    assert manager.get(session["id"])["status"] == "uploading"
+
+    resume.set()
+    writer.join(5)
+    assert manager.finalize(session["id"])["status"] == "complete"
+    with get_storage("input_images").reading("a.jpg") as path, open(path, "rb") as f:
+        assert f.read() == data
+
+
+def test_chunk_for_a_cancelled_upload_is_a_404(manager, data):
+    session = manager.create("a.jpg", len(data), "image/jpeg")
+    os.remove(os.path.join(manager.staging_dir, f"{session['id']}.part"))
+    with pytest.raises(UploadError) as e:
+        manager.write_chunk(session["id"], 0, data[:10])
+    assert e.value.status_code == 404